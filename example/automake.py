@@ -3,23 +3,50 @@
 # Author: Francois Boulogne
 # License:
 
+import argparse
+import logging
 import subprocess
-import os
 import time
 
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from libscifig import project, watcher
+from libscifig.detector import DATAFILE_EXTENSIONS
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # Only --poll
+    Observer = None
+    FileSystemEventHandler = object
+
+
+# Figure sources, and data files
+EXTENSIONS = ('.plt', '.tikz', '.tikzsnippet', '.tikzsnippet1',
+              '.tikzsnippet2', '.py', '.po') + DATAFILE_EXTENSIONS
+
+
+def build(changed=None):
+    subprocess.call("make pdf", shell=True)
 
 
 class ChangeHandler(FileSystemEventHandler):
     """React to modified source files."""
     def on_modified(self, event):
-        extensions = ('.plt', '.tikz', '.tikzsnippet')
-        if os.path.splitext(event.src_path)[-1].lower() in extensions:
-            subprocess.call("make pdf", shell=True)
+        if not event.is_directory and event.src_path.endswith(EXTENSIONS):
+            build()
+
+    on_created = on_modified
 
 
-def main():
+def main(poll=False):
+    if poll:
+        # Network filesystems do not send inotify events
+        proj = project.Project('.')
+        try:
+            watcher.PollingWatcher(proj.watched_paths).watch(build)
+        except KeyboardInterrupt:
+            pass
+        return
     handler = ChangeHandler()
     observer = Observer()
     observer.schedule(handler, 'src', recursive=True)
@@ -33,4 +60,16 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Build the pdf files '
+                                     'when the sources change')
+    parser.add_argument('--poll', action='store_true', default=False,
+                        help='Poll the sources instead of waiting for '
+                        'inotify events (NFS, SMB)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        default=False, help='Verbose mode')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose
+                        else logging.INFO)
+    if not args.poll and Observer is None:
+        parser.error('watchdog is needed, or use --poll')
+    main(poll=args.poll)
@@ -2,20 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import glob
+import json
 import os
 import os.path
 import shutil
+import sys
 import argparse
 
-from libscifig import detector, database
-
-
-def list_figdirs(src='src'):
-    """
-    Return the list of directories containing figures.
-    """
-    return glob.glob(os.path.join(src, '*'))
+from libscifig import (aiobuild, bundle, detector, distributed, metrics,
+                       project, server)
+from libscifig.task import LATEX_ENGINES, PNG_DEVICES
+from libscifig.toolchain import ToolNotFoundError
 
 
 def make_build_dir(build='build'):
@@ -42,20 +39,192 @@ def clean_up(path):
         shutil.rmtree(build)
 
 
-def main(workingdir, dest='/tmp', pdf_only=False):
-    make_build_dir(os.path.join(workingdir, 'build'))
-    tasks = []
-    for directory in list_figdirs(os.path.join(workingdir, 'src')):
-        tasks.extend(detector.detect_task(directory, workingdir))
-
-    db_path = os.path.join(workingdir, 'db.json')
-    with database.DataBase(db_path) as db:
-        for task in tasks:
-            if pdf_only:
-                task.make_pdf(db)
+def parse_tools(tools):
+    """
+    Parse NAME=PATH strings.
+
+    :returns: dict tool name -> filepath
+    """
+    paths = {}
+    for tool in tools or []:
+        name, sep, path = tool.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError('Expected NAME=PATH: %s' % tool)
+        paths[name] = path
+    return paths
+
+
+def parse_memory(size):
+    """
+    Parse a memory size like 512M or 4G, or auto (available memory).
+
+    :returns: bytes, None for auto if the available memory is unknown
+    """
+    if size == 'auto':
+        return aiobuild.available_memory()
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    factor = units.get(size[-1:].upper())
+    try:
+        if factor is None:
+            return int(size)
+        return int(float(size[:-1]) * factor)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Expected a size like 4G: %s' % size)
+
+
+def write_metrics(report=None, metrics_file=None, prometheus_file=None):
+    """
+    Write the metrics of the run, see :mod:`libscifig.metrics`.
+    """
+    if report is None:
+        report = metrics.snapshot()
+    if metrics_file:
+        metrics.write_json(metrics_file, report)
+    if prometheus_file:
+        metrics.write_prometheus(prometheus_file, report)
+
+
+def absolute(filepaths):
+    """
+    Return absolute filepaths, None if None.
+    """
+    if filepaths is None:
+        return None
+    return [os.path.abspath(filepath) for filepath in filepaths]
+
+
+def main(workingdir, dest='/tmp', pdf_only=False, engine='pdflatex',
+         scratch=None, workers=None, jobs=1, texfiles=None, tools=None,
+         png_dpi=(600,), png_device='png16m',
+         svg_precision=None, svgz=False, pdf_optimize=False, git=False,
+         metrics_file=None,
+         prometheus_file=None, markers=detector.FIGURE_MARKERS,
+         bundle_path=None, formats=None, bundle_fmt=None, memory=None,
+         worker_token=None):
+    """
+    Build the figures.
+
+    :returns: exit status, 1 if a figure failed or a tool is missing
+    """
+    if not workers and bundle_path is None:
+        # Let the build server do it, if any
+        options = project.build_options(engine=engine, scratch=scratch,
+                                        tools=tools, png_dpi=png_dpi,
+                                        png_device=png_device,
+                                        svg_precision=svg_precision,
+                                        svgz=svgz, pdf_optimize=pdf_optimize,
+                                        git=git, markers=markers)
+        request = {'command': 'build',
+                   'dest': os.path.abspath(dest),
+                   'pdf_only': pdf_only,
+                   'jobs': jobs,
+                   'options': options,
+                   'texfiles': absolute(texfiles)}
+        if memory is not None:
+            # Otherwise, the budget of the server
+            request['memory'] = memory
+        answer = server.request(workingdir, request)
+        if answer is not None:
+            if answer['status'] != 'ok':
+                logging.error('Build server: %s', answer['message'])
+                return 1
+            if answer['built']:
+                logging.info('Built by the server: %s',
+                             ', '.join(answer['built']))
             else:
-                task.make(db)
-            task.export(db, dst=dest)
+                logging.info('Nothing to do')
+            for name in answer['failed']:
+                logging.error('Build of %s failed', name)
+            write_metrics(answer['metrics'], metrics_file, prometheus_file)
+            return 1 if answer['failed'] else 0
+    make_build_dir(os.path.join(workingdir, 'build'))
+    try:
+        proj = project.Project(workingdir, engine=engine, scratch=scratch,
+                               tools=tools, png_dpi=png_dpi,
+                               png_device=png_device,
+                               svg_precision=svg_precision, svgz=svgz,
+                               pdf_optimize=pdf_optimize, git=git,
+                               markers=markers)
+        failed = proj.run(dest=dest, pdf_only=pdf_only, jobs=jobs,
+                          workers=workers, texfiles=texfiles,
+                          bundle_path=bundle_path, formats=formats,
+                          bundle_fmt=bundle_fmt, memory=memory,
+                          worker_token=worker_token)
+    except ToolNotFoundError as err:
+        logging.error('%s (see --tool)', err)
+        return 1
+    except bundle.BundleNameError as err:
+        logging.error('%s', err)
+        return 1
+    finally:
+        write_metrics(None, metrics_file, prometheus_file)
+    if failed:
+        logging.error('%i figures failed: %s', len(failed),
+                      ', '.join(task.get_name() for task in failed))
+        return 1
+    return 0
+
+
+def status(workingdir, pdf_only=False, engine='pdflatex', scratch=None,
+           texfiles=None, tools=None, png_dpi=(600,), png_device='png16m',
+           svg_precision=None, svgz=False, pdf_optimize=False, git=False,
+           markers=detector.FIGURE_MARKERS):
+    """
+    Print which figures must be built and why, in json.
+    """
+    options = project.build_options(engine=engine, scratch=scratch,
+                                    tools=tools,
+                                    png_dpi=png_dpi, png_device=png_device,
+                                    svg_precision=svg_precision, svgz=svgz,
+                                    pdf_optimize=pdf_optimize, git=git,
+                                    markers=markers)
+    answer = server.request(workingdir, {'command': 'status',
+                                         'pdf_only': pdf_only,
+                                         'options': options,
+                                         'texfiles': absolute(texfiles)})
+    if answer is not None and answer['status'] == 'ok':
+        report = answer['tasks']
+    else:
+        if answer is not None:
+            logging.warning('Build server: %s', answer['message'])
+        proj = project.Project(workingdir, engine=engine, tools=tools,
+                               png_dpi=png_dpi, png_device=png_device,
+                               svg_precision=svg_precision, svgz=svgz,
+                               pdf_optimize=pdf_optimize, git=git,
+                               markers=markers)
+        report = proj.status(pdf_only=pdf_only, texfiles=texfiles)
+    print(json.dumps(report, indent=2))
+
+
+def gc(workingdir, dest=None, dry_run=False,
+       markers=detector.FIGURE_MARKERS):
+    """
+    Remove the files and database entries of deleted figures.
+    """
+    proj = project.Project(workingdir, markers=markers)
+    result = proj.collect_garbage(dest=dest, dry_run=dry_run)
+    print(json.dumps(result, indent=2))
+
+
+def serve(workingdir, engine='pdflatex', scratch=None, jobs=1, tools=None,
+          png_dpi=(600,), png_device='png16m',
+          svg_precision=None, svgz=False, pdf_optimize=False, git=False,
+          markers=detector.FIGURE_MARKERS, memory=None):
+    """
+    Run a build server, see :mod:`libscifig.server`.
+    """
+    make_build_dir(os.path.join(workingdir, 'build'))
+    proj = project.Project(workingdir, engine=engine, scratch=scratch,
+                           tools=tools, png_dpi=png_dpi,
+                           png_device=png_device,
+                           svg_precision=svg_precision, svgz=svgz,
+                           pdf_optimize=pdf_optimize, git=git,
+                           markers=markers)
+    try:
+        server.serve(proj, jobs=jobs, memory=memory)
+    except RuntimeError as err:
+        logging.error('%s', err)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='', epilog='')
@@ -63,14 +232,131 @@ if __name__ == '__main__':
                         default=False, help='Clean')
     parser.add_argument('--pdf', action='store_true',
                         default=False, help='PDF only')
+    parser.add_argument('-e', '--engine', default='pdflatex',
+                        choices=sorted(LATEX_ENGINES),
+                        help='LaTeX engine (lualatex is used as a fallback '
+                        'when pdflatex runs out of memory)')
+    parser.add_argument('-s', '--scratch', metavar='DIR',
+                        default=None, help='Scratch directory for '
+                        'intermediate files (a local disk or a tmpfs)')
     parser.add_argument('-d', '--dest', metavar='DEST',
                         default='/tmp', help='destination')
     parser.add_argument('-w', '--workingdir', metavar='WORKINGDIR',
                         default='.', help='Working directory (where src/ '
                         'is and build/ will be written)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of external tools running at once')
+    parser.add_argument('--memory', metavar='SIZE', default=None,
+                        help='Memory budget of the external tools run with '
+                        '-j, estimated from their previous runs '
+                        '(ex: 4G, auto for the available memory)')
+    parser.add_argument('--workers', metavar='HOST:PORT', nargs='+',
+                        default=None, help='Build on remote workers '
+                        '(see serve-worker)')
+    parser.add_argument('--worker-token', metavar='TOKEN',
+                        default=os.environ.get('SCIFIG_WORKER_TOKEN'),
+                        help='Shared token of the workers '
+                        '(default: $SCIFIG_WORKER_TOKEN)')
+    parser.add_argument('--png-dpi', metavar='DPI', type=int, nargs='+',
+                        default=[600], help='Resolutions of the png files, '
+                        'the highest one is rasterized, the others are '
+                        'downscaled and exported in pngDPI/ '
+                        '(ex: --png-dpi 600 150 96)')
+    parser.add_argument('--png-device', default='png16m',
+                        choices=PNG_DEVICES, help='Ghostscript device '
+                        'of the png files')
+    parser.add_argument('--svg-precision', metavar='N', type=int,
+                        default=None, help='Optimize the svg files '
+                        '(merged glyphs, coordinates rounded to N '
+                        'decimals) and export them in svgmin/')
+    parser.add_argument('--svgz', action='store_true', default=False,
+                        help='Compress the optimized svg files, exported '
+                        'in svgz/ (3 decimals unless --svg-precision)')
+    parser.add_argument('--optimize-pdf', action='store_true', default=False,
+                        help='Optimize the pdf files with ghostscript '
+                        '(compressed streams, subset fonts, images '
+                        'embedded once), the other formats are made from '
+                        'the optimized pdf')
+    parser.add_argument('--git', action='store_true', default=False,
+                        help='Ask git which tracked sources changed, '
+                        'only untracked or modified files are hashed '
+                        'after a checkout')
+    parser.add_argument('--tool', metavar='NAME=PATH', action='append',
+                        default=None, help='Filepath of a tool, '
+                        'otherwise searched on the PATH '
+                        '(ex: --tool gs=/opt/gs/bin/gs)')
+    parser.add_argument('--marker', metavar='PATTERN', action='append',
+                        default=[], help='Files marking a figure directory, '
+                        'in addition to the figure sources and .figure '
+                        '(ex: --marker README.fig)')
+    parser.add_argument('--metrics', metavar='FILE', default=None,
+                        help='Write the metrics of the run (tasks, time '
+                        'per tool, bytes hashed and exported) in json')
+    parser.add_argument('--prometheus', metavar='FILE', default=None,
+                        help='Write the metrics of the run for the '
+                        'textfile collector of node_exporter (.prom)')
     parser.add_argument('--debug', action='store_true',
                         default=False, help='Run in debug mode')
 
+    subparsers = parser.add_subparsers(title='commands')
+
+    # scifig build
+    build_parser = subparsers.add_parser('build', help='Build and export '
+                                         'figures (default)')
+    build_parser.add_argument('--for', dest='texfiles', metavar='TEX',
+                              nargs='+', default=None,
+                              help='Only the figures included in these '
+                              'tex files')
+    build_parser.add_argument('--bundle', metavar='FILE', default=None,
+                              help='Write the built figures in a tar, '
+                              'tar.gz, tar.zst or zip file (- for stdout) '
+                              'with their sha256 hashes, instead of '
+                              'exporting them in DEST')
+    build_parser.add_argument('--bundle-format', default=None,
+                              choices=bundle.BUNDLE_FORMATS,
+                              help='Format of the bundle, guessed from its '
+                              'extension (tar for stdout)')
+    build_parser.add_argument('--formats', metavar='EXT', nargs='+',
+                              default=None, help='Formats to bundle '
+                              '(ex: pdf svg png150), all by default')
+    build_parser.set_defaults(action='build')
+
+    # scifig status
+    status_parser = subparsers.add_parser('status', help='Explain which '
+                                          'figures must be built, without '
+                                          'building them (json output)')
+    status_parser.add_argument('--for', dest='texfiles', metavar='TEX',
+                               nargs='+', default=None,
+                               help='Only the figures included in these '
+                               'tex files')
+    status_parser.set_defaults(action='status')
+
+    # scifig gc
+    gc_parser = subparsers.add_parser('gc', help='Remove build files and '
+                                      'database entries of deleted figures')
+    gc_parser.add_argument('--exports', action='store_true', default=False,
+                           help='Remove exported files too (see --dest)')
+    gc_parser.add_argument('-n', '--dry-run', action='store_true',
+                           default=False,
+                           help='Only report what would be removed')
+    gc_parser.set_defaults(action='gc')
+
+    # scifig serve
+    serve_parser = subparsers.add_parser('serve', help='Run a build server '
+                                         'keeping the state in memory, '
+                                         'used by the next invocations')
+    serve_parser.set_defaults(action='serve')
+
+    # scifig serve-worker
+    worker_parser = subparsers.add_parser('serve-worker',
+                                          help='Build tasks sent by a '
+                                          'coordinator (see --workers)')
+    worker_parser.add_argument('--host', default='127.0.0.1',
+                               help='Interface to listen on')
+    worker_parser.add_argument('--port', type=int, default=8642,
+                               help='Port to listen on')
+    worker_parser.set_defaults(action='serve-worker')
+
     args = parser.parse_args()
 
     from libscifig.collogging import formatter_message, ColoredFormatter
@@ -94,10 +380,73 @@ if __name__ == '__main__':
     steam_handler.setFormatter(color_formatter)
     logger.addHandler(steam_handler)
 
-    if args.clean:
+    action = getattr(args, 'action', None)
+    try:
+        tools = parse_tools(args.tool)
+    except argparse.ArgumentTypeError as err:
+        parser.error(str(err))
+    if (args.workers or action == 'serve-worker') and not args.worker_token:
+        parser.error('workers need a shared token, see --worker-token')
+    if args.workers:
+        workers = [distributed.parse_address(w) for w in args.workers]
+    else:
+        workers = None
+    markers = detector.FIGURE_MARKERS + tuple(args.marker)
+    memory = None
+    if args.memory is not None:
+        try:
+            memory = parse_memory(args.memory)
+        except argparse.ArgumentTypeError as err:
+            parser.error(str(err))
+    if args.svgz and args.svg_precision is None:
+        args.svg_precision = 3
+    bundle_path = getattr(args, 'bundle', None)
+    bundle_fmt = getattr(args, 'bundle_format', None)
+    if bundle_path is not None:
+        try:
+            if bundle_fmt is None and bundle_path != '-':
+                bundle_fmt = bundle.bundle_format(bundle_path)
+        except ValueError as err:
+            parser.error('%s (see --bundle-format)' % err)
+        if bundle_fmt == 'tar.zst' and bundle.zstandard is None:
+            parser.error('zstandard is needed to write tar.zst bundles')
+
+    if action == 'status':
+        status(args.workingdir, pdf_only=args.pdf, engine=args.engine,
+               scratch=args.scratch,
+               texfiles=args.texfiles, tools=tools, png_dpi=args.png_dpi,
+               png_device=args.png_device,
+               svg_precision=args.svg_precision, svgz=args.svgz,
+               pdf_optimize=args.optimize_pdf, git=args.git,
+               markers=markers)
+    elif action == 'gc':
+        gc(args.workingdir, dest=args.dest if args.exports else None,
+           dry_run=args.dry_run, markers=markers)
+    elif action == 'serve':
+        serve(args.workingdir, engine=args.engine, scratch=args.scratch,
+              jobs=args.jobs, tools=tools, png_dpi=args.png_dpi,
+              png_device=args.png_device,
+              svg_precision=args.svg_precision, svgz=args.svgz,
+              pdf_optimize=args.optimize_pdf, git=args.git,
+              markers=markers, memory=memory)
+    elif action == 'serve-worker':
+        distributed.serve_worker(args.host, args.port,
+                                 token=args.worker_token)
+    elif args.clean:
         logger.info('Cleaning...')
         clean_up(args.workingdir)
-    elif args.pdf:
-        main(args.workingdir, args.dest, pdf_only=True)
     else:
-        main(args.workingdir, args.dest, pdf_only=False)
+        code = main(args.workingdir, args.dest, pdf_only=args.pdf,
+                    engine=args.engine, scratch=args.scratch,
+                    workers=workers, jobs=args.jobs,
+                    texfiles=getattr(args, 'texfiles', None), tools=tools,
+                    png_dpi=args.png_dpi, png_device=args.png_device,
+                    svg_precision=args.svg_precision, svgz=args.svgz,
+                    pdf_optimize=args.optimize_pdf, git=args.git,
+                    metrics_file=args.metrics,
+                    prometheus_file=args.prometheus, markers=markers,
+                    bundle_path=bundle_path,
+                    formats=getattr(args, 'formats', None),
+                    bundle_fmt=bundle_fmt, memory=memory,
+                    worker_token=args.worker_token)
+        sys.exit(code)
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Build tasks concurrently with asyncio.
+
+The steps of a :class:`Task` are run in order, but external tools of
+different tasks run concurrently, up to a maximum number of jobs.
+Tasks sharing a build directory are built one after the other.
+
+On cancellation (Ctrl-C), running tools are killed and the products
+of unfinished tasks are removed, so that no half-written target remains.
+
+With a memory budget, a tool starts only if its estimated peak memory
+fits in what the running tools leave of the budget (see
+:class:`MemoryBudget`). Tools that do not fit wait, while smaller ones
+keep starting. The peak memory of each tool is read in /proc while it
+runs and recorded in the database for the next estimates.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import time
+
+from libscifig import metrics
+from libscifig.task import FunctionCommand, ScriptCommand
+
+# Estimate of a tool never run on a figure: a base amount
+# and an amount per byte of its input file.
+DEFAULT_MEMORY = 128 * 1024 * 1024
+MEMORY_PER_INPUT_BYTE = 64
+# Interval between two readings of the peak memory of a tool (s)
+PEAK_INTERVAL = 0.05
+
+
+def available_memory():
+    """
+    Return the memory available for new processes, read in /proc/meminfo.
+
+    :returns: bytes, None if unknown
+    """
+    try:
+        with open('/proc/meminfo') as fh:
+            for line in fh:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _memory_key(command):
+    """
+    Return the name under which the peak memory of a tool is recorded.
+
+    Ghostscript memory depends on the device and the resolution.
+    """
+    options = [arg for arg in command.args[1:]
+               if arg.startswith(('-sDEVICE=', '-r'))]
+    return ' '.join([command.tool] + options)
+
+
+def _input_size(command):
+    """
+    Return the size of the input file of a tool: its first argument
+    which is an existing file, except the output of -o.
+    """
+    args = iter(command.args[1:])
+    for arg in args:
+        if arg == '-o':
+            next(args, None)
+            continue
+        try:
+            return os.path.getsize(os.path.join(command.cwd, arg))
+        except OSError:
+            continue
+    return 0
+
+
+async def _peak_memory(process):
+    """
+    Read the peak memory (VmHWM) of a process until it exits.
+
+    :param process: `asyncio.subprocess.Process` instance
+    :returns: bytes, None if it could not be read
+    """
+    path = '/proc/%i/status' % process.pid
+    peak = None
+    while process.returncode is None:
+        try:
+            with open(path) as fh:
+                for line in fh:
+                    if line.startswith('VmHWM:'):
+                        peak = int(line.split()[1]) * 1024
+                        break
+        except (OSError, ValueError):
+            return peak
+        await asyncio.sleep(PEAK_INTERVAL)
+    return peak
+
+
+class MemoryBudget():
+    """
+    Admit the external tools while the sum of their estimated
+    peak memory fits in a budget.
+
+    The estimate of a tool is the peak recorded on the last build
+    of the figure, scaled up if its input grew, or a default based
+    on the input size. A tool larger than the budget runs alone.
+    Scripts run in the interpreters of :mod:`libscifig.pyrunner`,
+    whose memory is already allocated, and are not counted.
+
+    :param budget: memory budget (bytes)
+    :param db: `DataBase` instance keeping the peaks
+    """
+    def __init__(self, budget, db):
+        self.budget = budget
+        self.db = db
+        self.used = 0
+        self.running = 0
+        # (cost, future) of the tools waiting for memory
+        self.waiters = []
+
+    def estimate(self, task_id, command):
+        """
+        Estimate the peak memory of a tool.
+
+        :param task_id: ID of the task
+        :param command: `Command` instance
+        :returns: bytes
+        """
+        size = _input_size(command)
+        recorded = self.db.get(task_id, 'memory').get(_memory_key(command))
+        if recorded is None:
+            return DEFAULT_MEMORY + MEMORY_PER_INPUT_BYTE * size
+        peak, recorded_size = recorded
+        if recorded_size and size > recorded_size:
+            return int(peak * size / recorded_size)
+        return peak
+
+    def record(self, task_id, command, peak):
+        """
+        Record the peak memory of a tool.
+
+        :param task_id: ID of the task
+        :param command: `Command` instance
+        :param peak: bytes
+        """
+        peaks = self.db.get(task_id, 'memory')
+        peaks[_memory_key(command)] = [peak, _input_size(command)]
+        self.db.set(task_id, 'memory', peaks)
+
+    def _fits(self, cost):
+        return not self.running or self.used + cost <= self.budget
+
+    def _take(self, cost):
+        self.used += cost
+        self.running += 1
+
+    async def acquire(self, cost):
+        """
+        Wait until a tool fits in the budget.
+
+        :param cost: estimated peak memory of the tool (bytes)
+        """
+        if self._fits(cost):
+            self._take(cost)
+            return
+        logging.debug('Waiting for %i MB of memory', cost // 2**20)
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((cost, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted meanwhile
+                self.release(cost)
+            elif (cost, future) in self.waiters:
+                self.waiters.remove((cost, future))
+            raise
+
+    def release(self, cost):
+        """
+        Give back the memory of a tool and admit the waiting tools
+        which now fit.
+
+        :param cost: estimated peak memory of the tool (bytes)
+        """
+        self.used -= cost
+        self.running -= 1
+        for waiter in list(self.waiters):
+            cost, future = waiter
+            if future.done():
+                # Cancelled, acquire() removes it
+                continue
+            if self._fits(cost):
+                self.waiters.remove(waiter)
+                self._take(cost)
+                future.set_result(None)
+
+
+async def run_command(command, semaphore, budget=None, task_id=None):
+    """
+    Run a `Command` and wait for it.
+
+    :param command: `Command` instance
+    :param semaphore: semaphore capping the number of running tools
+    :param budget: `MemoryBudget` instance or None
+    :param task_id: ID of the task, to estimate and record the memory
+    :returns: `Command` to run next or None
+    """
+    if isinstance(command, FunctionCommand):
+        async with semaphore:
+            start = time.perf_counter()
+            await asyncio.get_running_loop().run_in_executor(
+                None, command.function)
+            metrics.add_tool_time(command.tool, time.perf_counter() - start)
+        return None
+    if isinstance(command, ScriptCommand):
+        async with semaphore:
+            start = time.perf_counter()
+            stdout, stderr = await asyncio.wrap_future(command.submit())
+            metrics.add_tool_time(command.tool, time.perf_counter() - start)
+        return command.finish(stdout, stderr)
+    cost = 0
+    if budget is not None:
+        cost = budget.estimate(task_id, command)
+        await budget.acquire(cost)
+    try:
+        async with semaphore:
+            logging.debug('Command: %s (in %s)', command.args, command.cwd)
+            start = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                *command.args, cwd=command.cwd, env=command.env,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+            if budget is not None:
+                peak = asyncio.ensure_future(_peak_memory(process))
+            try:
+                stdout, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+            finally:
+                metrics.add_tool_time(command.tool,
+                                      time.perf_counter() - start)
+    finally:
+        if budget is not None:
+            budget.release(cost)
+    if budget is not None:
+        peak = await peak
+        if peak is not None:
+            budget.record(task_id, command, peak)
+    return command.finish(stdout.decode(), stderr.decode())
+
+
+async def make(task, db, semaphore, pdf_only=False, budget=None):
+    """
+    Build a task if needed.
+
+    :param task: `Task` instance
+    :param db: `DataBase` instance
+    :param semaphore: semaphore capping the number of running tools
+    :param pdf_only: Build only tex and pdf
+    :param budget: `MemoryBudget` instance or None
+    """
+    targets = task.plan(db, pdf_only=pdf_only)
+    if not targets:
+        logging.info('Nothing to do for %s' % task.name)
+        metrics.count_tasks('skipped')
+        return
+    logging.info('Build in %s %s' % (', '.join(targets), task.name))
+    task._open_workpath()
+    try:
+        task._stage_inputs(targets)
+        for step in task.steps(db, targets):
+            command = step()
+            while command is not None:
+                command = await run_command(command, semaphore,
+                                            budget=budget, task_id=task.id)
+        task._collect_products(task.products(targets).values())
+    except asyncio.CancelledError:
+        logging.warning('Build of %s interrupted', task.name)
+        task._remove_products(targets)
+        raise
+    finally:
+        task._close_workpath()
+    task.record_build(db, targets)
+    metrics.count_tasks('built')
+
+
+async def _make_after(previous, task, db, semaphore, pdf_only, failed,
+                      budget=None):
+    """
+    Build a task once the previous task of its build directory is done.
+    """
+    if previous is not None:
+        await previous
+    try:
+        await make(task, db, semaphore, pdf_only=pdf_only, budget=budget)
+    except asyncio.CancelledError:
+        raise
+    except Exception as err:
+        logging.error('Build of %s failed: %s', task.name, err)
+        failed.append(task)
+
+
+async def make_all(tasks, db, jobs=4, pdf_only=False, memory=None):
+    """
+    Build tasks concurrently.
+
+    Tasks can be a generator, such as `Project.stream`: it runs on
+    the thread of the event loop, one task at a time between the steps
+    of the builds, as it reads and updates the database too.
+    The tasks are built as they come.
+
+    :param tasks: iterable of `Task` instances
+    :param db: `DataBase` instance
+    :param jobs: maximum number of external tools running at once
+    :param pdf_only: Build only tex and pdf
+    :param memory: memory budget of the external tools (bytes),
+                   None for no budget
+    :returns: list of tasks that failed
+    """
+    semaphore = asyncio.Semaphore(jobs)
+    budget = None
+    if memory is not None:
+        budget = MemoryBudget(memory, db)
+    # Tasks of a directory share the files copied in the build dir,
+    # each one waits for the previous one
+    last = collections.OrderedDict()
+    failed = []
+    try:
+        for task in tasks:
+            last[task.buildpath] = asyncio.ensure_future(
+                _make_after(last.get(task.buildpath), task, db, semaphore,
+                            pdf_only, failed, budget=budget))
+            # Let the builds start before the next task is planned
+            await asyncio.sleep(0)
+    finally:
+        # Errors of the generator are raised once the builds are done
+        await asyncio.gather(*last.values())
+    return failed
+
+
+def build(tasks, db, jobs=4, pdf_only=False, memory=None):
+    """
+    Build tasks concurrently, see :func:`make_all`.
+
+    :returns: list of tasks that failed
+    """
+    return asyncio.run(make_all(tasks, db, jobs=jobs, pdf_only=pdf_only,
+                                memory=memory))
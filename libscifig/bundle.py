@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+Bundle the built figures in a tar or zip file, without copying them
+to an export directory first.
+
+Members are named like the exported files (pdf/name.pdf,
+png150/name-150dpi.png). The last member, SHA256SUMS, lists their
+hashes in the format of `sha256sum -c`.
+
+Each member of a compressed tar bundle is compressed on its own:
+a gzip file can hold several gzip members, and a zstd file several
+frames. When a bundle is written again, the members of unchanged
+files are copied from the previous bundle, without reading the files
+or compressing them again. Zip members are always written again.
+"""
+
+import hashlib
+import logging
+import os
+import os.path
+import sys
+import tarfile
+import tempfile
+import zipfile
+import zlib
+
+from libscifig import metrics
+from libscifig.database import CACHE_ID
+from libscifig.task import product_filename
+
+try:
+    import zstandard
+except ImportError:
+    # No .tar.zst bundles
+    zstandard = None
+
+
+BUNDLE_FORMATS = ('tar', 'tar.gz', 'tar.zst', 'zip')
+MANIFEST = 'SHA256SUMS'
+CHUNK_SIZE = 1024 * 1024
+# Already compressed, stored as is in zip files
+STORED_TARGETS = ('pdf', 'png')
+
+
+class BundleNameError(ValueError):
+    """
+    Two figures would be bundled under the same member name.
+    """
+    pass
+
+
+def bundle_format(path):
+    """
+    Guess the format of a bundle from its extension.
+
+    :param path: filepath of the bundle
+    :returns: a format of BUNDLE_FORMATS
+    :raises: ValueError
+    """
+    for ext, fmt in (('.tar.gz', 'tar.gz'), ('.tgz', 'tar.gz'),
+                     ('.tar.zst', 'tar.zst'), ('.tzst', 'tar.zst'),
+                     ('.tar', 'tar'), ('.zip', 'zip')):
+        if path.endswith(ext):
+            return fmt
+    raise ValueError('Unknown bundle format: %s' % path)
+
+
+def list_members(tasks, db, formats=None):
+    """
+    List the built files of tasks.
+
+    :param tasks: tasks or task records
+    :param db: `DataBase` instance
+    :param formats: targets to bundle (ex: pdf, png150), all by default
+    :returns: list of (member name, filepath) tuples
+    :raises: BundleNameError if two figures have the same member name
+    """
+    members = []
+    sources = {}
+    for task in tasks:
+        for target, built in db.get(task.id, 'targets').items():
+            if not built or (formats and target not in formats):
+                continue
+            filename = product_filename(task.name, target)
+            filepath = os.path.join(task.buildpath, filename)
+            if os.path.isfile(filepath):
+                name = target + '/' + filename
+                if name in sources:
+                    raise BundleNameError('Two figures would be bundled '
+                                          'as %s: %s and %s'
+                                          % (name, sources[name], filepath))
+                sources[name] = filepath
+                members.append((name, filepath))
+            else:
+                logging.warning('Missing %s, not bundled', filepath)
+    return members
+
+
+def _mark_exported(tasks, db, members):
+    """
+    Mark the bundled targets of tasks as exported.
+    """
+    names = {name for name, filepath in members}
+    for task in tasks:
+        status = db.get(task.id, 'export')
+        for target in status:
+            if target + '/' + product_filename(task.name, target) in names:
+                status[target] = False
+        db.set(task.id, 'export', status)
+
+
+def _compressor(fmt):
+    """
+    Return a new compressor, making a complete gzip member or zstd frame.
+    """
+    if fmt == 'tar.gz':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if fmt == 'tar.zst':
+        return zstandard.ZstdCompressor().compressobj()
+    return None
+
+
+class _TarWriter():
+    """
+    Write a tar stream, member by member.
+
+    :param fileobj: binary file object
+    :param fmt: tar, tar.gz or tar.zst
+    """
+    def __init__(self, fileobj, fmt):
+        self.fileobj = fileobj
+        self.fmt = fmt
+        self.offset = 0
+
+    def _write(self, chunks):
+        """
+        Write a member, compressed on its own.
+
+        :returns: (offset, length) of the member in the bundle
+        """
+        start = self.offset
+        compressor = _compressor(self.fmt)
+        for chunk in chunks:
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            self.fileobj.write(chunk)
+            self.offset += len(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            self.fileobj.write(chunk)
+            self.offset += len(chunk)
+        return start, self.offset - start
+
+    def _chunks(self, name, size, mtime, fh, sha256):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        yield info.tobuf(tarfile.PAX_FORMAT)
+        while True:
+            chunk = fh.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            yield chunk
+        if size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+
+    def add(self, name, filepath):
+        """
+        Add a file.
+
+        :returns: (sha256, offset, length) tuple
+        """
+        stat = os.stat(filepath)
+        sha256 = hashlib.sha256()
+        with open(filepath, 'rb') as fh:
+            offset, length = self._write(self._chunks(name, stat.st_size,
+                                                      stat.st_mtime, fh,
+                                                      sha256))
+        return sha256.hexdigest(), offset, length
+
+    def add_bytes(self, name, content, mtime):
+        """
+        Add a member from a bytes string.
+        """
+        fh = _BytesReader(content)
+        return self._write(self._chunks(name, len(content), mtime, fh,
+                                        hashlib.sha256()))
+
+    def copy(self, previous, offset, length):
+        """
+        Copy a member of a previous bundle of the same format.
+
+        :param previous: binary file object of the previous bundle
+        :returns: (offset, length) of the member in the bundle
+        """
+        previous.seek(offset)
+        start = self.offset
+        remaining = length
+        while remaining:
+            chunk = previous.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise EOFError('Truncated bundle')
+            remaining -= len(chunk)
+            self.fileobj.write(chunk)
+            self.offset += len(chunk)
+        return start, length
+
+    def close(self):
+        """
+        Write the end of the archive.
+        """
+        self._write([tarfile.NUL * 2 * tarfile.BLOCKSIZE])
+
+
+class _BytesReader():
+    """
+    Read a bytes string by chunks, like a file.
+    """
+    def __init__(self, content):
+        self.content = content
+        self.position = 0
+
+    def read(self, size):
+        chunk = self.content[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+
+def _write_zip(fileobj, members):
+    """
+    Write a zip bundle.
+
+    :param fileobj: binary file object, can be unseekable (stdout)
+    :param members: list of (member name, filepath) tuples
+    :returns: dict member name -> sha256
+    """
+    hashes = {}
+    with zipfile.ZipFile(fileobj, 'w') as archive:
+        for name, filepath in members:
+            info = zipfile.ZipInfo.from_file(filepath, name)
+            if name.split('/')[0].startswith(STORED_TARGETS):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            sha256 = hashlib.sha256()
+            with open(filepath, 'rb') as src, \
+                    archive.open(info, 'w') as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    dst.write(chunk)
+            hashes[name] = sha256.hexdigest()
+        archive.writestr(MANIFEST, _manifest(hashes))
+    return hashes
+
+
+def _manifest(hashes):
+    """
+    Return the content of the manifest, like sha256sum.
+    """
+    return ''.join('%s  %s\n' % (hashes[name], name)
+                   for name in sorted(hashes)).encode()
+
+
+def _write_tar(fileobj, fmt, members, index, previous=None):
+    """
+    Write a tar bundle.
+
+    :param fileobj: binary file object, can be unseekable (stdout)
+    :param fmt: tar, tar.gz or tar.zst
+    :param members: list of (member name, filepath) tuples
+    :param index: dict member name -> [size, mtime, sha256, offset, length]
+                  of the previous bundle, left unchanged
+    :param previous: binary file object of the previous bundle or None
+    :returns: (index of the new bundle, number of members copied
+              from the previous bundle) tuple
+    """
+    writer = _TarWriter(fileobj, fmt)
+    old_index = index
+    index = {}
+    hashes = {}
+    reused = 0
+    for name, filepath in members:
+        stat = os.stat(filepath)
+        entry = old_index.get(name)
+        if (previous is not None and entry is not None
+                and entry[:2] == [stat.st_size, stat.st_mtime_ns]):
+            offset, length = writer.copy(previous, entry[3], entry[4])
+            sha256 = entry[2]
+            reused += 1
+        else:
+            sha256, offset, length = writer.add(name, filepath)
+        index[name] = [stat.st_size, stat.st_mtime_ns, sha256, offset, length]
+        hashes[name] = sha256
+    mtime = max([entry[1] for entry in index.values()] or [0]) / 1e9
+    writer.add_bytes(MANIFEST, _manifest(hashes), mtime)
+    writer.close()
+    return index, reused
+
+
+def write_bundle(tasks, db, path, formats=None, fmt=None):
+    """
+    Write the built files of tasks in a bundle.
+
+    The bundle is written in a temporary file and renamed, the
+    previous bundle is read meanwhile to reuse its members.
+    The bundled targets are then marked as exported.
+
+    :param tasks: tasks or task records
+    :param db: `DataBase` instance, keeps the index of the bundle
+    :param path: filepath of the bundle, - for stdout
+    :param formats: targets to bundle (ex: pdf, png150), all by default
+    :param fmt: format of BUNDLE_FORMATS, guessed from path by default
+                and tar for stdout
+    :returns: number of members, manifest excluded
+    :raises: ValueError, BundleNameError if two figures have the same
+             member name, ImportError if zstandard is missing
+    """
+    if fmt is None:
+        fmt = 'tar' if path == '-' else bundle_format(path)
+    if fmt not in BUNDLE_FORMATS:
+        raise ValueError('Unknown bundle format: %s' % fmt)
+    if fmt == 'tar.zst' and zstandard is None:
+        raise ImportError('zstandard is needed to write tar.zst bundles')
+    members = list_members(tasks, db, formats=formats)
+    size = sum(os.path.getsize(filepath) for name, filepath in members)
+
+    if path == '-':
+        if fmt == 'zip':
+            _write_zip(sys.stdout.buffer, members)
+        else:
+            _write_tar(sys.stdout.buffer, fmt, members, {})
+        sys.stdout.buffer.flush()
+        _mark_exported(tasks, db, members)
+        metrics.add_bytes('exported', size)
+        logging.info('Bundle of %i files written on stdout', len(members))
+        return len(members)
+
+    path = os.path.abspath(path)
+    bundles = db.get(CACHE_ID, 'bundles')
+    recorded = bundles.get(path)
+    previous = None
+    index = {}
+    try:
+        stat = os.stat(path)
+        if (recorded is not None and recorded['format'] == fmt
+                and recorded['bundle'] == [stat.st_size, stat.st_mtime_ns]):
+            index = recorded['members']
+            previous = open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.bundle-')
+    reused = 0
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            if fmt == 'zip':
+                _write_zip(fh, members)
+                index = {}
+            else:
+                index, reused = _write_tar(fh, fmt, members, index, previous)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        # The next bundle is written from scratch
+        bundles.pop(path, None)
+        db.set(CACHE_ID, 'bundles', bundles)
+        raise
+    finally:
+        if previous is not None:
+            previous.close()
+    stat = os.stat(path)
+    bundles[path] = {'format': fmt,
+                     'bundle': [stat.st_size, stat.st_mtime_ns],
+                     'members': index}
+    db.set(CACHE_ID, 'bundles', bundles)
+    _mark_exported(tasks, db, members)
+    metrics.add_bytes('exported', size)
+    logging.info('Bundle %s: %i files, %i reused from the previous bundle',
+                 path, len(members), reused)
+    return len(members)
@@ -5,6 +5,12 @@
 
 import hashlib
 import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from libscifig import metrics
 
 
 def calculate_checksum(filepath):
@@ -15,12 +21,27 @@ def calculate_checksum(filepath):
     :returns: string
     """
     hasher = hashlib.md5()
+    size = 0
     with open(filepath, 'rb') as afile:
-        buf = afile.read()
-        hasher.update(buf)
+        # hashlib releases the GIL on large buffers,
+        # files can be hashed in threads
+        for buf in iter(lambda: afile.read(1024 * 1024), b''):
+            hasher.update(buf)
+            size += len(buf)
+    metrics.add_bytes('hashed', size)
     return hasher.hexdigest()
 
 
+def _try_checksum(filepath):
+    """
+    Calculate the checksum of a file, None if it does not exist.
+    """
+    try:
+        return calculate_checksum(filepath)
+    except FileNotFoundError:
+        return None
+
+
 def is_different(cur_hashes, db_hashes):
     """
     Check if at least one item changed.
@@ -39,3 +60,177 @@ def is_different(cur_hashes, db_hashes):
             logging.debug('value of %s is None or does not match, modif is True', dep)
             return True
     return False
+
+
+# Coarse timestamps of the filesystems (ns): a file written just after
+# the index was read can have an older modification time
+RACY_MARGIN = 2 * 10**9
+
+
+class GitIndex():
+    """
+    Object IDs of the files tracked by git and identical in the
+    work tree, read from the index.
+
+    Files modified after the index was read, or shortly before,
+    are not trusted.
+
+    :param path: directory in a git work tree, only the files
+                 below it are read
+    :raises: OSError, subprocess.CalledProcessError
+    """
+    def __init__(self, path='.'):
+        self.started = time.time_ns()
+        self.blobs = {}
+        output = subprocess.run(['git', 'ls-files', '--stage', '-z'],
+                                cwd=path, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True).stdout
+        for line in output.decode('utf-8', 'surrogateescape').split('\0'):
+            if not line:
+                continue
+            info, filepath = line.split('\t', 1)
+            mode, blob, stage = info.split(' ')
+            # Skip submodules and conflicts
+            if mode != '160000' and stage == '0':
+                self.blobs[os.path.normpath(os.path.join(path,
+                                                         filepath))] = blob
+        # Files which differ from the index
+        output = subprocess.run(['git', 'diff', '--name-only', '--relative',
+                                 '-z'],
+                                cwd=path, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True).stdout
+        for filepath in output.decode('utf-8', 'surrogateescape').split('\0'):
+            if filepath:
+                self.blobs.pop(os.path.normpath(os.path.join(path, filepath)),
+                               None)
+        logging.debug('%i files tracked by git in %s, read in %.3f s',
+                      len(self.blobs), path,
+                      (time.time_ns() - self.started) / 1e9)
+
+    def blob(self, filepath, stat):
+        """
+        Return the object ID of a file.
+
+        :param filepath: file path
+        :param stat: stat of the file
+        :returns: string, None if the file is not tracked, differs
+                  from the index or was modified since it was read
+        """
+        if stat.st_mtime_ns >= self.started - RACY_MARGIN:
+            return None
+        return self.blobs.get(os.path.normpath(filepath))
+
+
+def read_git_index(path='.'):
+    """
+    Read the git index of a directory.
+
+    :param path: directory in a git work tree
+    :returns: `GitIndex` instance, None if git or the repository
+              is missing
+    """
+    try:
+        return GitIndex(path)
+    except (OSError, subprocess.CalledProcessError):
+        logging.warning('%s is not in a git work tree, '
+                        'all the dependencies are hashed', path)
+        return None
+
+
+class ChecksumCache():
+    """
+    Checksums of files, calculated again only if
+    the size or the modification time of a file changed.
+
+    With a git index, the git object ID of a file is recorded with
+    its checksum. A file whose size or modification time changed
+    (after a checkout) but whose object ID did not keeps its checksum
+    without being read.
+
+    :param data: dict filepath -> [size, mtime, checksum, object ID]
+                 (the object ID can be missing)
+    :param git: `GitIndex` instance or None
+    """
+    def __init__(self, data=None, git=None):
+        if data is None:
+            data = {}
+        self.data = data
+        self.git = git
+
+    def _known(self, filepath, stat):
+        """
+        Return the cache entry of a file if it is still valid, None
+        otherwise, and the object ID of the file.
+        """
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        entry = self.data.get(filepath)
+        if entry is not None and entry[:2] == fingerprint:
+            if self.git is not None and len(entry) == 3:
+                blob = self.git.blob(filepath, stat)
+                if blob is not None:
+                    entry.append(blob)
+            return entry, None
+        blob = None
+        if self.git is not None:
+            blob = self.git.blob(filepath, stat)
+        if blob is not None and entry is not None and entry[3:] == [blob]:
+            # Same content, new mtime
+            entry = fingerprint + entry[2:]
+            self.data[filepath] = entry
+            return entry, blob
+        return None, blob
+
+    def checksum(self, filepath):
+        """
+        Return the checksum of a file.
+
+        :param filepath: file path
+        :returns: string
+        """
+        stat = os.stat(filepath)
+        entry, blob = self._known(filepath, stat)
+        if entry is not None:
+            return entry[2]
+        md5 = calculate_checksum(filepath)
+        self.data[filepath] = [stat.st_size, stat.st_mtime_ns, md5]
+        if blob is not None:
+            self.data[filepath].append(blob)
+        return md5
+
+    def prime(self, filepaths, workers=8):
+        """
+        Calculate the checksums of files in a pool of threads,
+        so that :func:`checksum` finds them in the cache.
+
+        Only new or modified files are hashed, missing files are skipped.
+
+        :param filepaths: file paths
+        :param workers: number of threads
+        :returns: number of hashed files
+        """
+        stale = []
+        for filepath in set(filepaths):
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+            entry, blob = self._known(filepath, stat)
+            if entry is None:
+                stale.append((filepath, [stat.st_size, stat.st_mtime_ns],
+                              blob))
+        if not stale:
+            return 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            checksums = executor.map(_try_checksum,
+                                     [filepath for filepath, _, _ in stale])
+            for (filepath, fingerprint, blob), md5 in zip(stale, checksums):
+                if md5 is not None:
+                    self.data[filepath] = fingerprint + [md5]
+                    if blob is not None:
+                        self.data[filepath].append(blob)
+        elapsed = time.perf_counter() - start
+        size = sum(fingerprint[0] for _, fingerprint, _ in stale) / 1e6
+        logging.info('Hashed %i files (%.1f MB) in %.2f s, %.1f MB/s',
+                     len(stale), size, elapsed, size / max(elapsed, 1e-9))
+        return len(stale)
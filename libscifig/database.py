@@ -5,27 +5,75 @@
 
 import json
 import logging
+import os
+
+from libscifig import metrics
+from libscifig.checksum import ChecksumCache
+
+# Entry of the database holding caches, not a task
+CACHE_ID = 'CACHE:'
+
 
 class DataBase():
     """
     Custom class to manipulate a json database.
 
+    It also holds a `ChecksumCache` of the dependencies in `checksums`.
+
     :param db_path: filepath of the database.
     """
     def __init__(self, db_path):
         self.path = db_path
+        self.data = {}
+        self.checksums = ChecksumCache()
+        # Stat of the file when last read or written
+        self.stat = None
 
     def __enter__(self):
-        try:
-            with open(self.path, 'r') as f:
-                self.data = json.load(f)
-        except FileNotFoundError:
-            self.data = {}
+        self.load()
         return self
 
     def __exit__(self, type, value, traceback):
-        with open(self.path, 'w') as f:
-            json.dump(self.data, f)
+        self.save()
+
+    def load(self):
+        """
+        Read the database from the disk.
+        """
+        with metrics.db_timer('load'):
+            try:
+                with open(self.path, 'r') as f:
+                    self.data = json.load(f)
+            except FileNotFoundError:
+                self.data = {}
+        self.checksums = ChecksumCache(self.get(CACHE_ID, 'checksums'))
+        self.stat = self._stat()
+
+    def save(self):
+        """
+        Write the database to the disk.
+        """
+        self.set(CACHE_ID, 'checksums', self.checksums.data)
+        with metrics.db_timer('save'):
+            with open(self.path, 'w') as f:
+                json.dump(self.data, f)
+        self.stat = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def modified(self):
+        """
+        Tell if the file was written by another process
+        since it was last read or written.
+
+        :returns: boolean
+        """
+        return self._stat() != self.stat
 
     def set(self, name, obj, content):
         """
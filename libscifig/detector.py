@@ -4,7 +4,13 @@
 import glob
 import os.path
 import logging
-from libscifig.task import GnuplotTask, TikzTask
+import re
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from libscifig.task import (GnuplotTask, PDF_OPTIMIZE_OPTIONS, PNG_DEVICES,
+                            PythonTask, TikzTask, TranslatedTask,
+                            base_tools, product_filename)
+from libscifig.toolchain import ToolNotFoundError
 
 
 #TODO : recursive glob: https://docs.python.org/3.5/library/glob.html
@@ -20,6 +26,19 @@ def _recursive_glob(base, ext):
         for f in fnmatch.filter(files, '*' + ext)]
 
 
+# Python figures, other python files are modules they can import
+PYTHON_FIGURE_PATTERN = 'fig_*.py'
+# Files marking a figure directory: the figure sources, or an empty
+# .figure file for a directory which must not be searched deeper
+FIGURE_MARKERS = ('*.plt', '*.tikz', PYTHON_FIGURE_PATTERN, '.figure')
+# Version of the detection rules, a cache of an older version is dropped
+DETECTION_FORMAT = 3
+# Key of the cache holding the rules used by the cached scans
+CACHE_SIGNATURE = '<signature>'
+# Files of a figure directory (and its subdirectories) used as data
+DATAFILE_EXTENSIONS = ('csv', '.res', '.dat', '.txt', '.png', '.jpg')
+
+
 def detect_datafile(plt, root):
     """
     Detect datafiles associated with a plt file.
@@ -30,7 +49,7 @@ def detect_datafile(plt, root):
     """
     base = os.path.split(plt)[0]
     datafiles = []
-    for ext in ('csv', '.res', '.dat', '.txt', '.png', '.jpg'):
+    for ext in DATAFILE_EXTENSIONS:
         files = _recursive_glob(base, ext)
         files = [os.path.relpath(f, root) for f in files]
         datafiles.extend(files)
@@ -39,6 +58,23 @@ def detect_datafile(plt, root):
     return datafiles
 
 
+def detect_modules(py_file, root):
+    """
+    Detect the python modules a python figure can import,
+    in its directory and subdirectories.
+
+    :param py_file: python figure filepath
+    :param root: root filepath
+    :returns: list of filepath starting at root
+    """
+    base = os.path.split(py_file)[0]
+    modules = [os.path.relpath(f, root) for f in _recursive_glob(base, '.py')
+               if not fnmatch.fnmatch(os.path.basename(f),
+                                      PYTHON_FIGURE_PATTERN)]
+    logging.debug('Detected modules: %s', modules)
+    return sorted(modules)
+
+
 def detect_tikzsnippets(plt):
     """
     Detect tikzsnippets associated with a plt file.
@@ -55,28 +91,566 @@ def detect_tikzsnippets(plt):
     return snippets
 
 
-def detect_task(directory, root_path):
+def detect_translations(filepath):
+    """
+    Detect the po files translating a figure.
+
+    :param filepath: filepath of the figure
+    :returns: list of po filepaths, named like name_fr.po or name_pt_BR.po
+    """
+    dirname, filename = os.path.split(filepath)
+    name = os.path.splitext(filename)[0]
+    pattern = re.escape(name) + r'_[a-z]{2,3}(_[A-Z]{2})?\.po'
+    pofiles = [pofile for pofile
+               in glob.glob(os.path.join(dirname, name + '_*.po'))
+               if re.fullmatch(pattern, os.path.basename(pofile))]
+    logging.debug('Detected translations of %s: %s', name, pofiles)
+    return sorted(pofiles)
+
+
+def scan_directory(directory, root_path):
+    """
+    Detect the tasks to do depending on file extensions,
+    without creating them.
+
+    :param directory: directory to look at
+    :param root_path: root filepath
+    :returns: list of json-serializable dicts, see :func:`create_tasks`
+    """
+    specs = []
+    for plt_file in glob.glob(os.path.join(directory, '*.plt')):
+        snippet, snippet1, snippet2 = detect_tikzsnippets(plt_file)
+        specs.append({'kind': 'gnuplot',
+                      'filepath': plt_file,
+                      'datafiles': detect_datafile(plt_file, root_path),
+                      'tikzsnippet': snippet,
+                      'tikzsnippet1': snippet1,
+                      'tikzsnippet2': snippet2})
+    for tikz_file in glob.glob(os.path.join(directory, '*.tikz')):
+        specs.append({'kind': 'tikz',
+                      'filepath': tikz_file,
+                      'datafiles': detect_datafile(tikz_file, root_path)})
+    for py_file in glob.glob(os.path.join(directory, PYTHON_FIGURE_PATTERN)):
+        specs.append({'kind': 'python',
+                      'filepath': py_file,
+                      'datafiles': (detect_datafile(py_file, root_path)
+                                    + detect_modules(py_file, root_path))})
+    # Translations are built after their task
+    for spec in list(specs):
+        for pofile in detect_translations(spec['filepath']):
+            specs.append({'kind': 'translation',
+                          'filepath': pofile,
+                          'task': spec['filepath']})
+    return specs
+
+
+def create_tasks(specs, engine='pdflatex', scratch=None,
+                 png_dpi=(600,), png_device='png16m',
+                 svg_precision=None, svgz=False, pdf_optimize=False):
+    """
+    Create the tasks detected by :func:`scan_directory`.
+
+    :param specs: list of dicts
+    :param engine: LaTeX engine of the tasks
+    :param scratch: scratch dir of the tasks
+    :param png_dpi: resolutions of the png variants
+    :param png_device: ghostscript device of the png
+    :param svg_precision: decimals of the optimized svg, None to skip it
+    :param svgz: compress the optimized svg
+    :param pdf_optimize: optimize the pdf with ghostscript
+    :returns: list of tasks
+    """
+    return list(expand_records(create_records(specs, engine=engine,
+                                              scratch=scratch,
+                                              png_dpi=png_dpi,
+                                              png_device=png_device,
+                                              svg_precision=svg_precision,
+                                              svgz=svgz,
+                                              pdf_optimize=pdf_optimize)))
+
+
+class TaskRecord():
+    """
+    Compact form of a task, expanded into a :class:`Task` only when
+    it must be built.
+
+    A record holds the spec of the task with interned paths. It can
+    tell if the task is up to date, without creating it.
+
+    :param kind: gnuplot, tikz, python or translation
+    :param filepath: filepath of the main file
+    :param datafiles: tuple of filepaths of the data files
+    :param snippets: tuple of 3 booleans, tikzsnippets of a gnuplot task
+    :param task: record of the translated task, for a translation
+    :param options: dict of the keyword arguments of the tasks
+                    (engine, scratch, png_dpi, png_device,
+                    svg_precision, svgz, pdf_optimize),
+                    shared by the records
+    """
+    __slots__ = ('kind', 'filepath', 'datafiles', 'snippets', 'task',
+                 'options')
+
+    def __init__(self, kind, filepath, datafiles=(), snippets=None,
+                 task=None, options=None):
+        self.kind = kind
+        self.filepath = sys.intern(filepath)
+        self.datafiles = datafiles
+        self.snippets = snippets
+        self.task = task
+        self.options = options
+
+    @property
+    def name(self):
+        return os.path.splitext(os.path.basename(self.filepath))[0]
+
+    @property
+    def id(self):
+        return 'ID:' + os.path.relpath(self.filepath)
+
+    @property
+    def buildpath(self):
+        return os.path.join('build',
+                            os.path.relpath(os.path.dirname(self.filepath)))
+
+    def get_name(self):
+        """
+        Return the name of the task.
+        """
+        return self.id
+
+    @property
+    def dependencies(self):
+        """
+        Filepaths of the dependencies, as listed by the task.
+        """
+        dependencies = [self.filepath]
+        dependencies.extend(self.datafiles)
+        if self.snippets is not None:
+            base = os.path.splitext(self.filepath)[0] + '.tikzsnippet'
+            for suffix, snippet in zip(('', '1', '2'), self.snippets):
+                if snippet:
+                    dependencies.append(base + suffix)
+        if self.task is not None:
+            dependencies.extend(self.task.dependencies)
+        return dependencies
+
+    def tools(self, pdf_only=False):
+        """
+        Return the names of the tools needed by a build.
+
+        :param pdf_only: Only tex and pdf
+        :returns: list of tool names
+        """
+        tools = base_tools(self.options['engine'], pdf_only=pdf_only,
+                           pdf_optimize=self.options['pdf_optimize'])
+        if self.kind == 'gnuplot':
+            tools.insert(0, 'gnuplot')
+        if self.task is not None:
+            task_tools = self.task.tools(pdf_only)
+            tools = [tool for tool in tools
+                     if tool not in task_tools] + task_tools
+        return tools
+
+    def targets(self, pdf_only=False):
+        """
+        Return the targets of a build, see `Task.targets`.
+        """
+        if pdf_only:
+            return ['tex', 'pdf']
+        png_dpi = sorted(set(self.options['png_dpi']), reverse=True)
+        targets = (['tex', 'pdf', 'svg', 'eps', 'png']
+                   + ['png%i' % dpi for dpi in png_dpi[1:]])
+        if self.options['svg_precision'] is not None:
+            targets.append('svgz' if self.options['svgz'] else 'svgmin')
+        return targets
+
+    def is_current(self, db, toolchain, python_versions=None,
+                   pdf_only=False):
+        """
+        Check that the task is up to date, without creating it.
+
+        The check is conservative: files whose size or modification
+        time changed are left to the task, which hashes them.
+
+        :param db: `DataBase` instance
+        :param toolchain: `Toolchain` instance
+        :param python_versions: string returned by `pyrunner.versions`
+        :param pdf_only: Check only the status for pdf
+        """
+        task_id = self.id
+        recorded = db.get(task_id, 'deps')
+        if not recorded:
+            return False
+        for dep in self.dependencies:
+            try:
+                if db.checksums.checksum(dep) != recorded.get(dep):
+                    return False
+            except OSError:
+                return False
+        for tool in self.tools():
+            try:
+                version = toolchain.version(tool)
+            except ToolNotFoundError:
+                continue
+            if recorded.get('TOOL:' + tool) != version:
+                return False
+        if (self.kind == 'python'
+                and recorded.get('TOOL:python') != python_versions):
+            return False
+        png_dpi = max(self.options['png_dpi'])
+        if not pdf_only and \
+                recorded.get('PNG:') != '%s %i' % (self.options['png_device'],
+                                                  png_dpi):
+            return False
+        svg_precision = self.options['svg_precision']
+        if svg_precision is not None:
+            svg_target = 'svgz' if self.options['svgz'] else 'svgmin'
+            if recorded.get('SVG:') != '%s %i' % (svg_target, svg_precision):
+                return False
+        if self.options['pdf_optimize']:
+            if recorded.get('PDF:') != ' '.join(PDF_OPTIMIZE_OPTIONS):
+                return False
+        elif 'PDF:' in recorded:
+            return False
+        if any(db.get(task_id, 'export').values()):
+            # Built but not exported yet
+            return False
+        built = db.get(task_id, 'targets')
+        products = db.get(task_id, 'products')
+        buildpath = self.buildpath
+        name = self.name
+        for target in self.targets(pdf_only):
+            if not built.get(target) or target not in products:
+                return False
+            try:
+                stat = os.stat(os.path.join(buildpath,
+                                            product_filename(name, target)))
+            except FileNotFoundError:
+                return False
+            if products[target][:2] != [stat.st_size, stat.st_mtime_ns]:
+                return False
+        return True
+
+    def expand(self, task=None):
+        """
+        Create the task.
+
+        :param task: task of a translation, created from its record
+                     if not given
+        :returns: `Task` instance
+        """
+        if self.kind == 'gnuplot':
+            snippet, snippet1, snippet2 = self.snippets
+            return GnuplotTask(self.filepath,
+                               datafiles=list(self.datafiles),
+                               tikzsnippet=snippet,
+                               tikzsnippet1=snippet1,
+                               tikzsnippet2=snippet2,
+                               **self.options)
+        elif self.kind == 'tikz':
+            return TikzTask(self.filepath, datafiles=list(self.datafiles),
+                            **self.options)
+        elif self.kind == 'python':
+            return PythonTask(self.filepath, datafiles=list(self.datafiles),
+                              **self.options)
+        elif self.kind == 'translation':
+            if task is None:
+                task = self.task.expand()
+            return TranslatedTask(task, self.filepath, **self.options)
+        raise ValueError('Unknown task kind: %s' % self.kind)
+
+
+def create_records(specs, engine='pdflatex', scratch=None,
+                   png_dpi=(600,), png_device='png16m',
+                   svg_precision=None, svgz=False, pdf_optimize=False):
+    """
+    Create the records of the tasks detected by :func:`scan_directory`.
+
+    Tasks of a directory share their tuple of data files.
+
+    :param specs: list of dicts
+    :param engine: LaTeX engine of the tasks
+    :param scratch: scratch dir of the tasks
+    :param png_dpi: resolutions of the png variants
+    :param png_device: ghostscript device of the png
+    :param svg_precision: decimals of the optimized svg, None to skip it
+    :param svgz: compress the optimized svg
+    :param pdf_optimize: optimize the pdf with ghostscript
+    :returns: list of `TaskRecord` instances
+    """
+    if png_device not in PNG_DEVICES:
+        raise ValueError('Unknown png device: %s' % png_device)
+    options = {'engine': engine, 'scratch': scratch,
+               'png_dpi': tuple(png_dpi), 'png_device': png_device,
+               'svg_precision': svg_precision, 'svgz': svgz,
+               'pdf_optimize': pdf_optimize}
+    records = []
+    by_filepath = {}
+    datafiles = {}
+    for spec in specs:
+        if spec['kind'] == 'translation':
+            record = TaskRecord('translation', spec['filepath'],
+                                task=by_filepath[spec['task']],
+                                options=options)
+        else:
+            files = tuple(sys.intern(f) for f in spec['datafiles'])
+            files = datafiles.setdefault(files, files)
+            snippets = None
+            if spec['kind'] == 'gnuplot':
+                snippets = (spec['tikzsnippet'], spec['tikzsnippet1'],
+                            spec['tikzsnippet2'])
+            record = TaskRecord(spec['kind'], spec['filepath'],
+                                datafiles=files, snippets=snippets,
+                                options=options)
+        by_filepath[spec['filepath']] = record
+        records.append(record)
+    return records
+
+
+def expand_records(records):
+    """
+    Create the tasks of records.
+
+    A translation and its task share the same task instance
+    when both are expanded.
+
+    :param records: iterable of `TaskRecord` instances
+    :returns: generator of tasks
+    """
+    tasks = {}
+    for record in records:
+        task = record.expand(task=tasks.get(record.task))
+        tasks[record] = task
+        yield task
+
+
+def detect_task(directory, root_path, engine='pdflatex', scratch=None,
+                png_dpi=(600,), png_device='png16m',
+                svg_precision=None, svgz=False, pdf_optimize=False):
     """
     Detect the task to do depending on file extensions.
 
     :param directory: directory to look at
+    :param engine: LaTeX engine of the tasks
+    :param scratch: scratch dir of the tasks
+    :param png_dpi: resolutions of the png variants
+    :param png_device: ghostscript device of the png
+    :param svg_precision: decimals of the optimized svg, None to skip it
+    :param svgz: compress the optimized svg
+    :param pdf_optimize: optimize the pdf with ghostscript
     :returns: list of tasks
     """
-    plt_files = glob.glob(os.path.join(directory, '*.plt'))
-    tikz_files = glob.glob(os.path.join(directory, '*.tikz'))
-    tasks = []
-    for plt_file in plt_files:
-        data = detect_datafile(plt_file, root_path)
-        snippet, snippet1, snippet2 = detect_tikzsnippets(plt_file)
-        tasks.append(GnuplotTask(plt_file,
-                                 datafiles=data,
-                                 tikzsnippet=snippet,
-                                 tikzsnippet1=snippet1,
-                                 tikzsnippet2=snippet2,
-                                 ))
-    for tikz_file in tikz_files:
-        data = detect_datafile(tikz_file, root_path)
-        tasks.append(TikzTask(tikz_file,
-                              datafiles=data,
-                              ))
-    return tasks
+    return create_tasks(scan_directory(directory, root_path),
+                        engine=engine, scratch=scratch,
+                        png_dpi=png_dpi, png_device=png_device,
+                        svg_precision=svg_precision, svgz=svgz,
+                        pdf_optimize=pdf_optimize)
+
+
+def _is_figdir(filenames, markers=FIGURE_MARKERS):
+    """
+    Check if a directory is a figure directory.
+
+    :param filenames: names of the files of the directory
+    :param markers: patterns of the files marking a figure directory
+    """
+    return any(fnmatch.filter(filenames, marker) for marker in markers)
+
+
+def list_figdirs(src='src', markers=FIGURE_MARKERS):
+    """
+    Return the list of directories containing figures.
+
+    Figure directories are searched at any depth below `src`,
+    the subdirectories of a figure directory are its data.
+
+    :param src: filepath of the source directory
+    :param markers: patterns of the files marking a figure directory
+    """
+    figdirs = []
+    for dirpath, dirnames, filenames in os.walk(src):
+        dirnames.sort()
+        if dirpath != src and _is_figdir(filenames, markers):
+            figdirs.append(dirpath)
+            dirnames[:] = []
+    return figdirs
+
+
+def _mtimes(directory):
+    """
+    Return the modification times of a directory and its subdirectories.
+
+    :returns: dict filepath -> mtime
+    """
+    mtimes = {}
+    for dirpath, dirnames, filenames in os.walk(directory):
+        mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+    return mtimes
+
+
+def _unchanged(mtimes):
+    """
+    Check that no directory has been modified.
+
+    A directory is modified when a file or a subdirectory is
+    added, removed or renamed in it.
+
+    :param mtimes: dict returned by :func:`_mtimes`
+    """
+    for directory, mtime in mtimes.items():
+        try:
+            if os.stat(directory).st_mtime_ns != mtime:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def _visit(directory, root_path, markers, entry, is_src=False):
+    """
+    Scan a directory, unless it is unchanged since the cached scan.
+
+    :param directory: filepath of the directory
+    :param root_path: root filepath
+    :param markers: patterns of the files marking a figure directory
+    :param entry: cached scan of the directory or None
+    :param is_src: the source directory is never a figure directory
+    :returns: (entry, scanned) tuple, entry has the key specs for
+              a figure directory, subdirs otherwise
+    """
+    if (entry is not None and ('specs' in entry or 'subdirs' in entry)
+            and _unchanged(entry['mtimes'])):
+        return entry, False
+    # Changes made during the scan are seen by the next one
+    mtime = os.stat(directory).st_mtime_ns
+    filenames = []
+    subdirs = []
+    with os.scandir(directory) as it:
+        for dir_entry in it:
+            if dir_entry.is_dir():
+                subdirs.append(dir_entry.path)
+            else:
+                filenames.append(dir_entry.name)
+    if not is_src and _is_figdir(filenames, markers):
+        return {'mtimes': _mtimes(directory),
+                'specs': scan_directory(directory, root_path)}, True
+    return {'mtimes': {directory: mtime}, 'subdirs': sorted(subdirs)}, False
+
+
+def iter_specs(src, root_path, markers=FIGURE_MARKERS, cache=None,
+               workers=8):
+    """
+    Detect the tasks of the figure directories found at any depth
+    below `src`, without creating them.
+
+    Directories are scanned by a pool of threads, the specs of
+    a figure directory are yielded as soon as it is scanned.
+    Directories unchanged since the scan recorded in the cache
+    are not scanned again.
+
+    :param src: filepath of the source directory
+    :param root_path: root filepath
+    :param markers: patterns of the files marking a figure directory
+    :param cache: json-serializable dict, updated in place
+    :param workers: number of threads
+    :returns: generator of (figure directory, specs) tuples,
+              see :func:`scan_directory`
+    """
+    if cache is None:
+        cache = {}
+    signature = [DETECTION_FORMAT] + sorted(markers)
+    if cache.get(CACHE_SIGNATURE) != signature:
+        # Scanned with other rules
+        cache.clear()
+    if not os.path.isdir(src):
+        cache.clear()
+        return
+    cache[CACHE_SIGNATURE] = signature
+    visited = {CACHE_SIGNATURE}
+    figdirs = 0
+    scanned = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_visit, src, root_path, markers,
+                                   cache.get(src), True): src}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = pending.pop(future)
+                entry, rescanned = future.result()
+                cache[directory] = entry
+                visited.add(directory)
+                if 'specs' in entry:
+                    figdirs += 1
+                    scanned += rescanned
+                    yield directory, entry['specs']
+                    continue
+                for subdir in entry['subdirs']:
+                    pending[executor.submit(_visit, subdir, root_path,
+                                            markers, cache.get(subdir))] = subdir
+    # Forget removed directories
+    for directory in set(cache) - visited:
+        del cache[directory]
+    logging.debug('%i of %i figure directories scanned', scanned, figdirs)
+
+
+def iter_records(src, root_path, engine='pdflatex', scratch=None,
+                 png_dpi=(600,), png_device='png16m', svg_precision=None,
+                 svgz=False, pdf_optimize=False, markers=FIGURE_MARKERS,
+                 cache=None, workers=8):
+    """
+    Detect the tasks of all the figure directories, as a stream:
+    the tasks of a directory can be built while the others are scanned.
+
+    See :func:`iter_specs` for the parameters.
+
+    :returns: generator of `TaskRecord` instances
+    """
+    for directory, specs in iter_specs(src, root_path, markers=markers,
+                                       cache=cache, workers=workers):
+        yield from create_records(specs, engine=engine, scratch=scratch,
+                                  png_dpi=png_dpi, png_device=png_device,
+                                  svg_precision=svg_precision, svgz=svgz,
+                                  pdf_optimize=pdf_optimize)
+
+
+def detect_records(src, root_path, engine='pdflatex', scratch=None,
+                   png_dpi=(600,), png_device='png16m', svg_precision=None,
+                   svgz=False, pdf_optimize=False, markers=FIGURE_MARKERS,
+                   cache=None, workers=8):
+    """
+    Detect the tasks of all the figure directories.
+
+    See :func:`iter_specs` for the parameters.
+
+    :returns: list of `TaskRecord` instances, sorted by directory
+    """
+    specs = sorted(iter_specs(src, root_path, markers=markers,
+                              cache=cache, workers=workers))
+    return create_records([spec for directory, directory_specs in specs
+                           for spec in directory_specs],
+                          engine=engine, scratch=scratch,
+                          png_dpi=png_dpi, png_device=png_device,
+                          svg_precision=svg_precision, svgz=svgz,
+                          pdf_optimize=pdf_optimize)
+
+
+def detect_tasks(src, root_path, engine='pdflatex', scratch=None,
+                 png_dpi=(600,), png_device='png16m', svg_precision=None,
+                 svgz=False, pdf_optimize=False, markers=FIGURE_MARKERS,
+                 cache=None, workers=8):
+    """
+    Detect the tasks of all the figure directories.
+
+    See :func:`iter_specs` for the parameters.
+
+    :returns: list of tasks, sorted by directory
+    """
+    return list(expand_records(detect_records(src, root_path, engine=engine,
+                                              scratch=scratch,
+                                              png_dpi=png_dpi,
+                                              png_device=png_device,
+                                              svg_precision=svg_precision,
+                                              svgz=svgz,
+                                              pdf_optimize=pdf_optimize,
+                                              markers=markers, cache=cache,
+                                              workers=workers)))
@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Build tasks on remote workers.
+
+A worker (:func:`serve_worker`) receives the inputs of a task, builds it
+in a temporary directory and sends the products back.
+A :class:`Coordinator` dispatches the tasks to a set of workers
+and records the builds in the database.
+If a worker is lost, its task is rescheduled on another worker.
+
+A worker runs gnuplot, LaTeX and python on the files it receives:
+it listens on the loopback interface by default, and builds only
+the requests holding its shared token.
+
+Each message is a json header on one line, followed by the content
+of the files listed in the header::
+
+    {"type": "build", "token": ..., "files": [["src/fig/fig.plt", 1234]]}\\n
+    <1234 bytes>...
+
+"""
+
+import collections
+import hmac
+import json
+import logging
+import os
+import os.path
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+
+from libscifig import metrics
+from libscifig.database import DataBase
+from libscifig.task import GnuplotTask, PythonTask, TikzTask, TranslatedTask
+from libscifig.toolchain import Toolchain
+
+
+def send_message(wfile, header, files=()):
+    """
+    Send a message.
+
+    :param wfile: writable binary file object
+    :param header: dict
+    :param files: list of (filepath, content) tuples
+    """
+    files = list(files)
+    header = dict(header)
+    header['files'] = [[path, len(content)] for path, content in files]
+    wfile.write(json.dumps(header).encode() + b'\n')
+    for path, content in files:
+        wfile.write(content)
+    wfile.flush()
+
+
+def recv_message(rfile):
+    """
+    Receive a message.
+
+    :param rfile: readable binary file object
+    :returns: header (dict) and files (dict filepath -> content)
+    :raises: ConnectionError
+    """
+    line = rfile.readline()
+    if not line:
+        raise ConnectionError('Connection closed')
+    header = json.loads(line.decode())
+    files = {}
+    for path, size in header.pop('files', []):
+        content = rfile.read(size)
+        if len(content) != size:
+            raise ConnectionError('Truncated message')
+        files[path] = content
+    return header, files
+
+
+def _safe_path(root, path):
+    """
+    Return the path of a received file in root.
+
+    :param root: directory receiving the files
+    :param path: relative filepath
+    :raises: ValueError if path escapes root
+    """
+    path = os.path.normpath(path)
+    if os.path.isabs(path) or path.startswith(os.pardir):
+        raise ValueError('Invalid path: %s' % path)
+    return os.path.join(root, path)
+
+
+def task_spec(task):
+    """
+    Describe a task in a json-serializable dict.
+
+    :param task: `Task` instance
+    :returns: dict
+    """
+    spec = {'filepath': os.path.relpath(task.dependencies[0]),
+            'datafiles': [os.path.relpath(data) for data in task.data],
+            'engine': task.requested_engine,
+            'png_dpi': task.png_dpi,
+            'png_device': task.png_device,
+            'svg_precision': task.svg_precision,
+            'svgz': task.svg_target == 'svgz',
+            'pdf_optimize': task.pdf_optimize,
+            }
+    if isinstance(task, TranslatedTask):
+        spec['kind'] = 'translated'
+        spec['task'] = task_spec(task.task)
+    elif isinstance(task, GnuplotTask):
+        spec['kind'] = 'gnuplot'
+        spec['tikzsnippet'] = task.tikzsnippet
+        spec['tikzsnippet1'] = task.tikzsnippet1
+        spec['tikzsnippet2'] = task.tikzsnippet2
+    elif isinstance(task, TikzTask):
+        spec['kind'] = 'tikz'
+    elif isinstance(task, PythonTask):
+        spec['kind'] = 'python'
+    else:
+        raise ValueError('Unsupported task: %s' % task.get_name())
+    return spec
+
+
+def task_from_spec(spec, build='build'):
+    """
+    Create a task from its description.
+
+    :param spec: dict returned by :func:`task_spec`
+    :param build: relative filepath of the build dir
+    :returns: `Task` instance
+    """
+    if spec['kind'] == 'gnuplot':
+        return GnuplotTask(spec['filepath'],
+                           datafiles=spec['datafiles'],
+                           tikzsnippet=spec['tikzsnippet'],
+                           tikzsnippet1=spec['tikzsnippet1'],
+                           tikzsnippet2=spec['tikzsnippet2'],
+                           build=build,
+                           engine=spec['engine'],
+                           png_dpi=spec['png_dpi'],
+                           png_device=spec['png_device'],
+                           svg_precision=spec.get('svg_precision'),
+                           svgz=spec.get('svgz', False),
+                           pdf_optimize=spec.get('pdf_optimize', False))
+    elif spec['kind'] == 'tikz':
+        return TikzTask(spec['filepath'],
+                        datafiles=spec['datafiles'],
+                        build=build,
+                        engine=spec['engine'],
+                        png_dpi=spec['png_dpi'],
+                        png_device=spec['png_device'],
+                        svg_precision=spec.get('svg_precision'),
+                        svgz=spec.get('svgz', False),
+                        pdf_optimize=spec.get('pdf_optimize', False))
+    elif spec['kind'] == 'translated':
+        return TranslatedTask(task_from_spec(spec['task'], build=build),
+                              spec['filepath'],
+                              build=build,
+                              engine=spec['engine'],
+                              png_dpi=spec['png_dpi'],
+                              png_device=spec['png_device'],
+                              svg_precision=spec.get('svg_precision'),
+                              svgz=spec.get('svgz', False),
+                              pdf_optimize=spec.get('pdf_optimize', False))
+    elif spec['kind'] == 'python':
+        return PythonTask(spec['filepath'],
+                          datafiles=spec['datafiles'],
+                          build=build,
+                          engine=spec['engine'],
+                          png_dpi=spec['png_dpi'],
+                          png_device=spec['png_device'],
+                          svg_precision=spec.get('svg_precision'),
+                          svgz=spec.get('svgz', False),
+                          pdf_optimize=spec.get('pdf_optimize', False))
+    raise ValueError('Unknown task kind: %s' % spec['kind'])
+
+
+# Versions of the tools of the worker, by filepath and mtime
+_tool_cache = {}
+
+
+def build_spec(spec, files, pdf_only=False):
+    """
+    Build a task from its description and its input files.
+
+    :param spec: dict returned by :func:`task_spec`
+    :param files: dict filepath -> content of the inputs
+    :param pdf_only: build only tex and pdf
+    :returns: result (dict with the engine and the versions of the tools)
+              and list of (filename, content) of the products
+    """
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp(prefix='scifig-worker-')
+    try:
+        for path, content in files.items():
+            dest = _safe_path(tmpdir, path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, 'wb') as fh:
+                fh.write(content)
+        # Tasks work with paths relative to the current directory
+        os.chdir(tmpdir)
+        task = task_from_spec(spec)
+        # Tools of the worker
+        toolchain = Toolchain(cache=_tool_cache)
+        toolchain.check(task.tools(pdf_only))
+        task.use_toolchain(toolchain)
+        with DataBase(os.path.join(tmpdir, 'db.json')) as db:
+            if pdf_only:
+                task.make_pdf(db)
+            else:
+                task.make(db)
+        products = []
+        filenames = list(task.products(task.targets(pdf_only)).values())
+        if isinstance(task, PythonTask):
+            # Needed to build the pdf from the tex file
+            filenames.extend(task._intermediates(task.buildpath))
+        for product in filenames:
+            with open(os.path.join(task.buildpath, product), 'rb') as fh:
+                products.append((product, fh.read()))
+        return {'engine': task.engine, 'tools': task.tool_versions}, products
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# Default timeout (in seconds) of a build on a worker
+BUILD_TIMEOUT = 600
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """
+    Build the tasks sent by a coordinator.
+    """
+    def handle(self):
+        while True:
+            try:
+                header, files = recv_message(self.rfile)
+            except (ConnectionError, ValueError):
+                return
+            if not hmac.compare_digest(str(header.get('token', '')),
+                                       self.server.token):
+                logging.warning('Request without a valid token from %s:%s',
+                                *self.client_address[:2])
+                send_message(self.wfile, {'type': 'error',
+                                          'message': 'Invalid token'})
+                return
+            if header.get('type') != 'build':
+                send_message(self.wfile, {'type': 'error',
+                                          'message': 'Unknown request'})
+                continue
+            logging.info('Build %s', header['spec']['filepath'])
+            try:
+                result, products = self.server.builder(header['spec'], files,
+                                                       header['pdf_only'])
+            except Exception as err:
+                logging.error('Build of %s failed: %s',
+                              header['spec']['filepath'], err)
+                send_message(self.wfile, {'type': 'error',
+                                          'message': str(err)})
+            else:
+                send_message(self.wfile, dict(result, type='result'),
+                             products)
+
+
+class WorkerServer(socketserver.TCPServer):
+    """
+    Worker listening for a coordinator.
+
+    Builds are done one at a time, run several workers
+    to use several cores.
+
+    :param address: (host, port) tuple, port 0 picks a free port
+    :param token: shared token the coordinators send
+    :param builder: function building a task, see :func:`build_spec`
+    :raises: ValueError if the token is empty
+    """
+    allow_reuse_address = True
+
+    def __init__(self, address, token, builder=build_spec):
+        if not token:
+            raise ValueError('A worker needs a token')
+        self.token = token
+        self.builder = builder
+        socketserver.TCPServer.__init__(self, address, WorkerHandler)
+
+
+def serve_worker(host='127.0.0.1', port=8642, token=None):
+    """
+    Run a worker until interrupted.
+
+    :param host: interface to listen on
+    :param port: port to listen on
+    :param token: shared token the coordinators send
+    """
+    with WorkerServer((host, port), token) as server:
+        logging.info('Worker listening on %s:%s', *server.server_address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def parse_address(address, default_port=8642):
+    """
+    Parse a host:port string.
+
+    :param address: string
+    :returns: (host, port) tuple
+    """
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        return address, default_port
+    return host, int(port)
+
+
+class Coordinator():
+    """
+    Dispatch tasks to workers.
+
+    :param workers: list of (host, port) tuples
+    :param token: shared token of the workers
+    :param timeout: timeout (in seconds) of a build on a worker
+    """
+    def __init__(self, workers, token, timeout=BUILD_TIMEOUT):
+        self.workers = list(workers)
+        self.token = token
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # Tasks to send, and number of tasks not built yet
+        # (queued or on a worker), guarded by `condition`
+        self.todo = collections.deque()
+        self.pending = 0
+        self.condition = threading.Condition()
+
+    def _send_task(self, connection, task, pdf_only):
+        """
+        Send a task to a worker and wait for the products.
+
+        :returns: header and files of the answer
+        """
+        inputs = list(task.dependencies)
+        if isinstance(task, TranslatedTask):
+            # Translated from the tex file of its task
+            inputs.append(task.task.tex)
+        files = []
+        for path in inputs:
+            with open(path, 'rb') as fh:
+                files.append((os.path.relpath(path), fh.read()))
+        send_message(connection, {'type': 'build',
+                                  'token': self.token,
+                                  'spec': task_spec(task),
+                                  'pdf_only': pdf_only},
+                     files)
+        return recv_message(connection)
+
+    def _store(self, task, db, header, files, pdf_only):
+        """
+        Write the products of a task and record the build,
+        with the versions of the tools of the worker.
+        """
+        os.makedirs(task.buildpath, exist_ok=True)
+        for product, content in files.items():
+            dest = _safe_path(task.buildpath, product)
+            with open(dest, 'wb') as fh:
+                fh.write(content)
+        task._set_engine(header['engine'])
+        task.tool_versions = header.get('tools', {})
+        with self.lock:
+            task.check_dependencies(db)
+            task.record_build(db, task.targets(pdf_only))
+        metrics.count_tasks('built')
+
+    def _next_task(self):
+        """
+        Wait for a task to send.
+
+        An idle worker waits while tasks are on other workers,
+        in case one of them is lost.
+
+        :returns: a task, None once all the tasks are built
+        """
+        with self.condition:
+            while not self.todo and self.pending:
+                self.condition.wait()
+            if not self.todo:
+                return None
+            return self.todo.popleft()
+
+    def _done(self, task=None):
+        """
+        Mark a task as built (or failed), or put it back in the
+        queue if it is given.
+        """
+        with self.condition:
+            if task is None:
+                self.pending -= 1
+            else:
+                self.todo.appendleft(task)
+            self.condition.notify_all()
+
+    def _run_worker(self, address, db, pdf_only, failed):
+        """
+        Feed a worker with tasks until they are all built
+        or the worker is lost.
+        """
+        try:
+            sock = socket.create_connection(address, timeout=self.timeout)
+        except OSError as err:
+            logging.warning('Worker %s:%s unreachable: %s',
+                            address[0], address[1], err)
+            return
+        with sock, sock.makefile('rwb') as connection:
+            while True:
+                task = self._next_task()
+                if task is None:
+                    return
+                try:
+                    header, files = self._send_task(connection, task, pdf_only)
+                except (OSError, ConnectionError, ValueError) as err:
+                    logging.warning('Worker %s:%s lost (%s), reschedule %s',
+                                    address[0], address[1], err, task.name)
+                    self._done(task)
+                    return
+                try:
+                    if header['type'] == 'result':
+                        logging.info('Built %s on %s:%s',
+                                     task.name, address[0], address[1])
+                        self._store(task, db, header, files, pdf_only)
+                    else:
+                        logging.error('Build of %s failed on %s:%s: %s',
+                                      task.name, address[0], address[1],
+                                      header.get('message'))
+                        with self.lock:
+                            failed.append(task)
+                finally:
+                    self._done()
+
+    def _dispatch(self, tasks, db, pdf_only, failed):
+        """
+        Build tasks on the workers.
+
+        :param failed: list of the tasks that failed, updated in place
+        :returns: list of the tasks left when all the workers are lost
+        """
+        self.todo = collections.deque(tasks)
+        self.pending = len(self.todo)
+        threads = [threading.Thread(target=self._run_worker,
+                                    args=(address, db, pdf_only, failed))
+                   for address in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return list(self.todo)
+
+    def build(self, tasks, db, pdf_only=False):
+        """
+        Build the outdated tasks on the workers.
+
+        Translated tasks are sent once the tex file of their task
+        is back. Tasks left when all the workers are lost are built
+        locally.
+
+        :param tasks: list of `Task` instances
+        :param db: `DataBase` instance
+        :param pdf_only: build only tex and pdf
+        :returns: list of tasks that failed
+        """
+        outdated = []
+        translations = []
+        for task in tasks:
+            if not task.needs_build(db, pdf_only=pdf_only):
+                logging.info('Nothing to do for %s' % task.name)
+                metrics.count_tasks('skipped')
+            elif isinstance(task, TranslatedTask):
+                translations.append(task)
+            else:
+                outdated.append(task)
+        failed = []
+        leftover = self._dispatch(outdated, db, pdf_only, failed)
+        if leftover:
+            # Translations wait for the local build of their task
+            leftover.extend(translations)
+        else:
+            for task in translations:
+                if task.task in failed:
+                    failed.append(task)
+            leftover = self._dispatch([task for task in translations
+                                       if task not in failed],
+                                      db, pdf_only, failed)
+        for task in leftover:
+            if isinstance(task, TranslatedTask) and task.task in failed:
+                failed.append(task)
+                continue
+            logging.warning('No worker left, build %s locally', task.name)
+            if pdf_only:
+                task.make_pdf(db)
+            else:
+                task.make(db)
+        return failed
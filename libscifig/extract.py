@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+Extract graphics paths from tex files, and find the tasks building them.
+"""
+
+import json
+import logging
+import os
+import os.path
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+
+# \includegraphics[options]{path} or \input{file} or \include{file}
+TOKEN_PATTERN = re.compile(r'\\includegraphics(\[.*?\]|){([a-zA-Z0-9\.\-_/]*)}'
+                           r'|\\(?:input|include){([^}]*)}')
+# % up to the end of the line, unless escaped by \%
+COMMENT_PATTERN = re.compile(r'(?<!\\)%.*')
+# Extensions of the graphics, other dots belong to the name
+GRAPHIC_EXTENSIONS = ('.pdf', '.eps', '.ps', '.png', '.jpg', '.jpeg',
+                      '.svg', '.tex')
+# Format of the cache entries, older entries are scanned again
+CACHE_FORMAT = 2
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                             'scifig', 'scifigextract.json')
+
+
+class ScanCache():
+    """
+    Cache of scanned tex files, keyed by absolute filepath and
+    validated by a (size, mtime) fingerprint.
+
+    :param path: filepath of the json cache, None to keep it in memory
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.data = {}
+        self.modified = False
+        if path is not None:
+            try:
+                with open(path, 'r') as f:
+                    self.data = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self.data = {}
+
+    def get(self, filepath, fingerprint):
+        """
+        Return the tokens of a file, or None if unknown or outdated.
+        """
+        entry = self.data.get(os.path.abspath(filepath))
+        if entry is not None and entry.get('format') == CACHE_FORMAT \
+                and entry['fingerprint'] == fingerprint:
+            return entry['tokens']
+        return None
+
+    def set(self, filepath, fingerprint, tokens):
+        """
+        Store the tokens of a file.
+        """
+        self.data[os.path.abspath(filepath)] = {'format': CACHE_FORMAT,
+                                                'fingerprint': fingerprint,
+                                                'tokens': tokens}
+        self.modified = True
+
+    def save(self):
+        """
+        Write the cache, if it has a path and has been modified.
+        """
+        if self.path is None or not self.modified:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.data, f)
+        self.modified = False
+
+
+# Used when no cache is given, lives as long as the process
+_memory_cache = ScanCache()
+
+
+def _fingerprint(filepath):
+    """
+    Return a cheap fingerprint of a file.
+    """
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _scan_file(texfilepath, cache):
+    """
+    List graphics and included files of a tex file, in order.
+
+    :param texfilepath: filepath for the texfile to parse
+    :param cache: `ScanCache` instance
+    :returns: list of ('graphic', path) or ('input', name) lists
+    """
+    fingerprint = _fingerprint(texfilepath)
+    tokens = cache.get(texfilepath, fingerprint)
+    if tokens is not None:
+        logging.debug('Cached %s', texfilepath)
+        return tokens
+    logging.debug('Read %s', texfilepath)
+    with open(texfilepath, 'r') as tex:
+        content = tex.read()
+    tokens = []
+    content = COMMENT_PATTERN.sub('', content)
+    for match in TOKEN_PATTERN.finditer(content):
+        logging.debug('regexp result: %s', match.group(0))
+        if match.group(3) is None:
+            tokens.append(['graphic', match.group(2)])
+        else:
+            tokens.append(['input', match.group(3).strip()])
+    cache.set(texfilepath, fingerprint, tokens)
+    return tokens
+
+
+def _resolve_input(name, basedir):
+    r"""
+    Return the filepath of an \input or \include, or None if not found.
+
+    :param name: argument of the command
+    :param basedir: directory of the main tex file
+    """
+    path = os.path.join(basedir, name)
+    for candidate in (path + '.tex', path):
+        if os.path.isfile(candidate):
+            return candidate
+    logging.warning('Included file not found: %s', name)
+    return None
+
+
+def get_graphics_paths(texfilepath, uniquify=False, recursive=True,
+                       cache=None, jobs=8):
+    r"""
+    Parse tex files and returns filepaths in \includegraphics{} latex
+    functions.
+
+    Files included with \input{} or \include{} are parsed too,
+    relatively to the directory of texfilepath.
+    Files of a same inclusion level are parsed in parallel.
+
+    :param texfilepath: filepath for the texfile to parse
+    :param uniquify: uniquify the list
+    :param recursive: follow \input and \include
+    :param cache: `ScanCache` instance, an in-memory cache by default
+    :param jobs: number of files parsed at once
+    """
+    if cache is None:
+        cache = _memory_cache
+    basedir = os.path.dirname(texfilepath)
+    scanned = {}
+    level = [texfilepath]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while level:
+            results = executor.map(lambda f: _scan_file(f, cache), level)
+            next_level = []
+            for filepath, tokens in zip(level, results):
+                scanned[filepath] = tokens
+                if not recursive:
+                    continue
+                for kind, value in tokens:
+                    if kind != 'input':
+                        continue
+                    included = _resolve_input(value, basedir)
+                    if included is not None and included not in scanned \
+                            and included not in next_level:
+                        next_level.append(included)
+            level = next_level
+
+    # Expand inclusions in document order
+    graphic_names = []
+    stack = [iter(scanned[texfilepath])]
+    visiting = [texfilepath]
+    while stack:
+        try:
+            kind, value = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            visiting.pop()
+            continue
+        if kind == 'graphic':
+            graphic_names.append(value)
+        elif recursive:
+            included = _resolve_input(value, basedir)
+            if included in scanned and included not in visiting:
+                stack.append(iter(scanned[included]))
+                visiting.append(included)
+    if uniquify:
+        return list(set(graphic_names))
+    return graphic_names
+
+
+def _path_parts(path, extensions=None):
+    """
+    Split a path in its components, without the extension
+    of the last one.
+
+    :param extensions: extensions to remove, any by default
+    """
+    root, ext = os.path.splitext(path)
+    if extensions is None or ext.lower() in extensions:
+        path = root
+    return os.path.normpath(path).split(os.sep)
+
+
+def _common_suffix(a, b):
+    """
+    Return the number of trailing components shared by two paths.
+    """
+    count = 0
+    for x, y in zip(reversed(a), reversed(b)):
+        if x != y:
+            break
+        count += 1
+    return count
+
+
+def select_tasks(tasks, texfilepaths, cache=None):
+    """
+    Select the tasks building the graphics of tex files.
+
+    A graphic matches the tasks sharing the longest path with it,
+    compared from the end and without extension. The graphic
+    fig/a/plot.pdf matches src/a/plot.tikz rather than src/b/plot.tikz,
+    the graphic plot.pdf matches both.
+
+    :param tasks: list of `Task` instances
+    :param texfilepaths: list of tex filepaths
+    :param cache: `ScanCache` instance
+    :returns: list of tasks, in the order of the list of tasks
+    """
+    by_name = {}
+    for task in tasks:
+        by_name.setdefault(task.name, []).append(
+            (_path_parts(task.id[len('ID:'):]), task))
+    selected = set()
+    for texfilepath in texfilepaths:
+        for graphic in get_graphics_paths(texfilepath, uniquify=True,
+                                          cache=cache):
+            parts = _path_parts(graphic, GRAPHIC_EXTENSIONS)
+            candidates = by_name.get(parts[-1], [])
+            if not candidates:
+                logging.debug('No task for %s', graphic)
+                continue
+            lengths = [_common_suffix(parts, path) for path, _ in candidates]
+            matches = [task for length, (_, task) in zip(lengths, candidates)
+                       if length == max(lengths)]
+            if len(matches) > 1:
+                logging.warning('Several tasks for %s: %s', graphic,
+                                ', '.join(t.get_name() for t in matches))
+            selected.update(matches)
+    return [task for task in tasks if task in selected]
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+Metrics of a run: tasks built, time spent in each tool,
+bytes hashed and exported, database load and save time.
+
+The modules record the metrics in a global registry,
+which is written in json or as a Prometheus textfile
+(for the textfile collector of node_exporter) at the end of a run.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import os.path
+import tempfile
+import threading
+import time
+
+
+TASK_STATES = ('considered', 'built', 'skipped', 'failed')
+
+_lock = threading.Lock()
+_tasks = collections.Counter()
+_tool_seconds = collections.Counter()
+_db_seconds = collections.Counter()
+_bytes = collections.Counter()
+_start = time.time()
+
+
+def reset():
+    """
+    Forget the metrics, to start a new run.
+    """
+    global _start
+    with _lock:
+        _tasks.clear()
+        _tool_seconds.clear()
+        _db_seconds.clear()
+        _bytes.clear()
+        _start = time.time()
+
+
+def count_tasks(state, number=1):
+    """
+    Count tasks.
+
+    :param state: considered, built, skipped or failed
+    :param number: number of tasks
+    """
+    with _lock:
+        _tasks[state] += number
+
+
+def add_tool_time(tool, seconds):
+    """
+    Add the time spent running a tool.
+
+    :param tool: tool name
+    :param seconds: duration
+    """
+    with _lock:
+        _tool_seconds[tool] += seconds
+
+
+def add_bytes(kind, size):
+    """
+    Add processed bytes.
+
+    :param kind: hashed or exported
+    :param size: number of bytes
+    """
+    with _lock:
+        _bytes[kind] += size
+
+
+@contextlib.contextmanager
+def db_timer(operation):
+    """
+    Measure a database operation.
+
+    :param operation: load or save
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _db_seconds[operation] += time.perf_counter() - start
+
+
+def snapshot():
+    """
+    Return the metrics of the run.
+
+    :returns: json-serializable dict
+    """
+    with _lock:
+        return {'timestamp': time.time(),
+                'run_seconds': time.time() - _start,
+                'tasks': {state: _tasks[state] for state in TASK_STATES},
+                'tool_seconds': dict(_tool_seconds),
+                'bytes_hashed': _bytes['hashed'],
+                'bytes_exported': _bytes['exported'],
+                'db_seconds': {'load': _db_seconds['load'],
+                               'save': _db_seconds['save']},
+                }
+
+
+def _write_atomic(path, content):
+    """
+    Write a file at once, readers never see a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def write_json(path, metrics=None):
+    """
+    Write the metrics in json.
+
+    :param path: filepath of the json file
+    :param metrics: dict returned by :func:`snapshot`, the current
+                    metrics by default
+    """
+    if metrics is None:
+        metrics = snapshot()
+    _write_atomic(path, json.dumps(metrics, indent=2) + '\n')
+
+
+def prometheus(metrics):
+    """
+    Format the metrics for Prometheus.
+
+    :param metrics: dict returned by :func:`snapshot`
+    :returns: string in the text exposition format
+    """
+    lines = []
+
+    def metric(name, description, samples):
+        lines.append('# HELP scifig_%s %s' % (name, description))
+        lines.append('# TYPE scifig_%s gauge' % name)
+        for labels, value in samples:
+            lines.append('scifig_%s%s %s' % (name, labels, repr(float(value))))
+
+    metric('last_run_timestamp_seconds', 'End of the last run.',
+           [('', metrics['timestamp'])])
+    metric('run_seconds', 'Duration of the last run.',
+           [('', metrics['run_seconds'])])
+    metric('tasks', 'Tasks of the last run.',
+           [('{state="%s"}' % state, value)
+            for state, value in sorted(metrics['tasks'].items())])
+    metric('tool_seconds', 'Time spent running each tool.',
+           [('{tool="%s"}' % tool, value)
+            for tool, value in sorted(metrics['tool_seconds'].items())])
+    metric('hashed_bytes', 'Bytes hashed to detect changes.',
+           [('', metrics['bytes_hashed'])])
+    metric('exported_bytes', 'Bytes copied by the exports.',
+           [('', metrics['bytes_exported'])])
+    metric('db_seconds', 'Time spent loading and saving the database.',
+           [('{operation="%s"}' % operation, value)
+            for operation, value in sorted(metrics['db_seconds'].items())])
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path, metrics=None):
+    """
+    Write the metrics as a Prometheus textfile.
+
+    :param path: filepath of the .prom file
+    :param metrics: dict returned by :func:`snapshot`, the current
+                    metrics by default
+    """
+    if metrics is None:
+        metrics = snapshot()
+    _write_atomic(path, prometheus(metrics))
@@ -0,0 +1,575 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+A :class:`Project` is a working directory containing the sources
+of the figures in `src/`, the build directory `build/` and the
+database `db.json`.
+
+It holds the tasks and the database, so that they can be reused
+between several builds by a long-lived process.
+"""
+
+import logging
+import os
+import os.path
+import shutil
+
+from libscifig import (aiobuild, bundle, detector, distributed, extract,
+                       metrics, pyrunner)
+from libscifig.checksum import read_git_index
+from libscifig.database import CACHE_ID, DataBase
+from libscifig.task import base_tools, product_filename
+from libscifig.toolchain import Toolchain
+
+
+# Files written in the build dir by a task, besides its products
+INTERMEDIATE_SUFFIXES = ('.tex', '.plt', '.plttikz', '.pgf', '.tikz',
+                         '-raw.pdf', '.aux', '.log')
+
+
+def _size(path):
+    """
+    Return the size of a file or a directory tree, in bytes.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+def _remove(path, dry_run=False):
+    """
+    Remove a file or a directory tree.
+
+    :returns: reclaimed bytes
+    """
+    size = _size(path)
+    logging.info('Remove %s (%i bytes)', path, size)
+    if not dry_run:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    return size
+
+
+def build_options(engine='pdflatex', scratch=None, tools=None,
+                  png_dpi=(600,), png_device='png16m', svg_precision=None,
+                  svgz=False, pdf_optimize=False, git=False,
+                  markers=detector.FIGURE_MARKERS):
+    """
+    Return the options changing the built files, as json values.
+
+    Paths are absolute, so that the options of two processes
+    running in different directories can be compared.
+
+    :returns: dict
+    """
+    def path(filepath):
+        if os.sep in filepath:
+            return os.path.abspath(filepath)
+        # A command searched on the PATH
+        return filepath
+
+    return {'engine': engine,
+            'scratch': None if scratch is None else os.path.abspath(scratch),
+            'tools': {name: path(filepath)
+                      for name, filepath in (tools or {}).items()},
+            'png_dpi': sorted(set(png_dpi)),
+            'png_device': png_device,
+            'svg_precision': svg_precision,
+            'svgz': svgz,
+            'pdf_optimize': pdf_optimize,
+            'git': git,
+            'markers': sorted(set(markers))}
+
+
+class Project():
+    """
+    Figures of a working directory.
+
+    :param workingdir: directory containing `src/`
+    :param engine: LaTeX engine of the tasks
+    :param scratch: scratch dir of the tasks
+    :param tools: dict tool name -> filepath, tools not listed
+                  are searched on the PATH
+    :param png_dpi: resolutions of the png variants
+    :param png_device: ghostscript device of the png
+    :param svg_precision: decimals of the optimized svg, None to skip it
+    :param svgz: compress the optimized svg
+    :param pdf_optimize: optimize the pdf with ghostscript
+    :param hash_workers: number of threads hashing the dependencies
+    :param markers: patterns of the files marking a figure directory
+    :param scan_workers: number of threads scanning the directories
+    :param git: trust the git index for the tracked dependencies
+                which did not change, see :class:`checksum.GitIndex`
+    """
+    def __init__(self, workingdir='.', engine='pdflatex', scratch=None,
+                 tools=None, png_dpi=(600,), png_device='png16m',
+                 svg_precision=None, svgz=False, pdf_optimize=False,
+                 hash_workers=8, markers=detector.FIGURE_MARKERS,
+                 scan_workers=8, git=False):
+        self.workingdir = workingdir
+        self.src = os.path.join(workingdir, 'src')
+        self.build_dir = os.path.join(workingdir, 'build')
+        self.engine = engine
+        self.scratch = scratch
+        self.tools = tools
+        self.png_dpi = png_dpi
+        self.png_device = png_device
+        self.svg_precision = svg_precision
+        self.svgz = svgz
+        self.pdf_optimize = pdf_optimize
+        self.hash_workers = hash_workers
+        self.markers = markers
+        self.scan_workers = scan_workers
+        self.git = git
+        self.db = DataBase(os.path.join(workingdir, 'db.json'))
+        self.db.load()
+        self.toolchain = Toolchain(tools, self.db.get(CACHE_ID, 'toolchain'))
+        # Compact records of the figures, see detector.TaskRecord
+        self.records = []
+        # Tasks created from the records by the last select or stream
+        self.tasks = []
+        # Figure directory -> (specs, records) of the last detection,
+        # records are reused while the cached specs are unchanged
+        self._directories = {}
+        # Record -> task, tasks are reused with their records
+        self._expanded = {}
+
+    def options(self):
+        """
+        Return the options changing the built files,
+        see :func:`build_options`.
+        """
+        return build_options(engine=self.engine, scratch=self.scratch,
+                             tools=self.tools, png_dpi=self.png_dpi,
+                             png_device=self.png_device,
+                             svg_precision=self.svg_precision,
+                             svgz=self.svgz, pdf_optimize=self.pdf_optimize,
+                             git=self.git, markers=self.markers)
+
+    def _records(self, directory, specs, directories):
+        """
+        Return the records of a figure directory.
+
+        The records of the previous detection are reused if the
+        directory was not scanned again: its specs are the very
+        same cached list.
+
+        :param directories: dict updated with the records
+        :returns: list of `TaskRecord` instances
+        """
+        previous = self._directories.get(directory)
+        if previous is not None and previous[0] is specs:
+            records = previous[1]
+        else:
+            records = detector.create_records(specs, engine=self.engine,
+                                              scratch=self.scratch,
+                                              png_dpi=self.png_dpi,
+                                              png_device=self.png_device,
+                                              svg_precision=self.svg_precision,
+                                              svgz=self.svgz,
+                                              pdf_optimize=self.pdf_optimize)
+        directories[directory] = (specs, records)
+        return records
+
+    def _iter_records(self, cache, directories):
+        """
+        Detect the records as a stream, see :func:`detector.iter_specs`.
+
+        :param cache: detection cache, updated in place
+        :param directories: dict updated with the records
+                            of each directory
+        :returns: generator of `TaskRecord` instances
+        """
+        for directory, specs in detector.iter_specs(self.src,
+                                                    self.workingdir,
+                                                    markers=self.markers,
+                                                    cache=cache,
+                                                    workers=self.scan_workers):
+            yield from self._records(directory, specs, directories)
+
+    def _forget(self, directories):
+        """
+        Keep the records and tasks of the detected directories only.
+        """
+        self._directories = directories
+        live = {record for specs, records in directories.values()
+                for record in records}
+        self._expanded = {record: task
+                          for record, task in self._expanded.items()
+                          if record in live}
+
+    def _expand(self, record):
+        """
+        Return the task of a record, created once.
+
+        A translation and its task share the same task instance.
+        """
+        task = self._expanded.get(record)
+        if task is None:
+            if record.task is not None:
+                task = record.expand(task=self._expand(record.task))
+            else:
+                task = record.expand()
+            self._expanded[record] = task
+        return task
+
+    def detect(self, force=False):
+        """
+        Detect the tasks.
+
+        Only the figure directories modified since the last detection
+        are scanned, see :func:`detector.iter_specs`. The records (and
+        tasks) of the other directories are reused.
+
+        :param force: scan all the directories
+        :returns: list of `TaskRecord` instances
+        """
+        if force:
+            cache = {}
+        else:
+            cache = self.db.get(CACHE_ID, 'detection')
+        logging.debug('Detect tasks in %s', self.src)
+        directories = {}
+        for _ in self._iter_records(cache, directories):
+            pass
+        self._forget(directories)
+        self.records = [record for directory in sorted(directories)
+                        for record in directories[directory][1]]
+        self.db.set(CACHE_ID, 'detection', cache)
+        return self.records
+
+    def watched_paths(self):
+        """
+        Return the files whose changes may need a build:
+        the dependencies of the figures, and the scanned directories,
+        which change when a file is added or removed.
+
+        :returns: sorted list of filepaths
+        """
+        paths = {dep for record in self.detect()
+                 for dep in record.dependencies}
+        for directory, entry in self.db.get(CACHE_ID, 'detection').items():
+            if directory != detector.CACHE_SIGNATURE:
+                paths.update(entry['mtimes'])
+        return sorted(paths)
+
+    def _read_git_index(self):
+        """
+        Read the git index, if enabled, before checking the dependencies.
+        """
+        if self.git:
+            self.db.checksums.git = read_git_index(self.workingdir)
+
+    def _new_toolchain(self, remote=False, probe=True):
+        """
+        Search the tools again, a long-lived process sees the upgrades.
+
+        :param remote: the tools run on remote workers
+        :param probe: False to use the cached versions only
+        """
+        self.toolchain = Toolchain(self.tools,
+                                   self.db.get(CACHE_ID, 'toolchain'),
+                                   local=not remote, probe=probe)
+
+    def stream(self, pdf_only=False, remote=False):
+        """
+        Detect the tasks as a stream, ready to build: the first tasks
+        are built while the dependencies are still hashed.
+
+        Only the outdated figures are created as tasks, up-to-date
+        ones stay records. The tools needed by every figure are checked
+        before the directories are scanned, the tools of the kinds of
+        figures found (gnuplot) before the first task: a missing tool
+        stops the stream before any build.
+
+        :param pdf_only: build only tex and pdf
+        :param remote: the tasks are built on remote workers, tools
+                       are not needed locally
+        :returns: generator of tasks
+        :raises: ToolNotFoundError
+        """
+        cache = self.db.get(CACHE_ID, 'detection')
+        self._new_toolchain(remote)
+        self.toolchain.check(base_tools(self.engine, pdf_only=pdf_only,
+                                        pdf_optimize=self.pdf_optimize))
+        python_versions = pyrunner.versions()
+        self._read_git_index()
+        self.records = []
+        self.tasks = []
+        directories = {}
+        logging.debug('Detect tasks in %s', self.src)
+        records = list(self._iter_records(cache, directories))
+        self.toolchain.check(tool for record in records
+                             for tool in record.tools(pdf_only))
+        for record in records:
+            self.records.append(record)
+            metrics.count_tasks('considered')
+            self.db.checksums.prime(record.dependencies,
+                                    workers=self.hash_workers)
+            if record.is_current(self.db, self.toolchain, python_versions,
+                                 pdf_only=pdf_only):
+                # Not even created
+                logging.info('Nothing to do for %s' % record.name)
+                metrics.count_tasks('skipped')
+                continue
+            task = self._expand(record)
+            task.use_toolchain(self.toolchain)
+            self.tasks.append(task)
+            yield task
+        self._forget(directories)
+        self.db.set(CACHE_ID, 'detection', cache)
+        self.db.set(CACHE_ID, 'toolchain', self.toolchain.cache)
+
+    def select(self, texfiles=None, remote=False, probe=True):
+        """
+        Return the tasks to build.
+
+        :param texfiles: only the figures included in these tex files
+        :param remote: the tasks are built on remote workers, tools
+                       are not needed locally
+        :param probe: False to use the cached versions of the tools
+                      only, without running them
+        """
+        records = self.detect()
+        self._read_git_index()
+        if texfiles:
+            # Only build what the documents need
+            cache = extract.ScanCache(extract.DEFAULT_CACHE)
+            selected = extract.select_tasks(records, texfiles, cache=cache)
+            cache.save()
+            # Translations need the tex file of their task
+            needed = set(selected)
+            needed.update(record.task for record in selected
+                          if record.task is not None)
+            records = [record for record in records if record in needed]
+            logging.info('%i figures needed by %s', len(records),
+                         ', '.join(texfiles))
+        self.tasks = tasks = [self._expand(record) for record in records]
+        # Tools are searched once per run
+        self._new_toolchain(remote, probe=probe)
+        for task in tasks:
+            task.use_toolchain(self.toolchain)
+        self.db.set(CACHE_ID, 'toolchain', self.toolchain.cache)
+        # Hash the dependencies at once, rather than task by task
+        self.db.checksums.prime((dep for task in tasks
+                                 for dep in task.dependencies),
+                                workers=self.hash_workers)
+        return tasks
+
+    def build(self, tasks, pdf_only=False, jobs=1, workers=None,
+              memory=None, worker_token=None):
+        """
+        Build tasks.
+
+        :param tasks: list of tasks, or generator returned by :func:`stream`
+        :param pdf_only: build only tex and pdf
+        :param jobs: number of external tools running at once
+        :param memory: memory budget of the external tools (bytes) when
+                       jobs > 1, see :class:`libscifig.aiobuild.MemoryBudget`
+        :param workers: list of (host, port) of remote workers
+        :param worker_token: shared token of the workers
+        :returns: list of tasks that failed
+        :raises: ToolNotFoundError before building if a tool is missing
+        """
+        if isinstance(tasks, list):
+            # A stream checks its tools before its first task
+            self.toolchain.check(tool for task in tasks
+                                 for tool in task.tools(pdf_only))
+            metrics.count_tasks('considered', len(tasks))
+        os.makedirs(self.build_dir, exist_ok=True)
+        if workers:
+            coordinator = distributed.Coordinator(workers, worker_token)
+            failed = coordinator.build(tasks, self.db, pdf_only=pdf_only)
+        elif jobs > 1:
+            failed = aiobuild.build(tasks, self.db, jobs=jobs,
+                                    pdf_only=pdf_only, memory=memory)
+        else:
+            failed = []
+            for task in tasks:
+                try:
+                    if pdf_only:
+                        task.make_pdf(self.db)
+                    else:
+                        task.make(self.db)
+                except Exception:
+                    metrics.count_tasks('failed')
+                    raise
+        metrics.count_tasks('failed', len(failed))
+        return failed
+
+    def status(self, pdf_only=False, texfiles=None):
+        """
+        Explain which figures must be built and why, without building.
+
+        No tool is run: the versions of the tools are those cached
+        by a previous build, unknown versions are not compared.
+
+        :param pdf_only: build only tex and pdf
+        :param texfiles: only the figures included in these tex files
+        :returns: list of dicts, see `Task.explain`
+        """
+        return [task.explain(self.db, pdf_only=pdf_only)
+                for task in self.select(texfiles, probe=False)]
+
+    def _build_path(self, dirname):
+        """
+        Return the absolute build path of a figure directory.
+
+        :param dirname: directory of the figure, relative to the
+                        current directory like the task IDs
+        """
+        return os.path.abspath(os.path.join(
+            self.build_dir, os.path.relpath(dirname, self.workingdir)))
+
+    def collect_garbage(self, dest=None, dry_run=False):
+        """
+        Remove the build files, database entries and optionally
+        exported files of the figures which do not exist anymore.
+
+        Only the files of the recorded tasks are removed, below the
+        build directory of the project. Checksums of files which are
+        not a dependency anymore are forgotten.
+
+        :param dest: filepath of the export directory, None to keep
+                     exported files
+        :param dry_run: only report what would be removed
+        :returns: dict with the keys tasks (removed task IDs)
+                  and bytes (reclaimed bytes)
+        """
+        records = self.detect(force=True)
+        live_ids = {record.id for record in records}
+        live_names = {record.name for record in records}
+        live_buildpaths = {self._build_path(os.path.dirname(record.filepath))
+                           for record in records}
+        live_deps = {os.path.abspath(dep) for record in records
+                     for dep in record.dependencies}
+        stale_ids = [name for name in self.db.data
+                     if name.startswith('ID:') and name not in live_ids]
+        build_dir = os.path.abspath(self.build_dir)
+        reclaimed = 0
+
+        stale_buildpaths = set()
+        for task_id in stale_ids:
+            dirname, filename = os.path.split(task_id[len('ID:'):])
+            name = os.path.splitext(filename)[0]
+            targets = self.db.get(task_id, 'targets')
+            # Same build path as the task had
+            buildpath = self._build_path(dirname)
+            if not buildpath.startswith(build_dir + os.sep):
+                logging.warning('Build path of %s outside of %s, kept',
+                                task_id, self.build_dir)
+            elif buildpath in live_buildpaths:
+                # Shared with live tasks, remove only its own files
+                products = {product_filename(name, target)
+                            for target in targets}
+                products.update(name + suffix
+                                for suffix in INTERMEDIATE_SUFFIXES)
+                for product in sorted(products):
+                    path = os.path.join(buildpath, product)
+                    if os.path.isfile(path):
+                        reclaimed += _remove(path, dry_run)
+            else:
+                stale_buildpaths.add(buildpath)
+            if dest is not None and name not in live_names:
+                for ext in targets:
+                    exported = os.path.join(dest, ext,
+                                            product_filename(name, ext))
+                    if os.path.isfile(exported):
+                        reclaimed += _remove(exported, dry_run)
+            logging.info('Forget %s', task_id)
+            if not dry_run:
+                del self.db.data[task_id]
+
+        # Build directories of stale tasks only, unless live tasks
+        # are built below
+        for buildpath in sorted(stale_buildpaths):
+            if os.path.isdir(buildpath) and \
+                    not any(live.startswith(buildpath + os.sep)
+                            for live in live_buildpaths):
+                reclaimed += _remove(buildpath, dry_run)
+
+        # Checksums of files which are not a dependency anymore
+        stale_deps = [dep for dep in self.db.checksums.data
+                      if os.path.abspath(dep) not in live_deps]
+        logging.info('Forget the checksums of %i files', len(stale_deps))
+        if not dry_run:
+            for dep in stale_deps:
+                del self.db.checksums.data[dep]
+
+        if not dry_run:
+            self.db.save()
+        logging.info('%i tasks removed, %i bytes reclaimed',
+                     len(stale_ids), reclaimed)
+        return {'tasks': stale_ids, 'bytes': reclaimed}
+
+    def export(self, tasks, dest='/tmp'):
+        """
+        Export tasks.
+
+        :param tasks: list of tasks
+        :param dest: filepath of the destination directory
+        """
+        for task in tasks:
+            task.export(self.db, dst=dest)
+
+    def write_bundle(self, tasks, path, formats=None, fmt=None):
+        """
+        Write the built files of tasks in a bundle,
+        see :func:`bundle.write_bundle`.
+
+        :param tasks: tasks or task records
+        :param path: filepath of the bundle, - for stdout
+        :param formats: targets to bundle, all by default
+        :param fmt: format of the bundle, guessed from path by default
+        """
+        return bundle.write_bundle(tasks, self.db, path, formats=formats,
+                                   fmt=fmt)
+
+    def run(self, dest='/tmp', pdf_only=False, jobs=1, workers=None,
+            texfiles=None, bundle_path=None, formats=None, bundle_fmt=None,
+            memory=None, worker_token=None):
+        """
+        Build and export the figures, and save the database.
+
+        Without texfiles, tasks are built as they are detected.
+        With a bundle path, all the built figures are written in
+        the bundle instead of being exported in dest.
+
+        :returns: list of tasks that failed
+        """
+        remote = bool(workers)
+        if texfiles:
+            tasks = self.select(texfiles, remote=remote)
+        else:
+            tasks = self.stream(pdf_only=pdf_only, remote=remote)
+        try:
+            failed = self.build(tasks, pdf_only=pdf_only, jobs=jobs,
+                                workers=workers, memory=memory,
+                                worker_token=worker_token)
+            if bundle_path is not None:
+                if not texfiles:
+                    # Up-to-date figures too
+                    tasks = self.records
+                failed_ids = {task.id for task in failed}
+                self.write_bundle([task for task in tasks
+                                   if task.id not in failed_ids],
+                                  bundle_path, formats=formats,
+                                  fmt=bundle_fmt)
+                return failed
+            if not texfiles:
+                # Outdated tasks of the stream
+                tasks = self.tasks
+            self.export([task for task in tasks if task not in failed],
+                        dest=dest)
+        finally:
+            self.db.save()
+        return failed
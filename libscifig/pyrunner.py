@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+Run the python scripts of the figures in a pool of warm interpreters.
+
+The interpreters import the heavy modules (numpy, matplotlib...) once
+when they start, so that scripts do not pay for these imports.
+Each script runs as `__main__` in the working directory of its task.
+"""
+
+import contextlib
+import importlib
+import io
+import logging
+import os
+import os.path
+import platform
+import runpy
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+from multiprocessing import get_context
+
+
+# Modules imported by the interpreters when they start
+WARM_MODULES = ('numpy', 'matplotlib', 'matplotlib.pyplot')
+
+_executor = None
+# matplotlib settings after the warm up, restored after each script
+_rcparams = None
+
+
+def _warm_up(modules):
+    """
+    Import the modules in a new interpreter.
+
+    :param modules: module names, missing modules are skipped
+    """
+    global _rcparams
+    # No display in the workers
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    if 'matplotlib' in sys.modules:
+        _rcparams = sys.modules['matplotlib'].rcParams.copy()
+
+
+def _reset():
+    """
+    Forget the figures and settings left by a script.
+    """
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+    if _rcparams is not None:
+        sys.modules['matplotlib'].rcParams.update(_rcparams)
+
+
+def _forget_modules(modules, directories):
+    """
+    Forget the modules imported from directories by a script,
+    so that the next script imports its own modules of the same name.
+
+    :param modules: names of the modules loaded before the script
+    :param directories: absolute filepaths
+    """
+    directories = tuple(os.path.join(directory, '')
+                        for directory in directories)
+    for name in set(sys.modules) - modules:
+        filepath = getattr(sys.modules[name], '__file__', None)
+        if filepath and os.path.abspath(filepath).startswith(directories):
+            del sys.modules[name]
+
+
+def run_script(script, cwd):
+    """
+    Run a script in the current interpreter.
+
+    :param script: absolute filepath of the script
+    :param cwd: absolute filepath of the working directory
+    :returns: stdout and stderr (strings), stderr holds the traceback
+              if the script failed
+    """
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    previous = os.getcwd()
+    argv = sys.argv
+    path = list(sys.path)
+    modules = set(sys.modules)
+    try:
+        os.chdir(cwd)
+        sys.argv = [script]
+        # Modules next to the script can be imported
+        sys.path.insert(0, os.path.dirname(script))
+        with contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(stderr):
+            try:
+                runpy.run_path(script, run_name='__main__')
+            except SystemExit as err:
+                if err.code:
+                    raise
+    except (Exception, SystemExit):
+        traceback.print_exc(file=stderr)
+    finally:
+        os.chdir(previous)
+        sys.argv = argv
+        sys.path[:] = path
+        _forget_modules(modules, (os.path.dirname(script), cwd))
+        _reset()
+    return stdout.getvalue(), stderr.getvalue()
+
+
+def start(workers=None, modules=WARM_MODULES):
+    """
+    Start the pool of interpreters, if not started yet.
+
+    :param workers: number of interpreters, the number of cpus by default
+    :param modules: modules imported by the interpreters
+    """
+    global _executor
+    if _executor is None:
+        logging.debug('Start python interpreters, import %s',
+                      ', '.join(modules))
+        _executor = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=get_context('spawn'),
+                                        initializer=_warm_up,
+                                        initargs=(modules,))
+    return _executor
+
+
+def shutdown():
+    """
+    Stop the pool of interpreters.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def submit(script, cwd):
+    """
+    Run a script in the pool, see :func:`run_script`.
+
+    :returns: `concurrent.futures.Future` of stdout and stderr
+    """
+    return start().submit(run_script, os.path.abspath(script),
+                          os.path.abspath(cwd))
+
+
+def versions(modules=WARM_MODULES):
+    """
+    Return the versions of python and of the modules,
+    without importing them.
+
+    :param modules: module names
+    :returns: string
+    """
+    parts = ['Python ' + platform.python_version()]
+    for package in sorted({module.split('.')[0] for module in modules}):
+        try:
+            parts.append('%s %s' % (package, metadata.version(package)))
+        except metadata.PackageNotFoundError:
+            pass
+    return ', '.join(parts)
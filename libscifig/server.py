@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+Long-lived build server.
+
+The server keeps a :class:`Project` (tasks, database and checksums)
+in memory and answers requests on a Unix socket.
+Each request and each answer is a json object on one line::
+
+    {"command": "build", "dest": "/tmp", "pdf_only": false,
+     "options": {...}, "texfiles": ["/abs/doc.tex"]}
+    {"status": "ok", "built": [...], "failed": [...], "metrics": {...}}
+
+Commands are `build`, `export`, `status` and `rescan`.
+Requests are handled one at a time.
+
+The database is read again when another process (gc, a build with
+--bundle or --workers) wrote it since the previous request, so that
+the server does not overwrite its changes.
+
+The options of a request are those of the client
+(see :func:`project.build_options`). A request whose options differ
+from the options of the server is refused: the server would build
+other files than the client expects. Paths are absolute.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+
+from libscifig import metrics
+
+SOCKET_NAME = '.scifig.sock'
+
+
+def socket_path(workingdir):
+    """
+    Return the filepath of the socket of a working directory.
+    """
+    return os.path.join(workingdir, SOCKET_NAME)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answer the requests of a client.
+    """
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode())
+                answer = self.server.answer(request)
+            except Exception as err:
+                logging.error('Request failed: %s', err)
+                answer = {'status': 'error', 'message': str(err)}
+            self.wfile.write(json.dumps(answer).encode() + b'\n')
+            self.wfile.flush()
+
+
+class BuildServer(socketserver.UnixStreamServer):
+    """
+    Build server of a project.
+
+    :param project: `Project` instance
+    :param path: filepath of the Unix socket
+    :param jobs: number of external tools running at once
+    :param memory: memory budget of the external tools (bytes)
+    """
+    def __init__(self, project, path, jobs=1, memory=None):
+        self.project = project
+        self.jobs = jobs
+        self.memory = memory
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+
+    def check_options(self, request):
+        """
+        Refuse a request whose options differ from the server options.
+
+        :param request: dict
+        """
+        options = self.project.options()
+        requested = request.get('options', {})
+        differ = sorted(name for name in options.keys() | requested.keys()
+                        if options.get(name) != requested.get(name))
+        if differ:
+            raise ValueError('Options differ from the server options: %s '
+                             '(restart the server with these options)'
+                             % ', '.join(differ))
+
+    def answer(self, request):
+        """
+        Run a request.
+
+        :param request: dict
+        :returns: dict
+        """
+        command = request.get('command')
+        project = self.project
+        if command in ('build', 'export', 'status'):
+            self.check_options(request)
+        if project.db.modified():
+            logging.info('Database written by another process, read again')
+            project.db.load()
+        if command == 'build':
+            metrics.reset()
+            pdf_only = request.get('pdf_only', False)
+            tasks = project.select(request.get('texfiles'))
+            outdated = [task for task in tasks
+                        if task.needs_build(project.db, pdf_only)]
+            try:
+                failed = project.build(outdated, pdf_only=pdf_only,
+                                       jobs=request.get('jobs', self.jobs),
+                                       memory=(request.get('memory')
+                                               or self.memory))
+                project.export([task for task in tasks if task not in failed],
+                               dest=request.get('dest', '/tmp'))
+            finally:
+                project.db.save()
+            return {'status': 'ok',
+                    'built': [task.get_name() for task in outdated
+                              if task not in failed],
+                    'failed': [task.get_name() for task in failed],
+                    'metrics': metrics.snapshot()}
+        elif command == 'export':
+            tasks = project.select(request.get('texfiles'))
+            project.export(tasks, dest=request.get('dest', '/tmp'))
+            project.db.save()
+            return {'status': 'ok'}
+        elif command == 'status':
+            return {'status': 'ok',
+                    'tasks': project.status(request.get('pdf_only', False),
+                                            request.get('texfiles'))}
+        elif command == 'rescan':
+            return {'status': 'ok',
+                    'tasks': len(project.detect(force=True))}
+        raise ValueError('Unknown command: %s' % command)
+
+
+def serve(project, jobs=1, memory=None):
+    """
+    Run a build server until interrupted.
+
+    :param project: `Project` instance
+    :param jobs: number of external tools running at once
+    :param memory: memory budget of the external tools (bytes)
+    """
+    path = socket_path(project.workingdir)
+    if os.path.exists(path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            # Remove the socket of a dead server
+            os.remove(path)
+        else:
+            raise RuntimeError('A build server is already running on %s'
+                               % path)
+        finally:
+            sock.close()
+    server = BuildServer(project, path, jobs=jobs, memory=memory)
+    logging.info('Build server listening on %s', path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+        project.db.save()
+
+
+def request(workingdir, message):
+    """
+    Send a request to the build server of a working directory.
+
+    :param workingdir: directory containing `src/`
+    :param message: dict
+    :returns: the answer (dict), or None if no server is running
+    """
+    path = socket_path(workingdir)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    with sock, sock.makefile('rwb') as connection:
+        connection.write(json.dumps(message).encode() + b'\n')
+        connection.flush()
+        line = connection.readline()
+    if not line:
+        return None
+    return json.loads(line.decode())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+Optimize the svg files written by pdf2svg, in python.
+
+pdf2svg (cairo) defines the glyphs of each font subset as symbols,
+so that the same glyph is often defined several times, and writes
+coordinates with full precision. The optimizer merges identical
+symbols and clip paths, rounds the coordinates and removes
+the indentation. The result can be compressed (svgz).
+"""
+
+import gzip
+import logging
+import math
+import os
+import re
+import xml.etree.ElementTree as ET
+
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+
+# Attributes holding coordinates
+ROUNDED_ATTRIBUTES = ('d', 'points', 'x', 'y', 'x1', 'y1',
+                      'x2', 'y2', 'cx', 'cy', 'r', 'rx', 'ry',
+                      'width', 'height')
+# Definitions merged when identical
+MERGED_TAGS = ('{%s}symbol' % SVG_NS, '{%s}clipPath' % SVG_NS)
+HREF = '{%s}href' % XLINK_NS
+NUMBER_PATTERN = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+TRANSFORM_PATTERN = re.compile(r'([a-zA-Z]+)\s*\(([^)]*)\)')
+
+
+def _shorten(number, decimals):
+    """
+    Write a number with at most a number of decimals.
+    """
+    number = '%.*f' % (decimals, number)
+    if '.' in number:
+        number = number.rstrip('0').rstrip('.')
+    if number == '-0':
+        number = '0'
+    return number
+
+
+def round_numbers(value, precision=3):
+    """
+    Round the numbers of an attribute.
+
+    :param value: attribute value
+    :param precision: number of decimals
+    :returns: attribute value
+    """
+    def shorten(match):
+        return _shorten(float(match.group(0)), precision)
+    return NUMBER_PATTERN.sub(shorten, value)
+
+
+def _shorten_factor(number, precision):
+    """
+    Write a scale factor with a number of decimals,
+    but at least that many significant digits.
+    """
+    number = float(number)
+    decimals = precision
+    if number:
+        decimals = max(precision,
+                       precision - 1 - math.floor(math.log10(abs(number))))
+    return _shorten(number, decimals)
+
+
+def round_transform(value, precision=3):
+    """
+    Round the numbers of a transform attribute.
+
+    The translations and angles are rounded like coordinates. The
+    factors of scale() and the first four of matrix() keep their
+    significant digits: they multiply all the coordinates.
+
+    :param value: attribute value
+    :param precision: number of decimals
+    :returns: attribute value
+    """
+    def shorten(match):
+        function, args = match.groups()
+        numbers = NUMBER_PATTERN.findall(args)
+        if function == 'matrix':
+            factors = 4
+        elif function == 'scale':
+            factors = len(numbers)
+        else:
+            factors = 0
+        rounded = ([_shorten_factor(number, precision)
+                    for number in numbers[:factors]]
+                   + [_shorten(float(number), precision)
+                      for number in numbers[factors:]])
+        return '%s(%s)' % (function, ','.join(rounded))
+    return TRANSFORM_PATTERN.sub(shorten, value)
+
+
+def _signature(element):
+    """
+    Return the content of a definition, without its id.
+    """
+    attrib = {key: value for key, value in element.attrib.items()
+              if key != 'id'}
+    return (element.tag, tuple(sorted(attrib.items())),
+            ET.tostring(element, encoding='unicode').split('>', 1)[1])
+
+
+def merge_definitions(root):
+    """
+    Remove the definitions identical to a previous one
+    and refer to the previous one instead.
+
+    :param root: root element of the svg
+    :returns: number of removed definitions
+    """
+    kept = {}
+    replaced = {}
+    for parent in root.iter():
+        for element in list(parent):
+            if element.tag not in MERGED_TAGS or 'id' not in element.attrib:
+                continue
+            signature = _signature(element)
+            if signature in kept:
+                replaced[element.get('id')] = kept[signature]
+                parent.remove(element)
+            else:
+                kept[signature] = element.get('id')
+    if not replaced:
+        return 0
+
+    def url(match):
+        return 'url(#%s)' % replaced.get(match.group(1), match.group(1))
+
+    for element in root.iter():
+        for key, value in element.attrib.items():
+            if key in (HREF, 'href') and value[1:] in replaced:
+                element.set(key, '#' + replaced[value[1:]])
+            elif 'url(#' in value:
+                element.set(key, re.sub(r'url\(#([^)]*)\)', url, value))
+    return len(replaced)
+
+
+def optimize(src, dst, precision=3, compress=False):
+    """
+    Optimize a svg file.
+
+    :param src: filepath of the svg
+    :param dst: filepath of the optimized svg
+    :param precision: number of decimals of the coordinates
+    :param compress: write a gzip compressed file (svgz)
+    """
+    tree = ET.parse(src)
+    root = tree.getroot()
+    for element in root.iter():
+        if element is not root:
+            for key in ROUNDED_ATTRIBUTES:
+                if key in element.attrib:
+                    element.set(key, round_numbers(element.get(key),
+                                                   precision))
+            if 'transform' in element.attrib:
+                element.set('transform',
+                            round_transform(element.get('transform'),
+                                            precision))
+        # Indentation
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    # Rounded glyphs are more often identical
+    merged = merge_definitions(root)
+    if compress:
+        with open(dst, 'wb') as raw, \
+                gzip.GzipFile(filename='', mode='wb', fileobj=raw,
+                              mtime=0) as fh:
+            tree.write(fh, encoding='utf-8', xml_declaration=True)
+    else:
+        tree.write(dst, encoding='utf-8', xml_declaration=True)
+    logging.debug('%s: %i definitions merged, %i -> %i bytes', src, merged,
+                  os.path.getsize(src), os.path.getsize(dst))
@@ -8,14 +8,23 @@ A :class:`Task` is composed of the following steps:
     2. convert tex to pdf with :func:`_tex_to_pdf()`
     3. convert pdf to svg with :func:`_pdf_to_svg()`
     4. convert pdf to eps with :func:`_pdf_to_eps()`
-    5. convert pdf to png with :func:`_pdf_to_png()`
+    5. convert pdf to png with :func:`_pdf_to_png()`, smaller png
+       variants are downscaled from it with :func:`_downscale_png()`
+
+If enabled, the pdf is optimized by :func:`_optimize_pdf()` after step 2,
+and steps 3 to 5 start from the optimized pdf.
 
 Step 1 can be complex and could require several sub-steps.
-Thus, the role of :func:`_pre_make()` is to do all these sub-steps.
+Thus, the role of :func:`_pre_make()` is to list all these sub-steps.
 
 Steps 2 to 5 usually do not depend on the initial type of the task.
 The function :func:`make()` do all of them.
 
+Each step either does its work in python and returns None, or returns
+a :class:`Command` calling an external tool. The caller runs the command,
+which allows :func:`make()` to run it synchronously and
+:mod:`libscifig.aiobuild` to run it with asyncio.
+
 Each format has its own export function. The function :func:`export()`
 exports all of them.
 
@@ -27,8 +36,191 @@ import shutil
 import subprocess
 import logging
 import re
+import glob
+import tempfile
+import functools
+import time
 
+from libscifig import metrics, pyrunner, svgopt, translation
 from libscifig.checksum import calculate_checksum, is_different
+from libscifig.toolchain import ToolNotFoundError
+
+try:
+    from PIL import Image
+except ImportError:
+    # Downscale with ghostscript
+    Image = None
+
+
+LATEX_ENGINES = {'pdflatex': '/usr/bin/pdflatex',
+                 'lualatex': '/usr/bin/lualatex',
+                 'xelatex': '/usr/bin/xelatex',
+                 }
+# tex files larger than this (in bytes) go straight to lualatex,
+# whose memory is allocated dynamically.
+LUALATEX_THRESHOLD = 2 * 1024 * 1024
+CAPACITY_ERROR = 'TeX capacity exceeded'
+PNG_DEVICES = ('png16m', 'pngalpha', 'pnggray')
+# Ghostscript options of the pdf optimization: compressed streams,
+# subset fonts and images embedded once.
+PDF_OPTIMIZE_OPTIONS = ('-sDEVICE=pdfwrite', '-dCompatibilityLevel=1.5',
+                        '-dCompressPages=true', '-dCompressFonts=true',
+                        '-dSubsetFonts=true', '-dDetectDuplicateImages=true')
+
+
+def product_filename(name, target):
+    """
+    Return the filename of a product.
+
+    Smaller png variants (targets like png150) are named name-150dpi.png,
+    the optimized svg (svgmin target) name.min.svg.
+
+    :param name: name of the task
+    :param target: target name
+    """
+    match = re.fullmatch(r'png(\d+)', target)
+    if match:
+        return '%s-%sdpi.png' % (name, match.group(1))
+    if target == 'svgmin':
+        return name + '.min.svg'
+    return name + '.' + target
+
+
+class Command():
+    """
+    External tool call of a build step.
+
+    :param args: command line (list)
+    :param cwd: working directory of the tool
+    :param done: function called with stdout and stderr (strings),
+                 it can return a `Command` to run next.
+    :param env: environment of the tool, the one of scifig by default
+    """
+    def __init__(self, args, cwd, done=None, env=None):
+        self.args = args
+        self.cwd = cwd
+        self.done = done
+        self.env = env
+        # Name of the tool in the metrics
+        self.tool = os.path.basename(args[0])
+
+    def finish(self, stdout, stderr):
+        """
+        Process the outputs of the tool.
+
+        :param stdout: stdout of the tool
+        :param stderr: stderr of the tool
+        :returns: `Command` to run next or None
+        """
+        logging.debug(stdout)
+        if stderr:
+            logging.error(stderr)  # TODO color
+        if self.done is not None:
+            return self.done(stdout, stderr)
+        return None
+
+    def run(self):
+        """
+        Run the tool and wait for it.
+
+        :returns: `Command` to run next or None
+        """
+        logging.debug('Command: %s (in %s)', self.args, self.cwd)
+        start = time.perf_counter()
+        process = subprocess.Popen(self.args, cwd=self.cwd, env=self.env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        metrics.add_tool_time(self.tool, time.perf_counter() - start)
+        return self.finish(stdout.decode(), stderr.decode())
+
+
+class ScriptCommand(Command):
+    """
+    Python script of a build step,
+    run in the interpreters of :mod:`libscifig.pyrunner`.
+
+    :param script: filepath of the script
+    :param cwd: working directory of the script
+    :param done: function called with stdout and stderr (strings),
+                 it can return a `Command` to run next.
+    """
+    def __init__(self, script, cwd, done=None):
+        Command.__init__(self, [script], cwd, done=done)
+        self.tool = 'python'
+
+    def submit(self):
+        """
+        Start the script.
+
+        :returns: `concurrent.futures.Future` of stdout and stderr
+        """
+        logging.debug('Script: %s (in %s)', self.args[0], self.cwd)
+        return pyrunner.submit(self.args[0], self.cwd)
+
+    def run(self):
+        """
+        Run the script and wait for it.
+
+        :returns: `Command` to run next or None
+        """
+        start = time.perf_counter()
+        stdout, stderr = self.submit().result()
+        metrics.add_tool_time(self.tool, time.perf_counter() - start)
+        return self.finish(stdout, stderr)
+
+
+class FunctionCommand(Command):
+    """
+    Python function of a build step, run in a thread by
+    :mod:`libscifig.aiobuild` so that it does not block the event loop.
+
+    :param function: function without arguments
+    :param tool: name of the tool in the metrics
+    """
+    def __init__(self, function, tool):
+        Command.__init__(self, [tool], None)
+        self.function = function
+
+    def run(self):
+        """
+        Run the function and wait for it.
+
+        :returns: None
+        """
+        start = time.perf_counter()
+        self.function()
+        metrics.add_tool_time(self.tool, time.perf_counter() - start)
+        return None
+
+
+def base_tools(engine, pdf_only=False, pdf_optimize=False):
+    """
+    Return the names of the tools needed by every figure,
+    whatever its kind.
+
+    :param engine: LaTeX engine
+    :param pdf_only: Only tex and pdf
+    :param pdf_optimize: optimize the pdf with ghostscript
+    :returns: list of tool names
+    """
+    if pdf_only:
+        tools = [engine]
+        if pdf_optimize:
+            tools.append('gs')
+        return tools
+    return [engine, 'pdf2svg', 'pdftops', 'gs']
+
+
+def run_step(step):
+    """
+    Run a build step and the commands it returns.
+
+    :param step: function returning a `Command` or None
+    """
+    command = step()
+    while command is not None:
+        command = command.run()
 
 
 class Task():
@@ -37,24 +229,60 @@ class Task():
 
     :param filepath: filepath of the main file
     :param build: relative filepath of the build dir
+    :param engine: LaTeX engine (pdflatex, lualatex or xelatex)
+    :param scratch: filepath of a scratch dir for intermediate files
+    :param png_dpi: resolutions of the png variants, the highest one
+                    is the png target, the others are targets like png150
+    :param png_device: ghostscript device (png16m, pngalpha or pnggray)
+    :param svg_precision: decimals of the coordinates of the optimized
+                          svg, None to skip the optimization
+    :param svgz: compress the optimized svg (svgz target instead of svgmin)
+    :param pdf_optimize: optimize the pdf with ghostscript
     """
-    def __init__(self, filepath, build='build'):
-        self.cwd = os.getcwd()
+    def __init__(self, filepath, build='build', engine='pdflatex',
+                 scratch=None, png_dpi=(600,), png_device='png16m',
+                 svg_precision=None, svgz=False, pdf_optimize=False):
         self.id = 'ID:' + os.path.relpath(filepath)
         self.dependencies = []
         self.dependencies.append(filepath)
+        self.data = []
         self.dirname, filename = os.path.split(filepath)
         self.name = os.path.splitext(filename)[0]
         self.buildpath = os.path.join(build, os.path.relpath(self.dirname))
-        self.pdfmaker = '/usr/bin/pdflatex'
+        # Stages work in workpath, which is buildpath
+        # unless a scratch dir is given.
+        self.scratch = scratch
+        self.workpath = self.buildpath
+        self.requested_engine = engine
+        self.latexmakers = dict(LATEX_ENGINES)
+        self._set_engine(engine)
         self.svgmaker = '/usr/bin/pdf2svg'
         self.epsmaker = '/usr/bin/pdftops'
         self.pngmaker = '/usr/bin/gs'
+        # Versions of the tools, see use_toolchain()
+        self.tool_versions = {}
 
         self.eps = self.name + '.eps'
         self.pdf = self.name + '.pdf'
         self.png = self.name + '.png'
         self.svg = self.name + '.svg'
+        if png_device not in PNG_DEVICES:
+            raise ValueError('Unknown png device: %s' % png_device)
+        self.png_device = png_device
+        self.png_dpi = sorted(set(png_dpi), reverse=True)
+        # Smaller variants, target name -> dpi
+        self.png_variants = {'png%i' % dpi: dpi for dpi in self.png_dpi[1:]}
+        self.svg_precision = svg_precision
+        if svg_precision is None:
+            self.svg_target = None
+        elif svgz:
+            self.svg_target = 'svgz'
+        else:
+            self.svg_target = 'svgmin'
+        self.pdf_optimize = pdf_optimize
+        # pdf written by the LaTeX engine before the optimization
+        self.rawpdf = self.name + '-raw.pdf'
+        self.rawpdf_md5 = None
 
     def get_name(self):
         """
@@ -62,98 +290,315 @@ class Task():
         """
         return self.id
 
+    def _work(self, filepath):
+        """
+        Return the path of a build file in the working directory.
+
+        :param filepath: filepath of the file in the build dir
+        """
+        return os.path.join(self.workpath, os.path.basename(filepath))
+
+    def _open_workpath(self):
+        """
+        Create a private working directory in the scratch dir, if any.
+        """
+        if self.scratch is None:
+            return
+        os.makedirs(self.scratch, exist_ok=True)
+        self.workpath = tempfile.mkdtemp(prefix=self.name + '-',
+                                         dir=self.scratch)
+        logging.debug('Scratch dir: %s', self.workpath)
+
+    def _collect_products(self, products):
+        """
+        Copy products back to the build dir
+        if the working directory is a scratch dir.
+
+        :param products: filenames to copy back
+        """
+        if self.workpath == self.buildpath:
+            return
+        os.makedirs(self.buildpath, exist_ok=True)
+        for product in products:
+            src = os.path.join(self.workpath, product)
+            if os.path.exists(src):
+                logging.debug('copy %s to %s', src, self.buildpath)
+                shutil.copy(src, self.buildpath)
+
+    def _close_workpath(self):
+        """
+        Remove the private working directory, if any.
+        """
+        if self.workpath == self.buildpath:
+            return
+        shutil.rmtree(self.workpath, ignore_errors=True)
+        self.workpath = self.buildpath
+
+    def _remove_products(self, targets):
+        """
+        Remove products of an interrupted build from the build dir.
+
+        :param targets: list of target names
+        """
+        for product in self.products(targets).values():
+            try:
+                os.remove(os.path.join(self.buildpath, product))
+            except FileNotFoundError:
+                pass
+
+    def _set_engine(self, engine):
+        """
+        Set the LaTeX engine used to build the pdf.
+
+        :param engine: engine name, a key of LATEX_ENGINES
+        """
+        self.engine = engine
+        self.pdfmaker = self.latexmakers[engine]
+
+    def tools(self, pdf_only=False):
+        """
+        Return the names of the tools needed by a build.
+
+        :param pdf_only: Only tex and pdf
+        :returns: list of tool names
+        """
+        return base_tools(self.requested_engine, pdf_only=pdf_only,
+                          pdf_optimize=self.pdf_optimize)
+
+    def _set_makers(self, paths):
+        """
+        Set the filepaths of the tools.
+
+        :param paths: dict tool name -> filepath
+        """
+        for engine in self.latexmakers:
+            if engine in paths:
+                self.latexmakers[engine] = paths[engine]
+        self.svgmaker = paths.get('pdf2svg', self.svgmaker)
+        self.epsmaker = paths.get('pdftops', self.epsmaker)
+        self.pngmaker = paths.get('gs', self.pngmaker)
+        self._set_engine(self.engine)
+
+    def use_toolchain(self, toolchain):
+        """
+        Use the tools found by a toolchain.
+
+        Their versions are part of the dependencies,
+        so that a new version of a tool triggers a rebuild.
+        Missing tools are left to the default filepath.
+
+        :param toolchain: `Toolchain` instance
+        """
+        paths = {}
+        self.tool_versions = {}
+        for tool in self.tools() + ['lualatex']:
+            try:
+                paths[tool], version = toolchain.find(tool)
+            except ToolNotFoundError:
+                continue
+            if tool in self.tools():
+                self.tool_versions[tool] = version
+        self._set_makers(paths)
+
+    def _select_engine(self, db):
+        """
+        Reuse the engine recorded by a previous build, if any.
+
+        The record is ignored if the requested engine changed since.
+
+        :param db: `DataBase` instance
+        """
+        recorded = db.get(self.id, 'engine')
+        if recorded.get('requested') == self.requested_engine:
+            self._set_engine(recorded['name'])
+        else:
+            self._set_engine(self.requested_engine)
+        if self.engine == 'pdflatex':
+            tex = os.path.join(self.workpath, self.name + '.tex')
+            if os.path.getsize(tex) > LUALATEX_THRESHOLD:
+                logging.info('Large tex file, switch to lualatex')
+                self._set_engine('lualatex')
+
+    def _record_engine(self, db):
+        """
+        Record the engine used to build the pdf.
+
+        :param db: `DataBase` instance
+        """
+        db.set(self.id, 'engine', {'name': self.engine,
+                                   'requested': self.requested_engine})
+
     def _tex_to_pdf(self):
         """
         Convert tex to pdf.
+
+        If pdflatex runs out of memory, retry with lualatex.
+
+        If the pdf is optimized, the engine writes the raw pdf
+        with the modification time of the source as date, so that
+        unchanged sources give the same raw pdf.
         """
-        logging.info('tex -> pdf')
-        # Prepare and run the command
-        command = [self.pdfmaker, self.name + '.tex']
-        # in plt, all path are relative, need to move
-        logging.debug('chdir: %s', self.buildpath)
-        os.chdir(self.buildpath)
-        logging.debug('Command: %s', command)
-        process = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        # go back to the cur dir
-        os.chdir(self.cwd)
+        logging.info('tex -> pdf (%s)', self.engine)
+        command = [self.pdfmaker, '-interaction=nonstopmode']
+        env = None
+        if self.pdf_optimize:
+            command.append('-jobname=' + os.path.splitext(self.rawpdf)[0])
+            env = dict(os.environ)
+            env.setdefault('SOURCE_DATE_EPOCH',
+                           str(int(os.path.getmtime(self.dependencies[0]))))
+            env['FORCE_SOURCE_DATE'] = '1'
+        command.append(self.name + '.tex')
+        return Command(command, self.workpath, done=self._check_latex,
+                       env=env)
+
+    def _check_latex(self, stdout, stderr):
+        """
+        Retry with lualatex if the LaTeX engine runs out of memory.
+        """
+        if CAPACITY_ERROR in stdout and self.engine != 'lualatex':
+            logging.warning('%s: %s, retry with lualatex',
+                            self.engine, CAPACITY_ERROR)
+            self._set_engine('lualatex')
+            return self._tex_to_pdf()
+        return None
+
+    def _optimize_pdf(self, db):
+        """
+        Optimize the raw pdf with ghostscript.
 
-        stdout, stderr = process.communicate()
-        logging.debug(stdout.decode())
-        errors = stderr.decode()
-        if errors:
-            logging.error(errors)  # TODO color
+        The optimization is skipped if the raw pdf is identical to the
+        one of the previous build and the optimized pdf is intact.
+
+        :param db: `DataBase` instance
+        """
+        rawpdf = os.path.join(self.workpath, self.rawpdf)
+        self.rawpdf_md5 = calculate_checksum(rawpdf)
+        recorded = db.get(self.id, 'pdfopt')
+        if (recorded.get('raw') == self.rawpdf_md5
+                and recorded.get('settings') == self._pdf_settings()
+                and self._check_target(db, 'pdf') is None):
+            logging.info('pdf -> pdf (unchanged, optimized pdf reused)')
+            if self.workpath != self.buildpath:
+                shutil.copy(os.path.join(self.buildpath, self.pdf),
+                            self.workpath)
+            return None
+        logging.info('pdf -> pdf (optimize)')
+        command = ([self.pngmaker] + list(PDF_OPTIMIZE_OPTIONS)
+                   + ['-dNOPAUSE', '-dBATCH', '-dSAFER', '-dQUIET',
+                      '-o', self.pdf, self.rawpdf])
+        return Command(command, self.workpath, done=self._check_optimized)
+
+    def _check_optimized(self, stdout, stderr):
+        """
+        Keep the raw pdf if the optimized one is not smaller.
+        """
+        rawpdf = os.path.join(self.workpath, self.rawpdf)
+        pdf = os.path.join(self.workpath, self.pdf)
+        raw_size = os.path.getsize(rawpdf)
+        size = os.path.getsize(pdf)
+        if size >= raw_size:
+            logging.debug('%s: optimized pdf not smaller, raw pdf kept',
+                          self.name)
+            shutil.copy(rawpdf, pdf)
+        else:
+            logging.debug('%s: pdf optimized, %i -> %i bytes',
+                          self.name, raw_size, size)
+        return None
+
+    def _pdf_settings(self):
+        """
+        Return the options of the pdf optimization.
+        """
+        return ' '.join(PDF_OPTIMIZE_OPTIONS)
 
     def _pdf_to_svg(self):
         """
         Convert pdf to svg.
         """
         logging.info('pdf -> svg')
-
-        # Prepare and run the command
         command = [self.svgmaker, self.name + '.pdf', self.svg]
-        # in plt, all path are relative, need to move
-        logging.debug('chdir: %s', self.buildpath)
-        os.chdir(self.buildpath)
-        logging.debug('Command: %s', command)
-        process = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        # go back to the cur dir
-        os.chdir(self.cwd)
-
-        stdout, stderr = process.communicate()
-        logging.debug(stdout.decode())
-        errors = stderr.decode()
-        if errors:
-            logging.error(errors)  # TODO color
+        return Command(command, self.workpath)
 
     def _pdf_to_eps(self):
         """
         Convert pdf to eps.
         """
         logging.info('pdf -> eps')
-
-        # Prepare and run the command
         command = [self.epsmaker, '-eps', self.name + '.pdf', self.eps]
-        # in plt, all path are relative, need to move
-        logging.debug('chdir: %s', self.buildpath)
-        os.chdir(self.buildpath)
-        logging.debug('Command: %s', command)
-        process = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        # go back to the cur dir
-        os.chdir(self.cwd)
-
-        stdout, stderr = process.communicate()
-        logging.debug(stdout.decode())
-        errors = stderr.decode()
-        if errors:
-            logging.error(errors)  # TODO color
+        return Command(command, self.workpath)
 
-    # TODO sDEVICE: pngalpha and pnggray
-    def _pdf_to_png(self, dpi=600):
+    def _pdf_to_png(self, dpi=None, png=None):
         """
         Convert pdf to png.
+
+        :param dpi: resolution, the highest one of png_dpi by default
+        :param png: filename of the png
+        """
+        if dpi is None:
+            dpi = self.png_dpi[0]
+        if png is None:
+            png = self.png
+        logging.info('pdf -> png (%i dpi)', dpi)
+        command = [self.pngmaker, '-sDEVICE=' + self.png_device, '-o',
+                   png, '-r' + str(dpi), self.name + '.pdf']
+        return Command(command, self.workpath)
+
+    def _downscale_png(self, target):
         """
-        logging.info('pdf -> png')
+        Make a smaller png variant from the png.
 
-        # Prepare and run the command
-        command = [self.pngmaker, '-sDEVICE=png16m', '-o',
-                   self.png, '-r' + str(dpi), self.name + '.pdf']
-        # in plt, all path are relative, need to move
-        logging.debug('chdir: %s', self.buildpath)
-        os.chdir(self.buildpath)
-        logging.debug('Command: %s', command)
-        process = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        # go back to the cur dir
-        os.chdir(self.cwd)
+        The png is resampled with Pillow if it is installed,
+        otherwise the pdf is rasterized again.
 
-        stdout, stderr = process.communicate()
-        logging.debug(stdout.decode())
-        errors = stderr.decode()
-        if errors:
-            logging.error(errors)  # TODO color
+        :param target: target name of the variant
+        """
+        dpi = self.png_variants[target]
+        png = product_filename(self.name, target)
+        if Image is None:
+            return self._pdf_to_png(dpi, png)
+        return FunctionCommand(functools.partial(self._resize_png, dpi, png),
+                               'pillow')
+
+    def _resize_png(self, dpi, png):
+        """
+        Resample the png with Pillow.
+
+        :param dpi: resolution of the variant
+        :param png: filename of the variant
+        """
+        logging.info('png -> png (%i dpi)', dpi)
+        scale = dpi / self.png_dpi[0]
+        with Image.open(os.path.join(self.workpath, self.png)) as image:
+            size = (max(1, round(image.width * scale)),
+                    max(1, round(image.height * scale)))
+            small = image.resize(size, Image.LANCZOS)
+        small.save(os.path.join(self.workpath, png), dpi=(dpi, dpi))
+
+    def _optimize_svg(self):
+        """
+        Optimize the svg, see :mod:`libscifig.svgopt`.
+        """
+        logging.info('svg -> %s', self.svg_target)
+        start = time.perf_counter()
+        svgopt.optimize(os.path.join(self.workpath, self.svg),
+                        os.path.join(self.workpath,
+                                     product_filename(self.name,
+                                                      self.svg_target)),
+                        precision=self.svg_precision,
+                        compress=self.svg_target == 'svgz')
+        metrics.add_tool_time('svgopt', time.perf_counter() - start)
+
+    def _svg_settings(self):
+        """
+        Return the target and the precision of the optimized svg.
+        """
+        return '%s %i' % (self.svg_target, self.svg_precision)
+
+    def _png_settings(self):
+        """
+        Return the device and the resolution of the png target.
+        """
+        return '%s %i' % (self.png_device, self.png_dpi[0])
 
     def check_dependencies(self, db):
         """
@@ -163,12 +608,83 @@ class Task():
         """
         self.current_hashes = {}
         for dep in self.dependencies:
-            self.current_hashes[dep] = calculate_checksum(dep)
+            self.current_hashes[dep] = db.checksums.checksum(dep)
+        for tool, version in self.tool_versions.items():
+            self.current_hashes['TOOL:' + tool] = version
+        if self.svg_target is not None:
+            self.current_hashes['SVG:'] = self._svg_settings()
+        if self.pdf_optimize:
+            self.current_hashes['PDF:'] = self._pdf_settings()
 
         db_hashes = db.get(self.id, 'deps')
+        if not self.pdf_optimize and 'PDF:' in db_hashes:
+            # The pdf was optimized, build it again without
+            return True
 
         return is_different(self.current_hashes, db_hashes)
 
+    def targets(self, pdf_only=False):
+        """
+        Return the targets of a build.
+
+        :param pdf_only: Only tex and pdf
+        :returns: list of target names (extensions)
+        """
+        if pdf_only:
+            return ['tex', 'pdf']
+        targets = ['tex', 'pdf', 'svg', 'eps', 'png'] + list(self.png_variants)
+        if self.svg_target is not None:
+            targets.append(self.svg_target)
+        return targets
+
+    def products(self, targets):
+        """
+        Return the filenames of the files built in the build dir.
+
+        :param targets: list of target names
+        :returns: dict target -> filename
+        """
+        filenames = {'tex': os.path.basename(self.tex),
+                     'pdf': self.pdf,
+                     'svg': self.svg,
+                     'eps': self.eps,
+                     'png': self.png}
+        return {target: filenames.get(target,
+                                      product_filename(self.name, target))
+                for target in targets}
+
+    def _check_target(self, db, target):
+        """
+        Check that a target has been built and is intact.
+
+        The target is hashed only if its size or modification time
+        differ from the recorded ones.
+
+        :param db: `DataBase` instance
+        :param target: target name
+        :returns: None if the target is valid, the reason otherwise
+        """
+        if not db.get(self.id, 'targets').get(target):
+            return 'not built'
+        if (target == 'png' or target in self.png_variants) and \
+                db.get(self.id, 'deps').get('PNG:') != self._png_settings():
+            return 'new png settings'
+        product = os.path.join(self.buildpath,
+                               self.products([target])[target])
+        try:
+            stat = os.stat(product)
+        except FileNotFoundError:
+            return 'missing'
+        recorded = db.get(self.id, 'products').get(target)
+        if recorded is None:
+            # Built by an older version, trust the status
+            return None
+        if recorded[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return None
+        if calculate_checksum(product) != recorded[2]:
+            return 'modified'
+        return None
+
     def check_targets(self, db, pdf_only=False):
         """
         Check if targets have been modified.
@@ -176,65 +692,267 @@ class Task():
         :param db: `DataBase` instance
         :param pdf_only: Check only the status for pdf
         """
-        status = db.get(self.id, 'targets')
-        if pdf_only:
-            return not status['pdf']
-        else:
-            if False in status.values():
+        for target in self.targets(pdf_only):
+            if self._check_target(db, target) is not None:
                 return True
-            else:
-                return False
+        return False
+
+    def plan(self, db, pdf_only=False):
+        """
+        Return the targets to build.
+
+        All of them if a dependency changed, otherwise only
+        the targets which are not built, missing or modified.
+
+        :param db: `DataBase` instance
+        :param pdf_only: Only tex and pdf
+        :returns: list of target names
+        """
+        targets = self.targets(pdf_only)
+        if self.check_dependencies(db):
+            return targets
+        invalid = {target for target in targets
+                   if self._check_target(db, target) is not None}
+        if invalid & set(self.png_variants):
+            # Variants are downscaled from the png
+            invalid.add('png')
+        if self.svg_target in invalid:
+            # Optimized from the svg
+            invalid.add('svg')
+        return [target for target in targets if target in invalid]
+
+    def explain(self, db, pdf_only=False):
+        """
+        Explain why the figure must be built, without building it.
+
+        No external tool is run and the database is not modified.
+
+        :param db: `DataBase` instance
+        :param pdf_only: Check only the status for pdf
+        :returns: dict with the keys id, outdated, reasons and targets
+                  (targets to build)
+        """
+        reasons = []
+        db_hashes = db.get(self.id, 'deps')
+        if not db_hashes:
+            reasons.append('never built')
+        for dep in self.dependencies:
+            try:
+                md5 = db.checksums.checksum(dep)
+            except FileNotFoundError:
+                reasons.append('missing dependency: %s' % dep)
+                continue
+            if db_hashes and dep not in db_hashes:
+                reasons.append('new dependency: %s' % dep)
+            elif db_hashes and db_hashes[dep] != md5:
+                reasons.append('changed: %s' % dep)
+        for tool, version in self.tool_versions.items():
+            if db_hashes and db_hashes.get('TOOL:' + tool) != version:
+                reasons.append('new version of %s: %s' % (tool, version))
+        if (db_hashes and self.svg_target is not None
+                and db_hashes.get('SVG:') != self._svg_settings()):
+            reasons.append('new svg settings: %s decimals'
+                           % self._svg_settings())
+        if (db_hashes and self.pdf_optimize
+                and db_hashes.get('PDF:') != self._pdf_settings()):
+            reasons.append('new pdf optimization settings')
+        if db_hashes and not self.pdf_optimize and 'PDF:' in db_hashes:
+            reasons.append('pdf optimization disabled')
+
+        if reasons:
+            targets = self.targets(pdf_only)
+        else:
+            targets = []
+            for target in self.targets(pdf_only):
+                reason = self._check_target(db, target)
+                if reason is not None:
+                    targets.append(target)
+                    reasons.append('%s: %s' % (reason, target))
+            if set(targets) & set(self.png_variants) and 'png' not in targets:
+                # Variants are downscaled from the png
+                targets.append('png')
+            if self.svg_target in targets and 'svg' not in targets:
+                # Optimized from the svg
+                targets.append('svg')
+            targets = [target for target in self.targets(pdf_only)
+                       if target in targets]
+        return {'id': self.id,
+                'outdated': bool(reasons),
+                'reasons': reasons,
+                'targets': targets}
 
     def _pre_make(self):
         """
-        Make a tex file.
+        List the steps making a tex file.
         """
         logging.debug('Default pre_make() in class Task, nothing to do!')
-        pass
+        return []
+
+    def _copy_datafiles(self):
+        """
+        Copy data files in the working directory.
+        """
+        for data in self.data:
+            # Data starts from the root.
+            # We need the relative path from the individual directory
+            # (ex: src/figure/)
+            dest = os.path.join(self.workpath,
+                                os.path.relpath(data, start=self.dirname))
+            # Data may be in subdirectories
+            # We reproduce the tree
+            os.makedirs(os.path.split(dest)[0], exist_ok=True)
+            logging.debug('copy %s file to %s', data, dest)
+            shutil.copy(data, dest)
+
+    def _stage_inputs(self, targets):
+        """
+        Copy the intermediate files a partial build starts from
+        in the working directory, if it is a scratch dir.
+
+        :param targets: list of target names to build
+        """
+        if self.workpath == self.buildpath:
+            return
+        inputs = []
+        if 'tex' not in targets and 'pdf' in targets:
+            inputs.append('tex')
+        if 'pdf' not in targets and set(targets) - {'tex'}:
+            inputs.append('pdf')
+        for filename in self.products(inputs).values():
+            shutil.copy(os.path.join(self.buildpath, filename), self.workpath)
+
+    def steps(self, db, targets):
+        """
+        List the steps of a build.
+
+        The pdf is built from the tex file if the tex target is
+        not in targets, and other formats are built from the pdf
+        if the pdf target is not in targets.
+
+        :param db: `DataBase` instance
+        :param targets: list of target names to build
+        :returns: list of functions returning a `Command` or None
+        """
+        steps = []
+        if 'tex' in targets:
+            steps.extend(self._pre_make())
+        elif 'pdf' in targets:
+            # The tex file may use data files
+            steps.append(self._copy_datafiles)
+        if 'pdf' in targets:
+            steps.append(functools.partial(self._select_engine, db))
+            steps.append(self._tex_to_pdf)
+            if self.pdf_optimize:
+                steps.append(functools.partial(self._optimize_pdf, db))
+        for target, step in (('svg', self._pdf_to_svg),
+                             ('eps', self._pdf_to_eps),
+                             ('png', self._pdf_to_png)):
+            if target in targets:
+                steps.append(step)
+        for target in self.png_variants:
+            if target in targets:
+                steps.append(functools.partial(self._downscale_png, target))
+        if self.svg_target in targets:
+            steps.append(self._optimize_svg)
+        return steps
+
+    def _make(self, db, targets):
+        """
+        Run all the steps of a build.
+        """
+        self._open_workpath()
+        try:
+            self._stage_inputs(targets)
+            for step in self.steps(db, targets):
+                run_step(step)
+            self._collect_products(self.products(targets).values())
+        finally:
+            self._close_workpath()
+        self.record_build(db, targets)
+
+    def needs_build(self, db, pdf_only=False):
+        """
+        Check if the figure must be built.
+
+        :param db: `DataBase` instance
+        :param pdf_only: Check only the status for pdf
+        """
+        return bool(self.plan(db, pdf_only=pdf_only))
+
+    def record_build(self, db, targets):
+        """
+        Record a successful build in the database.
+
+        Products are recorded with their size, modification time
+        and checksum to detect missing or modified files.
+
+        :param db: `DataBase` instance
+        :param targets: list of target names built
+        """
+        self._record_engine(db)
+        hashes = dict(self.current_hashes)
+        recorded = db.get(self.id, 'deps')
+        if is_different(self.current_hashes, recorded):
+            # New sources, other targets are outdated
+            target_status = {}
+            export_status = {}
+            products = {}
+        else:
+            target_status = db.get(self.id, 'targets')
+            export_status = db.get(self.id, 'export')
+            products = db.get(self.id, 'products')
+            if 'PNG:' in recorded:
+                hashes['PNG:'] = recorded['PNG:']
+        if 'png' in targets:
+            # Only the png targets depend on the rasterization settings
+            hashes['PNG:'] = self._png_settings()
+        db.set(self.id, 'deps', hashes)
+        for target, filename in self.products(targets).items():
+            product = os.path.join(self.buildpath, filename)
+            stat = os.stat(product)
+            products[target] = [stat.st_size, stat.st_mtime_ns,
+                                calculate_checksum(product)]
+            target_status[target] = True
+            export_status[target] = True
+        for target in self.targets():
+            target_status.setdefault(target, False)
+            export_status.setdefault(target, False)
+        db.set(self.id, 'targets', target_status)
+        db.set(self.id, 'export', export_status)
+        db.set(self.id, 'products', products)
+        if 'pdf' in targets:
+            # Raw pdf of the optimized pdf
+            if self.pdf_optimize:
+                db.set(self.id, 'pdfopt', {'raw': self.rawpdf_md5,
+                                           'settings': self._pdf_settings()})
+            else:
+                db.set(self.id, 'pdfopt', {})
 
     def make_pdf(self, db):
         """
         Compile the figure in pdf.
         """
-        if self.check_dependencies(db) or self.check_targets(db, pdf_only=True):
-            logging.info('Build in pdf %s' % self.name)
-            self._pre_make()
-            # Build a pdf
-            self._tex_to_pdf()
-            db.set(self.id, 'deps', self.current_hashes)
-            target_status = {'tex': True,
-                             'pdf': True,
-                             'svg': False,
-                             'eps': False,
-                             'png': False}
-            db.set(self.id, 'targets', target_status)
-            db.set(self.id, 'export', target_status)
+        targets = self.plan(db, pdf_only=True)
+        if targets:
+            logging.info('Build in %s %s' % (', '.join(targets), self.name))
+            self._make(db, targets)
+            metrics.count_tasks('built')
         else:
             logging.info('Nothing to do for %s' % self.name)
+            metrics.count_tasks('skipped')
 
     def make(self, db):
         """
         Compile the figure in all formats.
         """
-        if self.check_dependencies(db) or self.check_targets(db, pdf_only=False):
-            logging.info('Build in all formats %s' % self.name)
-            self._pre_make()
-            # Build a pdf
-            self._tex_to_pdf()
-            # Build other formats
-            self._pdf_to_svg()
-            self._pdf_to_eps()
-            self._pdf_to_png()
-            db.set(self.id, 'deps', self.current_hashes)
-            target_status = {'tex': True,
-                             'pdf': True,
-                             'svg': True,
-                             'eps': True,
-                             'png': True}
-            db.set(self.id, 'targets', target_status)
-            db.set(self.id, 'export', target_status)
+        targets = self.plan(db, pdf_only=False)
+        if targets:
+            logging.info('Build in %s %s' % (', '.join(targets), self.name))
+            self._make(db, targets)
+            metrics.count_tasks('built')
         else:
             logging.info('Nothing to do for %s' % self.name)
+            metrics.count_tasks('skipped')
 
     def export_tex(self, dst='/tmp'):
         """
@@ -291,30 +1009,63 @@ class Task():
         logging.debug('Export %s to %s', png_src, dst)
         shutil.copy(png_src, dst)
 
+    def export_svg_optimized(self, dst='/tmp'):
+        """
+        Export the optimized svg (svgmin or svgz).
+
+        :param dst: filepath of the destination directory
+        """
+        dst = os.path.expanduser(dst)
+        svg_src = os.path.join(self.buildpath,
+                               product_filename(self.name, self.svg_target))
+        logging.debug('Export %s to %s', svg_src, dst)
+        shutil.copy(svg_src, dst)
+
+    def export_png_variant(self, target, dst='/tmp'):
+        """
+        Export a built png variant.
+
+        :param target: target name of the variant
+        :param dst: filepath of the destination directory
+        """
+        dst = os.path.expanduser(dst)
+        png_src = os.path.join(self.buildpath,
+                               product_filename(self.name, target))
+        logging.debug('Export %s to %s', png_src, dst)
+        shutil.copy(png_src, dst)
+
     def export(self, db, dst='/tmp'):
         """
         Export built files.
 
+        Each target is exported in its own directory (ex: png150/).
+
         :param db: `DataBase` instance
         :param dst: filepath of the destination directory
         """
         logging.info('Export %s' % self.name)
         status = db.get(self.id, 'export')
-        for ext, func in (('tex', self.export_tex),
-                          ('pdf', self.export_pdf),
-                          ('svg', self.export_svg),
-                          ('eps', self.export_eps),
-                          ('png', self.export_png),):
-
-            if status[ext]:
+        exports = [('tex', self.export_tex),
+                   ('pdf', self.export_pdf),
+                   ('svg', self.export_svg),
+                   ('eps', self.export_eps),
+                   ('png', self.export_png),]
+        for target in self.png_variants:
+            exports.append((target,
+                            functools.partial(self.export_png_variant,
+                                              target)))
+        if self.svg_target is not None:
+            exports.append((self.svg_target, self.export_svg_optimized))
+        for ext, func in exports:
+
+            if status.get(ext):
                 path = os.path.join(dst, ext)
                 os.makedirs(path, exist_ok=True)
                 func(path)
-        export_status = {'tex': False,
-                         'pdf': False,
-                         'svg': False,
-                         'eps': False,
-                         'png': False}
+                product = self.products([ext])[ext]
+                metrics.add_bytes('exported', os.path.getsize(
+                    os.path.join(self.buildpath, product)))
+        export_status = {target: False for target in self.targets()}
         db.set(self.id, 'export', export_status)
 
 
@@ -323,8 +1074,14 @@ class TikzTask(Task):
     Tikz Task manager.
     """
     def __init__(self, filepath, datafiles=[],
-                 build='build'):
-        Task.__init__(self, filepath, build=build)
+                 build='build', engine='pdflatex', scratch=None,
+                 png_dpi=(600,), png_device='png16m',
+                 svg_precision=None, svgz=False, pdf_optimize=False):
+        Task.__init__(self, filepath, build=build, engine=engine,
+                      scratch=scratch, png_dpi=png_dpi,
+                      png_device=png_device,
+                      svg_precision=svg_precision, svgz=svgz,
+                      pdf_optimize=pdf_optimize)
         self.data = datafiles
         self.dependencies.extend(datafiles)
         self.tex = os.path.join(build, self.dirname, self.name + '.tex')
@@ -336,18 +1093,7 @@ class TikzTask(Task):
 
         :raises: SyntaxError
         """
-        # Copy data files
-        for data in self.data:
-            # Data starts from the root.
-            # We need the relative path from the individual directory
-            # (ex: src/figure/)
-            dest = os.path.join(self.buildpath, os.path.relpath(data,
-                                start=os.path.split(self.tikz)[0]))
-            # Data may be in subdirectories
-            # We reproduce the tree
-            os.makedirs(os.path.split(dest)[0], exist_ok=True)
-            logging.debug('copy %s file to %s', data, dest)
-            shutil.copy(data, dest)
+        self._copy_datafiles()
         logging.info('tikz -> tex')
         tex_content = '\\documentclass{standalone}\n\n'
         tex_content += '\\usepackage{gnuplot-lua-tikz}\n'
@@ -377,19 +1123,19 @@ class TikzTask(Task):
             raise SyntaxError('The file %s does not contain \\begin{tikzpicture}' % self.tikz)
         tex_content += '\\end{document}'
 
-        with open(self.tex, 'w') as fh:
+        with open(self._work(self.tex), 'w') as fh:
             fh.write(tex_content)
 
     def _pre_make(self):
         """
-        make a tex file.
+        List the steps making a tex file.
         """
         logging.debug('pre_make(): Tikz file %s', self.tikz)
         # Make build path
         logging.debug('pre_make build path %s', self.buildpath)
         os.makedirs(self.buildpath, exist_ok=True)
-        # First convert tikz to tex
-        self._tikz_to_tex()
+        # Convert tikz to tex
+        return [self._tikz_to_tex]
 
 
 class GnuplotTask(Task):
@@ -398,8 +1144,14 @@ class GnuplotTask(Task):
     """
     def __init__(self, filepath, datafiles=[], tikzsnippet=False,
                  tikzsnippet1=False, tikzsnippet2=False,
-                 build='build'):
-        Task.__init__(self, filepath, build=build)
+                 build='build', engine='pdflatex', scratch=None,
+                 png_dpi=(600,), png_device='png16m',
+                 svg_precision=None, svgz=False, pdf_optimize=False):
+        Task.__init__(self, filepath, build=build, engine=engine,
+                      scratch=scratch, png_dpi=png_dpi,
+                      png_device=png_device,
+                      svg_precision=svg_precision, svgz=svgz,
+                      pdf_optimize=pdf_optimize)
         self.plt = filepath
 
         self.data = datafiles
@@ -425,40 +1177,43 @@ class GnuplotTask(Task):
 
         self.gnuplot = '/usr/bin/gnuplot'
 
+    def tools(self, pdf_only=False):
+        """
+        Return the names of the tools needed by a build.
+
+        :param pdf_only: Only tex and pdf
+        :returns: list of tool names
+        """
+        return ['gnuplot'] + Task.tools(self, pdf_only=pdf_only)
+
+    def _set_makers(self, paths):
+        """
+        Set the filepaths of the tools.
+
+        :param paths: dict tool name -> filepath
+        """
+        Task._set_makers(self, paths)
+        self.gnuplot = paths.get('gnuplot', self.gnuplot)
+
     def _plt_to_plttikz(self):
         """
         Convert plt to plttikz.
         """
         logging.info('plt -> plttikz')
-        logging.debug('copy plt file to %s', self.buildpath)
-        shutil.copyfile(self.plt, self.pltcopy)
+        logging.debug('copy plt file to %s', self.workpath)
+        shutil.copyfile(self.plt, self._work(self.pltcopy))
 
-        # Copy data files
-        for data in self.data:
-            # Data starts from the root.
-            # We need the relative path from the individual directory (ex: src/figure/)
-            dest = os.path.join(self.buildpath, os.path.relpath(data,
-                                start=os.path.split(self.plt)[0]))
-            # Data may be in subdirectories
-            # We reproduce the tree
-            os.makedirs(os.path.split(dest)[0], exist_ok=True)
-            shutil.copy(data, dest)
-        # Prepare and run the command
+        self._copy_datafiles()
+        # in plt, all path are relative, run in the build dir
         command = [self.gnuplot, self.name + '.plt']
-        logging.debug('Command: %s', command)
-        # in plt, all path are relative, need to move
-        os.chdir(self.buildpath)
-        process = subprocess.Popen(command, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-        # go back to the cur dir
-        os.chdir(self.cwd)
+        return Command(command, self.workpath, done=self._write_plttikz)
 
-        stdout, stderr = process.communicate()
-        with open(self.plttikz, 'w') as fh:
-            fh.write(stdout.decode())
-        errors = stderr.decode()
-        if errors:
-            logging.error(errors)  # TODO color
+    def _write_plttikz(self, stdout, stderr):
+        """
+        Write the tikz code produced by gnuplot.
+        """
+        with open(self._work(self.plttikz), 'w') as fh:
+            fh.write(stdout)
 
     def _plttikz_to_tex(self):
         """
@@ -523,7 +1278,7 @@ class GnuplotTask(Task):
                 raise SyntaxError('The file %s does not contain \\begin{tikzpicture}' % self.tikzsnippet1)
 
         # Inject plttikz
-        with open(self.plttikz, 'r') as fh:
+        with open(self._work(self.plttikz), 'r') as fh:
             plttikz_content = fh.read()
         plttikz_content = plttikz_content.replace('\\end{tikzpicture}', '')
         tex_content += plttikz_content.replace('\\begin{tikzpicture}[gnuplot]', '')
@@ -539,18 +1294,245 @@ class GnuplotTask(Task):
         tex_content += '\\end{tikzpicture}\n'
         tex_content += '\\end{document}'
 
-        with open(self.tex, 'w') as fh:
+        with open(self._work(self.tex), 'w') as fh:
             fh.write(tex_content)
 
     def _pre_make(self):
         """
-        make a tex file.
+        List the steps making a tex file.
         """
         logging.debug('pre_make(): Gnuplot file %s', self.plt)
         # Make build path
         logging.debug('pre_make build path %s', self.buildpath)
         os.makedirs(self.buildpath, exist_ok=True)
-        # First convert plt to plttikz
-        self._plt_to_plttikz()
-        # Then, make a tex
-        self._plttikz_to_tex()
+        return [self._plt_to_plttikz, self._plttikz_to_tex]
+
+
+class PythonTask(Task):
+    """
+    Python Task manager.
+
+    The script runs in the working directory and saves the figure
+    as name.pgf (ex: matplotlib savefig), name.tikz or name.pdf.
+    """
+    def __init__(self, filepath, datafiles=[],
+                 build='build', engine='pdflatex', scratch=None,
+                 png_dpi=(600,), png_device='png16m',
+                 svg_precision=None, svgz=False, pdf_optimize=False):
+        Task.__init__(self, filepath, build=build, engine=engine,
+                      scratch=scratch, png_dpi=png_dpi,
+                      png_device=png_device,
+                      svg_precision=svg_precision, svgz=svgz,
+                      pdf_optimize=pdf_optimize)
+        self.py = filepath
+        self.data = datafiles
+        self.dependencies.extend(datafiles)
+        self.tex = os.path.join(build, self.dirname, self.name + '.tex')
+        # pdf saved by the script, included by the tex file
+        self.figpdf = self.name + '-fig.pdf'
+
+    def use_toolchain(self, toolchain):
+        """
+        Use the tools found by a toolchain.
+
+        The versions of python and of the modules loaded by the
+        interpreters are part of the dependencies.
+
+        :param toolchain: `Toolchain` instance
+        """
+        Task.use_toolchain(self, toolchain)
+        self.tool_versions['python'] = pyrunner.versions()
+
+    def plan(self, db, pdf_only=False):
+        """
+        Return the targets to build.
+
+        The script makes the figure again, so all the targets
+        are built if the tex file must be built.
+
+        :param db: `DataBase` instance
+        :param pdf_only: Only tex and pdf
+        :returns: list of target names
+        """
+        targets = Task.plan(self, db, pdf_only=pdf_only)
+        if 'tex' in targets:
+            return self.targets(pdf_only)
+        return targets
+
+    def _intermediates(self, path):
+        """
+        Return the filenames of the files saved by the script
+        and needed by the tex file.
+
+        :param path: directory to look at
+        """
+        return [os.path.basename(filepath)
+                for filepath in glob.glob(os.path.join(path, self.name + '-*'))
+                if filepath.endswith(self.figpdf)
+                or re.fullmatch(re.escape(self.name) + r'-img\d+\.png',
+                                os.path.basename(filepath))]
+
+    def _stage_inputs(self, targets):
+        """
+        Copy the intermediate files a partial build starts from
+        in the working directory, if it is a scratch dir.
+
+        :param targets: list of target names to build
+        """
+        Task._stage_inputs(self, targets)
+        if self.workpath == self.buildpath:
+            return
+        if 'tex' not in targets and 'pdf' in targets:
+            for filename in self._intermediates(self.buildpath):
+                shutil.copy(os.path.join(self.buildpath, filename),
+                            self.workpath)
+
+    def _collect_products(self, products):
+        """
+        Copy products and the files saved by the script back
+        to the build dir if the working directory is a scratch dir.
+
+        :param products: filenames to copy back
+        """
+        Task._collect_products(self, list(products) +
+                               self._intermediates(self.workpath))
+
+    def _py_to_figure(self):
+        """
+        Run the python script.
+        """
+        logging.info('py -> pgf, tikz or pdf')
+        self._copy_datafiles()
+        # Outputs of a previous run
+        for ext in ('.pgf', '.tikz', '.pdf'):
+            try:
+                os.remove(os.path.join(self.workpath, self.name + ext))
+            except FileNotFoundError:
+                pass
+        return ScriptCommand(self.py, self.workpath)
+
+    def _figure_to_tex(self):
+        """
+        Convert the figure saved by the script to tex.
+
+        :raises: FileNotFoundError, SyntaxError
+        """
+        tex_content = '\\documentclass{standalone}\n\n'
+        tex_content += '\\usepackage{pgf}\n'
+        tex_content += """\\usepackage{tikz}
+\\usepackage{graphicx}
+\\usepackage{amssymb}
+\\usepackage{amsfonts}
+\\usepackage{mathrsfs}
+\\usepackage{amsmath}
+\\usepackage[amssymb]{SIunits}\n
+"""
+        pgf = self._work(self.name + '.pgf')
+        tikz = self._work(self.name + '.tikz')
+        pdf = self._work(self.pdf)
+        if os.path.isfile(pgf):
+            logging.info('pgf -> tex')
+            with open(pgf, 'r') as fh:
+                tex_content += '\\begin{document}\n'
+                tex_content += fh.read()
+        elif os.path.isfile(tikz):
+            logging.info('tikz -> tex')
+            with open(tikz, 'r') as fh:
+                tikz_content = fh.read()
+            tikz_content = tikz_content.split("\\begin{tikzpicture}")
+            tex_content += tikz_content[0]
+            tex_content += "\\begin{document}\n"
+            tex_content += "\\begin{tikzpicture}"
+            try:
+                tex_content += tikz_content[1]
+            except IndexError:
+                # The file does not contain tikzpicture
+                raise SyntaxError('The file %s does not contain \\begin{tikzpicture}' % tikz)
+        elif os.path.isfile(pdf):
+            logging.info('pdf -> tex')
+            # The pdf target is built from the tex file
+            os.replace(pdf, self._work(self.figpdf))
+            tex_content += '\\begin{document}\n'
+            tex_content += '\\includegraphics{%s}\n' % self.figpdf
+        else:
+            raise FileNotFoundError('%s did not save %s.pgf, %s.tikz or %s'
+                                    % (self.py, self.name, self.name,
+                                       self.pdf))
+        tex_content += '\\end{document}'
+
+        with open(self._work(self.tex), 'w') as fh:
+            fh.write(tex_content)
+
+    def _pre_make(self):
+        """
+        List the steps making a tex file.
+        """
+        logging.debug('pre_make(): Python file %s', self.py)
+        # Make build path
+        logging.debug('pre_make build path %s', self.buildpath)
+        os.makedirs(self.buildpath, exist_ok=True)
+        # Run the script, then make a tex
+        return [self._py_to_figure, self._figure_to_tex]
+
+
+class TranslatedTask(Task):
+    """
+    Translated variant of a task.
+
+    The tex file built by the task is translated with a po file,
+    so that the stages making it (gnuplot...) run once for all
+    the languages. The task must be built first.
+
+    :param task: `Task` instance to translate
+    :param pofile: filepath of the po file, named like name_fr.po
+    """
+    def __init__(self, task, pofile,
+                 build='build', engine='pdflatex', scratch=None,
+                 png_dpi=(600,), png_device='png16m',
+                 svg_precision=None, svgz=False, pdf_optimize=False):
+        Task.__init__(self, pofile, build=build, engine=engine,
+                      scratch=scratch, png_dpi=png_dpi,
+                      png_device=png_device,
+                      svg_precision=svg_precision, svgz=svgz,
+                      pdf_optimize=pdf_optimize)
+        self.task = task
+        self.po = pofile
+        self.lang = self.name[len(task.name) + 1:]
+        self.data = task.data
+        self.dependencies.extend(task.dependencies)
+        self.tex = os.path.join(build, self.dirname, self.name + '.tex')
+
+    def tools(self, pdf_only=False):
+        """
+        Return the names of the tools needed by a build,
+        including the tools making the tex file of the task.
+
+        :param pdf_only: Only tex and pdf
+        :returns: list of tool names
+        """
+        tools = self.task.tools(pdf_only)
+        return [tool for tool in Task.tools(self, pdf_only)
+                if tool not in tools] + tools
+
+    def _translate_tex(self):
+        """
+        Translate the tex file of the task.
+        """
+        logging.info('tex -> tex (%s)', self.lang)
+        self._copy_datafiles()
+        catalog = translation.read_po(self.po)
+        with open(self.task.tex, 'r') as fh:
+            tex_content = fh.read()
+        with open(self._work(self.tex), 'w') as fh:
+            fh.write(translation.translate(tex_content, catalog))
+
+    def _pre_make(self):
+        """
+        List the steps making a tex file.
+        """
+        logging.debug('pre_make(): Translation %s of %s',
+                      self.po, self.task.name)
+        # Make build path
+        logging.debug('pre_make build path %s', self.buildpath)
+        os.makedirs(self.buildpath, exist_ok=True)
+        return [self._translate_tex]
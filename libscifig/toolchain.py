@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+Find the external tools (makers) used by the tasks and their versions.
+
+Tools are looked up on the PATH unless a path is configured.
+Versions are cached by executable path and modification time,
+so that a tool is run to get its version only after an upgrade.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+
+
+# Arguments printing the version of each tool
+VERSION_ARGS = {'pdflatex': ['--version'],
+                'lualatex': ['--version'],
+                'xelatex': ['--version'],
+                'gnuplot': ['--version'],
+                'pdf2svg': [],
+                'pdftops': ['-v'],
+                'gs': ['--version'],
+                }
+
+
+class ToolNotFoundError(FileNotFoundError):
+    """
+    A tool is not on the system.
+    """
+    pass
+
+
+def _version(path, tool):
+    """
+    Run a tool to get its version.
+
+    :param path: filepath of the executable
+    :param tool: tool name
+    :returns: first line printed by the tool
+    """
+    command = [path] + VERSION_ARGS.get(tool, ['--version'])
+    logging.debug('Command: %s', command)
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 stdin=subprocess.DEVNULL, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as err:
+        logging.warning('Cannot get the version of %s: %s', path, err)
+        return ''
+    output = (process.stdout + process.stderr).decode(errors='replace')
+    for line in output.splitlines():
+        if line.strip():
+            return line.strip()
+    return ''
+
+
+class Toolchain():
+    """
+    External tools of the tasks.
+
+    :param config: dict tool name -> filepath, overriding the PATH
+    :param cache: dict filepath -> [mtime, version], updated in place
+    :param local: False when the tools run on remote workers, no tool
+                  is searched locally: tasks keep their default tools
+                  and the versions are reported by the workers
+    :param probe: False to read the versions from the cache only,
+                  without running the tools: a tool missing from the
+                  cache is not found
+    """
+    def __init__(self, config=None, cache=None, local=True, probe=True):
+        if config is None:
+            config = {}
+        if cache is None:
+            cache = {}
+        self.config = config
+        self.cache = cache
+        self.local = local
+        self.probe = probe
+        self.tools = {}
+
+    def find(self, tool):
+        """
+        Return the filepath and the version of a tool.
+
+        :param tool: tool name
+        :returns: (path, version) tuple
+        :raises: ToolNotFoundError
+        """
+        if tool in self.tools:
+            return self.tools[tool]
+        if not self.local:
+            raise ToolNotFoundError('Tool %s is on the workers' % tool)
+        path = self.config.get(tool) or shutil.which(tool)
+        if path is None or not os.path.isfile(path):
+            raise ToolNotFoundError('Tool not found: %s' % tool)
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        entry = self.cache.get(path)
+        if entry is not None and entry[0] == mtime:
+            version = entry[1]
+        elif not self.probe:
+            raise ToolNotFoundError('Version of %s unknown' % tool)
+        else:
+            version = _version(path, tool)
+            self.cache[path] = [mtime, version]
+        logging.debug('Tool %s: %s (%s)', tool, path, version)
+        self.tools[tool] = (path, version)
+        return self.tools[tool]
+
+    def check(self, tools):
+        """
+        Find all the tools, before any build starts.
+
+        Tools on remote workers are checked by the workers.
+
+        :param tools: tool names
+        :raises: ToolNotFoundError listing the missing tools
+        """
+        if not self.local:
+            return
+        missing = []
+        for tool in sorted(set(tools)):
+            try:
+                self.find(tool)
+            except ToolNotFoundError:
+                missing.append(tool)
+        if missing:
+            raise ToolNotFoundError('Tools not found: %s' % ', '.join(missing))
+
+    def path(self, tool):
+        """
+        Return the filepath of a tool, see :func:`find`.
+        """
+        return self.find(tool)[0]
+
+    def version(self, tool):
+        """
+        Return the version of a tool, see :func:`find`.
+        """
+        return self.find(tool)[1]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+Translate figures with po files.
+
+The texts of the nodes of a tex file are replaced by their translations,
+as done by the po4a module `po4a/Tikz.pm`. Labels written by gnuplot
+are nodes too, so the po files made by `po4a/Gnuplot.pm` also apply.
+"""
+
+import logging
+import re
+
+
+# Same rule as po4a/Tikz.pm: the text between the first brace after
+# node and the last brace of the line
+NODE_PATTERN = re.compile(r'(^[^\r\n]*node.*?{)(.*)(}.*)')
+
+
+def _unquote(string):
+    """
+    Return the content of a quoted po string.
+    """
+    string = string.strip()[1:-1]
+    return re.sub(r'\\(.)',
+                  lambda match: {'n': '\n', 't': '\t'}.get(match.group(1),
+                                                           match.group(1)),
+                  string)
+
+
+def read_po(filepath):
+    """
+    Read the translations of a po file.
+
+    Fuzzy and untranslated entries are skipped.
+
+    :param filepath: filepath of the po file
+    :returns: dict msgid -> msgstr
+    """
+    catalog = {}
+    entry = {'fuzzy': False}
+    key = None
+    fuzzy = False
+
+    def add(entry):
+        if entry.get('msgid') and entry.get('msgstr') and not entry['fuzzy']:
+            catalog[entry['msgid']] = entry['msgstr']
+
+    with open(filepath, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#'):
+                if line.startswith('#,') and 'fuzzy' in line:
+                    fuzzy = True
+                continue
+            if line.startswith('msgid '):
+                add(entry)
+                entry = {'fuzzy': fuzzy}
+                fuzzy = False
+                key = 'msgid'
+                line = line[len('msgid '):]
+            elif line.startswith('msgstr '):
+                key = 'msgstr'
+                line = line[len('msgstr '):]
+            elif not line.startswith('"'):
+                # msgctxt, msgid_plural... are not supported
+                key = None
+                continue
+            if key is not None:
+                entry[key] = entry.get(key, '') + _unquote(line)
+    add(entry)
+    logging.debug('%i translations in %s', len(catalog), filepath)
+    return catalog
+
+
+def translate(content, catalog):
+    """
+    Translate the texts of the nodes.
+
+    :param content: tex or tikz code
+    :param catalog: dict msgid -> msgstr, see :func:`read_po`
+    :returns: translated code
+    """
+    lines = []
+    for line in content.splitlines(True):
+        match = NODE_PATTERN.match(line)
+        if match and match.group(2) in catalog:
+            line = (match.group(1) + catalog[match.group(2)]
+                    + match.group(3) + line[match.end():])
+        lines.append(line)
+    return ''.join(lines)
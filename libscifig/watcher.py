@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Francois Boulogne
+# License:
+
+"""
+Watch the dependencies of the figures by polling.
+
+Inotify events never arrive for files modified on network filesystems
+(NFS, SMB). The watcher takes stat snapshots of the known files
+instead and compares them. Changes are batched: the callback runs
+once the files stop changing.
+
+The interval between two polls is short after a change and doubles
+while nothing changes. It is also kept long enough for the polls
+to use at most a small share of a CPU, whatever the number of files.
+"""
+
+import logging
+import os
+import time
+
+
+def snapshot(paths):
+    """
+    Take a stat snapshot of files.
+
+    :param paths: filepaths
+    :returns: dict filepath -> (mtime in ns, size), None if missing
+    """
+    state = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            state[path] = None
+        else:
+            state[path] = (stat.st_mtime_ns, stat.st_size)
+    return state
+
+
+def compare(old, new):
+    """
+    Compare two snapshots.
+
+    :returns: sorted list of the filepaths added, removed or modified
+    """
+    return sorted(path for path in old.keys() | new.keys()
+                  if old.get(path) != new.get(path))
+
+
+class PollingWatcher():
+    """
+    Poll files and report the changes by batch.
+
+    :param paths: function returning the filepaths to watch,
+                  called again after each batch
+    :param min_interval: interval after a change (s)
+    :param max_interval: longest interval while nothing changes (s)
+    :param cpu_share: largest share of a CPU used by the polls
+    """
+    def __init__(self, paths, min_interval=0.5, max_interval=8.0,
+                 cpu_share=0.01):
+        self.paths = paths
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.cpu_share = cpu_share
+        self.interval = min_interval
+        self.watched = []
+        self.state = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Update the list of watched files.
+
+        Files already watched keep their snapshot, so that a change
+        made meanwhile is reported by the next poll.
+        """
+        self.watched = list(self.paths())
+        known = {path: self.state[path] for path in self.watched
+                 if path in self.state}
+        self.state = snapshot(path for path in self.watched
+                              if path not in known)
+        self.state.update(known)
+        logging.debug('Watching %i files', len(self.watched))
+
+    def poll(self):
+        """
+        Take a snapshot and adapt the interval.
+
+        :returns: list of the filepaths changed since the last poll
+        """
+        start = time.process_time()
+        state = snapshot(self.watched)
+        cost = time.process_time() - start
+        changed = compare(self.state, state)
+        self.state = state
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(2 * self.interval, self.max_interval)
+        self.interval = max(self.interval, cost / self.cpu_share)
+        logging.debug('%i files polled in %.3f s, next poll in %.1f s',
+                      len(self.watched), cost, self.interval)
+        return changed
+
+    def watch(self, callback):
+        """
+        Call a function on each batch of changes, until interrupted.
+
+        A batch ends with the first poll finding no new change.
+
+        :param callback: function called with the list of changed
+                         filepaths
+        """
+        batch = set()
+        while True:
+            time.sleep(self.interval)
+            changed = self.poll()
+            if changed:
+                batch.update(changed)
+            elif batch:
+                logging.info('%i files changed', len(batch))
+                callback(sorted(batch))
+                batch = set()
+                self.refresh()
@@ -17,4 +17,5 @@ setup(
     description  = "A build tool for (non?)-scientific figures",
     scripts      = ['example/scifig.py', 'tools/scifigextract.py'],
     packages     = ['libscifig'],
+    python_requires = '>=3.8',
 )
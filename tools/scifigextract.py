@@ -18,7 +18,8 @@
 
 import logging
 import argparse
-import re
+
+from libscifig.extract import get_graphics_paths, ScanCache, DEFAULT_CACHE
 
 logger = logging.getLogger()
 logger.setLevel(logging.ERROR)
@@ -28,29 +29,6 @@ steam_handler.setFormatter(formatter)
 logger.addHandler(steam_handler)
 
 
-def get_graphics_paths(texfilepath, uniquify=False):
-    """
-    Parse tex files and returns filepaths in \includegraphics{} latex
-    functions.
-
-    :param texfilepath: filepath for the texfile to parse
-    :param uniquify: uniquify the list
-    """
-    graphic_names = []
-    logger.debug('Read %s', texfilepath)
-    with open(texfilepath, 'r') as tex:
-        for line in tex.readlines():
-            graphics = re.findall('\includegraphics(\[.*?\]|){([a-zA-Z0-9\.\-_/]*)}', line)
-            if graphics != []:
-                logger.debug('regexp result: %s', graphics)
-
-            for graphic in graphics:
-                graphic_names.append(graphic[1])
-    if uniquify:
-        return list(set(graphic_names))
-    return graphic_names
-
-
 if __name__ == '__main__':
     description = 'Extract path from includegraphics in tex files'
     epilog = ''
@@ -67,6 +45,10 @@ if __name__ == '__main__':
     # scifigselect list
     list_parser = subparsers.add_parser('list', help='Extract paths and list')
     list_parser.add_argument('tex', help='Name') # multiple files?
+    list_parser.add_argument('--cache', default=DEFAULT_CACHE,
+                             help='Cache of parsed files (default: %(default)s)')
+    list_parser.add_argument('--no-cache', action='store_true',
+                             help='Do not use the cache')
     list_parser.set_defaults(action='list')
 
     args = parser.parse_args()
@@ -86,7 +68,9 @@ if __name__ == '__main__':
 
     try:
         if args.action == 'list':
-            graphics = get_graphics_paths(args.tex)
+            cache = ScanCache(None if args.no_cache else args.cache)
+            graphics = get_graphics_paths(args.tex, cache=cache)
+            cache.save()
             for graphic in graphics:
                 print(graphic)
     except AttributeError:
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+Run the tests from the source tree, without installing scifig.
+"""
+
+import os.path
+import sys
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+TOOLS = os.path.dirname(TESTS)
+# scifigextract, then libscifig
+sys.path.insert(0, TOOLS)
+sys.path.insert(0, os.path.dirname(TOOLS))
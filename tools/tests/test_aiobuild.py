@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import unittest
+
+from libscifig import aiobuild
+from libscifig.aiobuild import MemoryBudget
+
+
+class test_memory_budget(unittest.TestCase):
+
+    def test_admitted_in_order(self):
+        async def scenario():
+            budget = MemoryBudget(100, None)
+            await budget.acquire(80)
+            waiting = asyncio.ensure_future(budget.acquire(50))
+            await asyncio.sleep(0)
+            self.assertFalse(waiting.done())
+            budget.release(80)
+            await waiting
+            self.assertEqual((budget.used, budget.running), (50, 1))
+        asyncio.run(scenario())
+
+    def test_large_tool_alone(self):
+        async def scenario():
+            budget = MemoryBudget(100, None)
+            await budget.acquire(500)
+            self.assertEqual(budget.running, 1)
+        asyncio.run(scenario())
+
+    def test_cancelled_waiter(self):
+        async def scenario():
+            budget = MemoryBudget(100, None)
+            await budget.acquire(80)
+            cancelled = asyncio.ensure_future(budget.acquire(50))
+            waiting = asyncio.ensure_future(budget.acquire(60))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            # Released before the cancelled waiter wakes up
+            budget.release(80)
+            with self.assertRaises(asyncio.CancelledError):
+                await cancelled
+            await waiting
+            self.assertEqual(budget.waiters, [])
+            self.assertEqual((budget.used, budget.running), (60, 1))
+            budget.release(60)
+            self.assertEqual((budget.used, budget.running), (0, 0))
+        asyncio.run(scenario())
+
+
+class test_build(unittest.TestCase):
+
+    def test_generator_on_loop_thread(self):
+        threads = []
+
+        def stream():
+            # Reads and updates the database like Project.stream
+            threads.append(threading.get_ident())
+            return
+            yield
+
+        self.assertEqual(aiobuild.build(stream(), None, jobs=2), [])
+        self.assertEqual(threads, [threading.get_ident()])
+
+    def test_generator_error(self):
+        def stream():
+            raise FileNotFoundError('Tool not found: gnuplot')
+            yield
+
+        with self.assertRaises(FileNotFoundError):
+            aiobuild.build(stream(), None, jobs=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from libscifig import bundle
+from libscifig.database import CACHE_ID, DataBase
+from libscifig.task import TikzTask, product_filename
+
+TIKZ = '\\begin{tikzpicture}\n\\draw (0,0) -- (1,1);\n\\end{tikzpicture}\n'
+
+
+def built_task(db, directory, name):
+    """
+    Return a task whose pdf is built and not exported yet.
+    """
+    os.makedirs(os.path.join('src', directory), exist_ok=True)
+    filepath = os.path.join('src', directory, name + '.tikz')
+    with open(filepath, 'w') as fh:
+        fh.write(TIKZ)
+    task = TikzTask(filepath)
+    os.makedirs(task.buildpath, exist_ok=True)
+    with open(os.path.join(task.buildpath,
+                           product_filename(name, 'pdf')), 'wb') as fh:
+        fh.write(b'%PDF ' + filepath.encode())
+    db.set(task.id, 'targets', {'pdf': True, 'png': False})
+    db.set(task.id, 'export', {'pdf': True, 'png': False})
+    return task
+
+
+class test_bundle(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        self.db = DataBase('db.json')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_tar_members(self):
+        tasks = [built_task(self.db, 'a', 'a'), built_task(self.db, 'b', 'b')]
+        self.assertEqual(bundle.write_bundle(tasks, self.db, 'out.tar.gz'),
+                         2)
+        with tarfile.open('out.tar.gz') as archive:
+            self.assertEqual(archive.getnames(),
+                             ['pdf/a.pdf', 'pdf/b.pdf', bundle.MANIFEST])
+            content = archive.extractfile('pdf/a.pdf').read()
+            manifest = archive.extractfile(bundle.MANIFEST).read().decode()
+        self.assertIn('%s  pdf/a.pdf\n' % hashlib.sha256(content).hexdigest(),
+                      manifest)
+
+    def test_reuse_members(self):
+        tasks = [built_task(self.db, 'a', 'a'), built_task(self.db, 'b', 'b')]
+        bundle.write_bundle(tasks, self.db, 'out.tar.gz')
+        with self.assertLogs(level='INFO') as logs:
+            bundle.write_bundle(tasks, self.db, 'out.tar.gz')
+        self.assertIn('2 reused', logs.output[-1])
+        with tarfile.open('out.tar.gz') as archive:
+            self.assertEqual(archive.extractfile('pdf/b.pdf').read(),
+                             b'%PDF ' + os.path.join('src', 'b',
+                                                     'b.tikz').encode())
+
+    def test_interrupted(self):
+        tasks = [built_task(self.db, 'a', 'a'), built_task(self.db, 'b', 'b')]
+        bundle.write_bundle(tasks, self.db, 'out.tar.gz')
+        with open(os.path.join('build', 'src', 'b', 'b.pdf'), 'wb') as fh:
+            fh.write(b'%PDF new')
+        with mock.patch.object(bundle._TarWriter, 'add',
+                               side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                bundle.write_bundle(tasks, self.db, 'out.tar.gz')
+        self.assertEqual(self.db.get(CACHE_ID, 'bundles'), {})
+        self.assertEqual([name for name in os.listdir('.')
+                          if name.startswith('.bundle-')], [])
+        bundle.write_bundle(tasks, self.db, 'out.tar.gz')
+        with tarfile.open('out.tar.gz') as archive:
+            self.assertEqual(archive.extractfile('pdf/b.pdf').read(),
+                             b'%PDF new')
+
+    def test_zip_formats(self):
+        tasks = [built_task(self.db, 'a', 'a')]
+        self.assertEqual(bundle.write_bundle(tasks, self.db, 'out.zip',
+                                             formats=['png']), 0)
+        with zipfile.ZipFile('out.zip') as archive:
+            self.assertEqual(archive.namelist(), [bundle.MANIFEST])
+
+    def test_marked_exported(self):
+        tasks = [built_task(self.db, 'a', 'a')]
+        bundle.write_bundle(tasks, self.db, 'out.tar')
+        self.assertEqual(self.db.get(tasks[0].id, 'export'),
+                         {'pdf': False, 'png': False})
+
+    def test_same_name(self):
+        tasks = [built_task(self.db, 'a', 'plot'),
+                 built_task(self.db, 'b', 'plot')]
+        with self.assertRaisesRegex(bundle.BundleNameError, 'pdf/plot.pdf'):
+            bundle.write_bundle(tasks, self.db, 'out.tar')
+        self.assertFalse(os.path.exists('out.tar'))
+        self.assertTrue(self.db.get(tasks[0].id, 'export')['pdf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from libscifig.checksum import (ChecksumCache, GitIndex, calculate_checksum,
+                                read_git_index)
+
+
+def git(path, *args):
+    subprocess.run(['git', '-c', 'user.name=test',
+                    '-c', 'user.email=test@example.org'] + list(args),
+                   cwd=path, check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+
+
+@unittest.skipIf(shutil.which('git') is None, 'git is missing')
+class test_git_index(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmpdir, 'data.dat')
+        with open(self.data, 'w') as fh:
+            fh.write('1 2\n')
+        # Written before the index is read
+        os.utime(self.data, ns=(10**18, 10**18))
+        git(self.tmpdir, 'init', '-q')
+        git(self.tmpdir, 'add', 'data.dat')
+        git(self.tmpdir, 'commit', '-q', '-m', 'data')
+        self.md5 = calculate_checksum(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_checkout(self):
+        cache = ChecksumCache(git=GitIndex(self.tmpdir))
+        self.assertEqual(cache.checksum(self.data), self.md5)
+        # Checked out again: new mtime, same content
+        os.utime(self.data, ns=(15 * 10**17, 15 * 10**17))
+        cache.git = GitIndex(self.tmpdir)
+        with mock.patch('libscifig.checksum.calculate_checksum',
+                        side_effect=AssertionError('file read')):
+            self.assertEqual(cache.checksum(self.data), self.md5)
+        self.assertEqual(cache.data[self.data][1], 15 * 10**17)
+
+    def test_modified(self):
+        cache = ChecksumCache(git=GitIndex(self.tmpdir))
+        cache.checksum(self.data)
+        with open(self.data, 'w') as fh:
+            fh.write('3 4\n')
+        os.utime(self.data, ns=(15 * 10**17, 15 * 10**17))
+        cache.git = GitIndex(self.tmpdir)
+        self.assertNotEqual(cache.checksum(self.data), self.md5)
+
+    def test_modified_after_read(self):
+        cache = ChecksumCache(git=GitIndex(self.tmpdir))
+        cache.checksum(self.data)
+        # Same content in the index, but written meanwhile
+        os.utime(self.data, None)
+        with mock.patch('libscifig.checksum.calculate_checksum',
+                        return_value='read') as checksum:
+            self.assertEqual(cache.checksum(self.data), 'read')
+        checksum.assert_called_once_with(self.data)
+
+    def test_not_a_repository(self):
+        shutil.rmtree(os.path.join(self.tmpdir, '.git'))
+        self.assertIsNone(read_git_index(self.tmpdir))
+
+
+if __name__ == '__main__':
+    unittest.main()
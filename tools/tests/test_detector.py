@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from libscifig import detector
+from libscifig.project import Project
+from libscifig.toolchain import ToolNotFoundError
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w'):
+        pass
+
+
+class test_detection(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmpdir, 'src')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def detect(self, cache=None):
+        records = detector.detect_records(self.src, self.tmpdir,
+                                          cache=cache)
+        return sorted(os.path.relpath(record.filepath, self.src)
+                      for record in records)
+
+    def test_python_figures(self):
+        touch(os.path.join(self.src, 'fig', 'fig_plot.py'))
+        touch(os.path.join(self.src, 'fig', 'helpers.py'))
+        touch(os.path.join(self.src, 'fig', 'fig_plot_fr.po'))
+        self.assertEqual(self.detect(), ['fig/fig_plot.py',
+                                         'fig/fig_plot_fr.po'])
+
+    def test_modules_are_dependencies(self):
+        touch(os.path.join(self.src, 'fig', 'fig_plot.py'))
+        touch(os.path.join(self.src, 'fig', 'fig_other.py'))
+        touch(os.path.join(self.src, 'fig', 'helpers.py'))
+        touch(os.path.join(self.src, 'fig', 'lib', 'tools.py'))
+        records = detector.detect_records(self.src, self.tmpdir)
+        self.assertEqual(sorted(records[0].datafiles),
+                         [os.path.join('src', 'fig', 'helpers.py'),
+                          os.path.join('src', 'fig', 'lib', 'tools.py')])
+
+    def test_modules_do_not_mark_directories(self):
+        # A package of helpers holding figures
+        touch(os.path.join(self.src, 'lib', '__init__.py'))
+        touch(os.path.join(self.src, 'lib', 'fig', 'fig.tikz'))
+        self.assertEqual(detector.list_figdirs(self.src),
+                         [os.path.join(self.src, 'lib', 'fig')])
+        self.assertEqual(self.detect(), ['lib/fig/fig.tikz'])
+
+    def test_cache_of_other_rules(self):
+        touch(os.path.join(self.src, 'fig', 'fig_plot.py'))
+        touch(os.path.join(self.src, 'fig', 'helpers.py'))
+        directory = os.path.join(self.src, 'fig')
+        cache = {}
+        self.detect(cache)
+        # Scanned by an older version, helpers.py was a figure
+        cache[directory]['specs'].append(
+            {'kind': 'python',
+             'filepath': os.path.join(directory, 'helpers.py'),
+             'datafiles': []})
+        del cache[detector.CACHE_SIGNATURE]
+        self.assertEqual(self.detect(cache), ['fig/fig_plot.py'])
+        self.assertIn(detector.CACHE_SIGNATURE, cache)
+
+
+class test_project_detection(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ('a', 'b'):
+            touch(os.path.join(self.tmpdir, 'src', name, name + '.tikz'))
+        touch(os.path.join(self.tmpdir, 'src', 'a', 'a_fr.po'))
+        self.project = Project(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reuse_unchanged_directories(self):
+        first = self.project.detect()
+        tasks = self.project.select()
+        self.assertEqual(len(first), 3)
+        second = self.project.detect()
+        self.assertEqual([id(r) for r in first], [id(r) for r in second])
+        # A translation and its task share the task instance
+        again = self.project.select()
+        self.assertEqual([id(t) for t in tasks], [id(t) for t in again])
+        self.assertIs(again[1].task, again[0])
+
+        # A new file in b: b is scanned again, a is reused
+        touch(os.path.join(self.tmpdir, 'src', 'b', 'b2.tikz'))
+        os.utime(os.path.join(self.tmpdir, 'src', 'b'), ns=(0, 0))
+        third = self.project.detect()
+        self.assertEqual(len(third), 4)
+        self.assertEqual([id(r) for r in third[:2]],
+                         [id(r) for r in first[:2]])
+        self.assertIsNot(third[2], first[2])
+
+    def test_tools_checked_first(self):
+        tools = {tool: sys.executable
+                 for tool in ('pdflatex', 'pdf2svg', 'gs', 'gnuplot')}
+        tools['pdftops'] = os.path.join(self.tmpdir, 'missing')
+        project = Project(self.tmpdir, tools=tools)
+        with self.assertRaisesRegex(ToolNotFoundError, 'pdftops'):
+            next(project.stream())
+        # Before any directory is scanned
+        self.assertEqual(project.records, [])
+
+    def test_tools_of_kinds_checked_first(self):
+        touch(os.path.join(self.tmpdir, 'src', 'c', 'c.plt'))
+        tools = {tool: sys.executable
+                 for tool in ('pdflatex', 'pdf2svg', 'gs', 'pdftops')}
+        tools['gnuplot'] = os.path.join(self.tmpdir, 'missing')
+        project = Project(self.tmpdir, tools=tools)
+        with self.assertRaisesRegex(ToolNotFoundError, 'gnuplot'):
+            next(project.stream())
+        # Before the tikz figures are yielded
+        self.assertEqual(project.tasks, [])
+
+    def test_status_runs_no_tool(self):
+        marker = os.path.join(self.tmpdir, 'ran')
+        tool = os.path.join(self.tmpdir, 'tool')
+        with open(tool, 'w') as fh:
+            fh.write('#!/bin/sh\ntouch %s\necho 1.0\n' % marker)
+        os.chmod(tool, 0o755)
+        tools = {name: tool for name in ('pdflatex', 'lualatex', 'pdf2svg',
+                                         'pdftops', 'gs', 'gnuplot')}
+        report = Project(self.tmpdir, tools=tools).status()
+        self.assertEqual(len(report), 3)
+        self.assertTrue(all(task['outdated'] for task in report))
+        self.assertFalse(os.path.exists(marker))
+
+    def test_force(self):
+        first = self.project.detect()
+        second = self.project.detect(force=True)
+        self.assertFalse(set(map(id, first)) & set(map(id, second)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from libscifig import distributed
+from libscifig.database import DataBase
+from libscifig.task import TikzTask
+
+TOKEN = 'secret'
+TIKZ = '\\begin{tikzpicture}\n\\draw (0,0) -- (1,1);\n\\end{tikzpicture}\n'
+
+
+class _Killed(BaseException):
+    """
+    Stop a worker as if its process was killed.
+    """
+
+
+def fake_builder(name, built, delay=0, die=False):
+    """
+    Return a builder recording the tasks it builds.
+    """
+    def builder(spec, files, pdf_only):
+        time.sleep(delay)
+        if die:
+            raise _Killed()
+        figure = os.path.splitext(os.path.basename(spec['filepath']))[0]
+        built.append((name, figure))
+        return ({'engine': 'pdflatex', 'tools': {'pdflatex': name}},
+                [(figure + '.tex', b'tex'), (figure + '.pdf', b'%PDF')])
+    return builder
+
+
+def start_worker(builder):
+    """
+    Start a worker on localhost.
+
+    :returns: server
+    """
+    server = distributed.WorkerServer(('127.0.0.1', 0), TOKEN,
+                                      builder=builder)
+
+    def serve():
+        try:
+            server.serve_forever()
+        except _Killed:
+            server.server_close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server
+
+
+class test_coordinator(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        self.tasks = []
+        for name in ('a', 'b', 'c'):
+            os.makedirs(os.path.join('src', name))
+            filepath = os.path.join('src', name, name + '.tikz')
+            with open(filepath, 'w') as fh:
+                fh.write(TIKZ)
+            self.tasks.append(TikzTask(filepath))
+        self.db = DataBase('db.json')
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_worker_killed(self):
+        built = []
+        # The first task goes to the slow worker, which dies
+        # once the fast worker is idle
+        dying = start_worker(fake_builder('dying', built,
+                                          delay=0.5, die=True))
+        live = start_worker(fake_builder('live', built))
+        self.servers = [dying, live]
+        coordinator = distributed.Coordinator([dying.server_address,
+                                               live.server_address],
+                                              TOKEN, timeout=10)
+        failed = coordinator.build(self.tasks, self.db, pdf_only=True)
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(built), [('live', 'a'), ('live', 'b'),
+                                         ('live', 'c')])
+        for task in self.tasks:
+            self.assertFalse(task.needs_build(self.db, pdf_only=True))
+            # Version of the tool of the worker
+            self.assertEqual(self.db.get(task.id, 'deps')['TOOL:pdflatex'],
+                             'live')
+
+    def test_invalid_token(self):
+        built = []
+        worker = start_worker(fake_builder('worker', built))
+        self.servers = [worker]
+        coordinator = distributed.Coordinator([worker.server_address],
+                                              'wrong', timeout=10)
+        failed = coordinator.build(self.tasks[:1], self.db, pdf_only=True)
+        self.assertEqual(failed, self.tasks[:1])
+        self.assertEqual(built, [])
+
+    def test_token_needed(self):
+        with self.assertRaises(ValueError):
+            distributed.WorkerServer(('127.0.0.1', 0), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from libscifig.database import DataBase
+from libscifig.task import CAPACITY_ERROR, TikzTask
+from libscifig.toolchain import Toolchain
+
+TIKZ = '\\begin{tikzpicture}\n\\draw (0,0) -- (1,1);\n\\end{tikzpicture}\n'
+
+# Fake LaTeX engine, logging its calls in calls.log
+ENGINE = """#!%(python)s
+import os, sys
+if '--version' in sys.argv:
+    print('%(name)s fake')
+    sys.exit(0)
+with open(%(log)r, 'a') as fh:
+    fh.write('%(name)s\\n')
+if %(full)r:
+    print('! %(error)s!')
+    sys.exit(1)
+tex = sys.argv[-1]
+with open(os.path.splitext(tex)[0] + '.pdf', 'w') as fh:
+    fh.write('%%PDF')
+"""
+
+
+class test_engine_fallback(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        self.log = os.path.join(self.tmpdir, 'calls.log')
+        tools = {}
+        for name, full in (('pdflatex', True), ('lualatex', False)):
+            tools[name] = os.path.join(self.tmpdir, name)
+            with open(tools[name], 'w') as fh:
+                fh.write(ENGINE % {'python': sys.executable, 'name': name,
+                                   'log': self.log, 'full': full,
+                                   'error': CAPACITY_ERROR})
+            os.chmod(tools[name], 0o755)
+        self.toolchain = Toolchain(tools)
+        os.makedirs(os.path.join('src', 'a'))
+        self.source = os.path.join('src', 'a', 'a.tikz')
+        with open(self.source, 'w') as fh:
+            fh.write(TIKZ)
+        self.db = DataBase('db.json')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def build(self):
+        task = TikzTask(self.source)
+        task.use_toolchain(self.toolchain)
+        task.make_pdf(self.db)
+        return task
+
+    def calls(self):
+        with open(self.log) as fh:
+            return fh.read().split()
+
+    def test_capacity_exceeded(self):
+        task = self.build()
+        self.assertEqual(self.calls(), ['pdflatex', 'lualatex'])
+        self.assertTrue(os.path.isfile(os.path.join(task.buildpath,
+                                                    'a.pdf')))
+        self.assertEqual(self.db.get(task.id, 'engine'),
+                         {'name': 'lualatex', 'requested': 'pdflatex'})
+
+        # The next build starts with lualatex
+        with open(self.source, 'a') as fh:
+            fh.write('% edited\n')
+        self.build()
+        self.assertEqual(self.calls(), ['pdflatex', 'lualatex', 'lualatex'])
+
+
+if __name__ == '__main__':
+    unittest.main()
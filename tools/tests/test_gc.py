@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from libscifig.database import DataBase
+from libscifig.project import Project
+
+TIKZ = '\\begin{tikzpicture}\n\\draw (0,0) -- (1,1);\n\\end{tikzpicture}\n'
+
+
+def touch(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fh:
+        fh.write(content)
+
+
+class test_collect_garbage(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        with DataBase('db.json') as db:
+            for task_id in ('ID:src/a/plot.tikz', 'ID:src/a/plot.v2.tikz',
+                            'ID:src/old/old.tikz'):
+                db.set(task_id, 'targets', {'pdf': True, 'png150': True})
+            for dep in ('./src/a/plot.tikz', './src/a/plot.v2.tikz',
+                        './src/old/old.tikz'):
+                db.checksums.data[dep] = [1, 1, 'md5']
+        touch('src/a/plot.v2.tikz', TIKZ)
+        for filename in ('plot.tex', 'plot.pdf', 'plot-150dpi.png',
+                         'plot.v2.tex', 'plot.v2.pdf', 'plot.v2-150dpi.png',
+                         'data.dat'):
+            touch(os.path.join('build', 'src', 'a', filename))
+        touch('build/src/old/old.pdf')
+        touch('build/unknown/file.pdf')
+        touch('export/pdf/plot.pdf')
+        touch('export/pdf/plot.v2.pdf')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_stale_tasks(self):
+        result = Project('.').collect_garbage(dest='export')
+        self.assertEqual(sorted(result['tasks']),
+                         ['ID:src/a/plot.tikz', 'ID:src/old/old.tikz'])
+        self.assertEqual(sorted(os.listdir('build/src/a')),
+                         ['data.dat', 'plot.v2-150dpi.png', 'plot.v2.pdf',
+                          'plot.v2.tex'])
+        self.assertFalse(os.path.exists('build/src/old'))
+        # Not recorded in the database
+        self.assertTrue(os.path.exists('build/unknown/file.pdf'))
+        self.assertEqual(os.listdir('export/pdf'), ['plot.v2.pdf'])
+
+        db = DataBase('db.json')
+        db.load()
+        self.assertEqual(sorted(key for key in db.data
+                                if key.startswith('ID:')),
+                         ['ID:src/a/plot.v2.tikz'])
+        self.assertEqual(list(db.checksums.data), ['./src/a/plot.v2.tikz'])
+
+    def test_dry_run(self):
+        result = Project('.').collect_garbage(dry_run=True)
+        self.assertEqual(len(result['tasks']), 2)
+        self.assertTrue(os.path.exists('build/src/a/plot.pdf'))
+        self.assertTrue(os.path.exists('build/src/old/old.pdf'))
+        db = DataBase('db.json')
+        db.load()
+        self.assertIn('ID:src/old/old.tikz', db.data)
+        self.assertEqual(len(db.checksums.data), 3)
+
+    def test_other_directory(self):
+        # The build dir of the current directory is not the project's
+        touch('other/src/b/b.tikz', TIKZ)
+        touch('other/build/mine/mine.pdf')
+        os.chdir('other')
+        try:
+            Project(self.tmpdir).collect_garbage()
+        finally:
+            os.chdir(self.tmpdir)
+        self.assertTrue(os.path.exists('build/src/old/old.pdf'))
+        self.assertTrue(os.path.exists('build/src/a/plot.pdf'))
+        self.assertTrue(os.path.exists('other/build/mine/mine.pdf'))
+
+    def test_project_in_subdirectory(self):
+        # Run from the parent directory of the project
+        touch('proj/src/b/b.tikz', TIKZ)
+        touch('proj/build/src/b/b.pdf')
+        touch('proj/build/src/gone/gone.pdf')
+        with DataBase('proj/db.json') as db:
+            for task_id in ('ID:proj/src/b/b.tikz',
+                            'ID:proj/src/gone/gone.tikz'):
+                db.set(task_id, 'targets', {'pdf': True})
+        result = Project('proj').collect_garbage()
+        self.assertEqual(result['tasks'], ['ID:proj/src/gone/gone.tikz'])
+        self.assertFalse(os.path.exists('proj/build/src/gone'))
+        self.assertTrue(os.path.exists('proj/build/src/b/b.pdf'))
+
+
+if __name__ == '__main__':
+    unittest.main()
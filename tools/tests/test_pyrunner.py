@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from libscifig import pyrunner
+
+SCRIPT = 'import helpers\nprint(helpers.NAME)\n'
+
+
+class test_run_script(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.scripts = []
+        for name in ('a', 'b'):
+            directory = os.path.join(self.tmpdir, name)
+            os.makedirs(directory)
+            with open(os.path.join(directory, 'helpers.py'), 'w') as fh:
+                fh.write('NAME = %r\n' % name)
+            script = os.path.join(directory, 'fig_%s.py' % name)
+            with open(script, 'w') as fh:
+                fh.write(SCRIPT)
+            self.scripts.append(script)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_own_modules(self):
+        path = list(sys.path)
+        outputs = [pyrunner.run_script(script, os.path.dirname(script))
+                   for script in self.scripts]
+        self.assertEqual(outputs, [('a\n', ''), ('b\n', '')])
+        self.assertNotIn('helpers', sys.modules)
+        self.assertEqual(sys.path, path)
+
+    def test_failure(self):
+        with open(self.scripts[0], 'a') as fh:
+            fh.write('raise RuntimeError("broken")\n')
+        stdout, stderr = pyrunner.run_script(self.scripts[0], self.tmpdir)
+        self.assertEqual(stdout, 'a\n')
+        self.assertIn('RuntimeError: broken', stderr)
+        self.assertNotEqual(os.getcwd(), self.tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
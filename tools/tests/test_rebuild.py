@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from libscifig import detector
+from libscifig.database import DataBase
+from libscifig.toolchain import Toolchain
+
+TIKZ = '\\begin{tikzpicture}\n\\draw (0,0) -- (1,1);\n\\end{tikzpicture}\n'
+
+
+def fake_build(task, db, targets):
+    """
+    Write the products of a task and record the build,
+    as if the tools had run and the figure was exported.
+    """
+    task.check_dependencies(db)
+    os.makedirs(task.buildpath, exist_ok=True)
+    for filename in task.products(targets).values():
+        with open(os.path.join(task.buildpath, filename), 'w') as fh:
+            fh.write(filename)
+    task.rawpdf_md5 = 'md5'
+    task.record_build(db, targets)
+    db.set(task.id, 'export', {})
+
+
+class test_settings(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        os.makedirs(os.path.join('src', 'a'))
+        with open(os.path.join('src', 'a', 'a.tikz'), 'w') as fh:
+            fh.write(TIKZ)
+        self.db = DataBase('db.json')
+        # No tool version: the settings only are compared
+        self.toolchain = Toolchain(local=False)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def record(self, **options):
+        specs = detector.scan_directory(os.path.join('src', 'a'), '.')
+        return detector.create_records(specs, **options)[0]
+
+    def check(self, record, outdated, pdf_only=True):
+        """
+        Check that the record and its task agree.
+        """
+        task = record.expand()
+        task.use_toolchain(self.toolchain)
+        self.assertEqual(record.is_current(self.db, self.toolchain,
+                                           pdf_only=pdf_only), not outdated)
+        self.assertEqual(task.needs_build(self.db, pdf_only=pdf_only),
+                         outdated)
+        self.assertEqual(task.explain(self.db, pdf_only=pdf_only)['outdated'],
+                         outdated)
+        return task
+
+    def test_pdf_optimize_toggled(self):
+        optimized = self.record(pdf_optimize=True)
+        task = self.check(optimized, True)
+        fake_build(task, self.db, ['tex', 'pdf'])
+        self.check(optimized, False)
+
+        # The optimized pdf must be replaced
+        plain = self.record()
+        task = self.check(plain, True)
+        self.assertEqual(task.plan(self.db, pdf_only=True), ['tex', 'pdf'])
+        fake_build(task, self.db, ['tex', 'pdf'])
+        self.check(plain, False)
+        self.check(optimized, True)
+
+    def test_pdf_optimize_enabled(self):
+        plain = self.record()
+        fake_build(plain.expand(), self.db, ['tex', 'pdf'])
+        self.check(plain, False)
+        task = self.check(self.record(pdf_optimize=True), True)
+        self.assertEqual(task.plan(self.db, pdf_only=True), ['tex', 'pdf'])
+
+    def test_svg_precision(self):
+        record = self.record(svg_precision=3)
+        task = record.expand()
+        fake_build(task, self.db, task.targets())
+        self.check(record, False, pdf_only=False)
+        self.check(self.record(svg_precision=2), True, pdf_only=False)
+        self.check(self.record(svg_precision=3, svgz=True), True,
+                   pdf_only=False)
+        # Without optimized svg, nothing to build
+        self.check(self.record(), False, pdf_only=False)
+
+    def test_png_settings(self):
+        record = self.record()
+        task = record.expand()
+        fake_build(task, self.db, task.targets())
+        self.check(record, False, pdf_only=False)
+        task = self.check(self.record(png_dpi=(300,)), True, pdf_only=False)
+        self.assertEqual(task.plan(self.db), ['png'])
+        # The pdf does not depend on the png settings
+        self.check(self.record(png_dpi=(300,)), False)
+        fake_build(task, self.db, ['png'])
+        self.check(self.record(png_dpi=(300,)), False, pdf_only=False)
+
+
+class test_partial_rebuild(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        os.makedirs(os.path.join('src', 'a'))
+        with open(os.path.join('src', 'a', 'a.tikz'), 'w') as fh:
+            fh.write(TIKZ)
+        self.db = DataBase('db.json')
+        specs = detector.scan_directory(os.path.join('src', 'a'), '.')
+        self.task = detector.create_tasks(specs, png_dpi=(600, 150),
+                                          svg_precision=3)[0]
+        self.task.use_toolchain(Toolchain(local=False))
+        fake_build(self.task, self.db, self.task.targets())
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def product(self, target):
+        return os.path.join(self.task.buildpath,
+                            self.task.products([target])[target])
+
+    def test_intact(self):
+        self.assertEqual(self.task.plan(self.db), [])
+        # Touched, same content
+        os.utime(self.product('pdf'), ns=(0, 0))
+        self.assertEqual(self.task.plan(self.db), [])
+
+    def test_missing(self):
+        os.remove(self.product('eps'))
+        self.assertEqual(self.task.plan(self.db), ['eps'])
+        self.assertEqual(self.task.explain(self.db)['reasons'],
+                         ['missing: eps'])
+
+    def test_modified(self):
+        with open(self.product('svg'), 'w') as fh:
+            fh.write('edited')
+        self.assertEqual(self.task.plan(self.db), ['svg'])
+        # Optimized from the svg
+        with open(self.product('svgmin'), 'w') as fh:
+            fh.write('edited')
+        self.assertEqual(self.task.plan(self.db), ['svg', 'svgmin'])
+
+    def test_variant(self):
+        os.remove(self.product('png150'))
+        # Downscaled from the png
+        self.assertEqual(self.task.plan(self.db), ['png', 'png150'])
+
+    def test_new_sources(self):
+        with open(os.path.join('src', 'a', 'a.tikz'), 'a') as fh:
+            fh.write('% edited\n')
+        self.assertEqual(self.task.plan(self.db), self.task.targets())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,8 +18,14 @@
 
 import unittest
 import tempfile
+import os
+import os.path
 
-from scifigextract import get_graphics_paths
+from scifigextract import get_graphics_paths, ScanCache
+from libscifig.extract import select_tasks
+from libscifig.detector import TaskRecord
+from libscifig.extract import select_tasks
+from libscifig.detector import TaskRecord
 
 class test_get_graphics_paths(unittest.TestCase):
 
@@ -27,7 +33,7 @@ class test_get_graphics_paths(unittest.TestCase):
         #Prepare the tex file
         temp = tempfile.mkstemp()[1]
         with open(temp, 'w') as tmp:
-            tex = """
+            tex = r"""
             \includegraphics{foo.pdf}
             \includegraphics{fig/toto.pdf}
             \includegraphics[scale=2]{fig/tutu.eps}
@@ -52,7 +58,7 @@ class test_get_graphics_paths(unittest.TestCase):
         #Prepare the tex file
         temp = tempfile.mkstemp()[1]
         with open(temp, 'w') as tmp:
-            tex = """
+            tex = r"""
             \includegraphics[scale=2]{fig/foo.eps}\includegraphics[scale=2]{fig/bar.eps}
 
             """
@@ -69,7 +75,7 @@ class test_get_graphics_paths(unittest.TestCase):
         #Prepare the tex file
         temp = tempfile.mkstemp()[1]
         with open(temp, 'w') as tmp:
-            tex = """
+            tex = r"""
             \includegraphics[scale=2]{fig/foo.eps}
             \includegraphics[scale=2]{fig/bar.eps}
             \includegraphics[scale=1]{fig/foo.eps}
@@ -88,7 +94,7 @@ class test_get_graphics_paths(unittest.TestCase):
         #Prepare the tex file
         temp = tempfile.mkstemp()[1]
         with open(temp, 'w') as tmp:
-            tex = """
+            tex = r"""
             \includegraphics[scale=2]{fig/foo.eps}
             \includegraphics[scale=2]{fig/bar.eps}
             \includegraphics[scale=1]{fig/foo.eps}
@@ -102,3 +108,124 @@ class test_get_graphics_paths(unittest.TestCase):
             result = get_graphics_paths(temp, uniquify=True)
 
         self.assertEqual(sorted(expected), sorted(result))
+
+
+class test_get_graphics_paths_recursive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'chapters'))
+        self.main = os.path.join(self.tmpdir, 'main.tex')
+        with open(self.main, 'w') as tmp:
+            tmp.write(r"""
+            \includegraphics{fig/first.pdf}
+            \input{chapters/one}
+            \include{chapters/two.tex}
+            \includegraphics{fig/last.pdf}
+            """)
+        with open(os.path.join(self.tmpdir, 'chapters', 'one.tex'), 'w') as tmp:
+            tmp.write(r"""
+            \includegraphics[width=3cm]{fig/one.pdf}
+            \input{chapters/three}
+            """)
+        with open(os.path.join(self.tmpdir, 'chapters', 'two.tex'), 'w') as tmp:
+            tmp.write(r"\includegraphics{fig/two.pdf}")
+        with open(os.path.join(self.tmpdir, 'chapters', 'three.tex'), 'w') as tmp:
+            tmp.write(r"\includegraphics{fig/three.pdf}\input{main}")
+
+    def test_includes_in_order(self):
+        expected = ['fig/first.pdf',
+                    'fig/one.pdf',
+                    'fig/three.pdf',
+                    'fig/two.pdf',
+                    'fig/last.pdf']
+        result = get_graphics_paths(self.main, cache=ScanCache())
+        self.assertEqual(expected, result)
+
+    def test_not_recursive(self):
+        expected = ['fig/first.pdf', 'fig/last.pdf']
+        result = get_graphics_paths(self.main, recursive=False,
+                                    cache=ScanCache())
+        self.assertEqual(expected, result)
+
+    def test_cache(self):
+        cache_path = os.path.join(self.tmpdir, 'cache.json')
+        cache = ScanCache(cache_path)
+        get_graphics_paths(self.main, cache=cache)
+        cache.save()
+
+        # Reloaded cache is used
+        cache = ScanCache(cache_path)
+        self.assertEqual(len(cache.data), 4)
+        result = get_graphics_paths(self.main, cache=cache)
+        self.assertFalse(cache.modified)
+        self.assertIn('fig/two.pdf', result)
+
+        # Modified files are parsed again
+        with open(os.path.join(self.tmpdir, 'chapters', 'two.tex'), 'w') as tmp:
+            tmp.write(r"\includegraphics{fig/two-bis.pdf}")
+        result = get_graphics_paths(self.main, cache=cache)
+        self.assertTrue(cache.modified)
+        self.assertIn('fig/two-bis.pdf', result)
+        self.assertNotIn('fig/two.pdf', result)
+
+    def test_cache_absolute_keys(self):
+        cache = ScanCache()
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.tmpdir)
+            get_graphics_paths('main.tex', cache=cache)
+            self.assertIn(self.main, cache.data)
+            # Another main.tex, in another directory
+            os.chdir(os.path.join(self.tmpdir, 'chapters'))
+            with open('main.tex', 'w') as tmp:
+                tmp.write(r"\includegraphics{fig/other.pdf}")
+            result = get_graphics_paths('main.tex', cache=cache)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(result, ['fig/other.pdf'])
+
+    def test_comments(self):
+        with open(self.main, 'w') as tmp:
+            tmp.write(r"""
+            \includegraphics{fig/first.pdf}
+            % \input{chapters/one}
+            \includegraphics{fig/last.pdf} % \includegraphics{fig/old.pdf}
+            100\% \include{chapters/two}
+            """)
+        expected = ['fig/first.pdf', 'fig/last.pdf', 'fig/two.pdf']
+        result = get_graphics_paths(self.main, cache=ScanCache())
+        self.assertEqual(expected, result)
+
+
+class test_select_tasks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.main = os.path.join(self.tmpdir, 'main.tex')
+        self.tasks = [TaskRecord('tikz', os.path.join('src', path))
+                      for path in ('a/plot.tikz', 'b/plot.tikz',
+                                   'b/plot.v2.tikz', 'c/other.tikz')]
+
+    def select(self, tex):
+        with open(self.main, 'w') as tmp:
+            tmp.write(tex)
+        selected = select_tasks(self.tasks, [self.main], cache=ScanCache())
+        return [task.filepath for task in selected]
+
+    def test_relative_path(self):
+        result = self.select(r"\includegraphics{figures/b/plot.pdf}")
+        self.assertEqual(result, [os.path.join('src', 'b', 'plot.tikz')])
+
+    def test_name_only(self):
+        result = self.select(r"\includegraphics{plot}")
+        self.assertEqual(result, [os.path.join('src', 'a', 'plot.tikz'),
+                                  os.path.join('src', 'b', 'plot.tikz')])
+
+    def test_dotted_name(self):
+        result = self.select(r"\includegraphics{pdf/plot.v2.pdf}"
+                             r"\includegraphics{plot.v2}")
+        self.assertEqual(result, [os.path.join('src', 'b', 'plot.v2.tikz')])
+
+    def test_no_task(self):
+        self.assertEqual(self.select(r"\includegraphics{photo.jpg}"), [])
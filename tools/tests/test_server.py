@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from libscifig import server
+from libscifig.project import Project
+
+
+class test_server(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'src'))
+        self.project = Project(self.tmpdir)
+        self.path = server.socket_path(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_live_server_kept(self):
+        live = server.BuildServer(self.project, self.path)
+        threading.Thread(target=live.serve_forever, daemon=True).start()
+        try:
+            with self.assertRaises(RuntimeError):
+                server.serve(self.project)
+            answer = server.request(self.tmpdir, {'command': 'rescan'})
+            self.assertEqual(answer, {'status': 'ok', 'tasks': 0})
+        finally:
+            live.shutdown()
+            live.server_close()
+
+    def test_dead_server_replaced(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+        thread = threading.Thread(target=server.serve, args=(self.project,),
+                                  daemon=True)
+        thread.start()
+        answer = None
+        for _ in range(50):
+            answer = server.request(self.tmpdir, {'command': 'rescan'})
+            if answer is not None:
+                break
+            thread.join(0.1)
+        self.assertEqual(answer, {'status': 'ok', 'tasks': 0})
+
+    def test_database_written_meanwhile(self):
+        build_server = server.BuildServer(self.project, self.path)
+        self.addCleanup(build_server.server_close)
+        self.project.db.save()
+        # gc in another process
+        other = Project(self.tmpdir)
+        other.db.set('ID:src/a/a.tikz', 'targets', {'pdf': True})
+        other.db.save()
+        build_server.answer({'command': 'status',
+                             'options': self.project.options()})
+        self.assertEqual(self.project.db.get('ID:src/a/a.tikz', 'targets'),
+                         {'pdf': True})
+
+    def test_options(self):
+        build_server = server.BuildServer(self.project, self.path)
+        self.addCleanup(build_server.server_close)
+        options = self.project.options()
+        build_server.check_options({'options': options})
+        with self.assertRaisesRegex(ValueError, 'engine'):
+            build_server.check_options({'options': dict(options,
+                                                        engine='lualatex')})
+        with self.assertRaisesRegex(ValueError, 'png_dpi, scratch'):
+            build_server.check_options({'options': dict(options,
+                                                        png_dpi=[300],
+                                                        scratch='/tmp')})
+
+
+if __name__ == '__main__':
+    unittest.main()
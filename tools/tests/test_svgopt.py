@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from libscifig import svgopt
+
+SVG = """<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg"
+     xmlns:xlink="http://www.w3.org/1999/xlink" width="10pt" height="10pt">
+  <defs>
+    <symbol id="glyph0-1">
+      <path d="M 1.00001 2.12345 L 3.5 4.5 Z"/>
+    </symbol>
+    <symbol id="glyph1-1">
+      <path d="M 1.00002 2.12349 L 3.5 4.5 Z"/>
+    </symbol>
+  </defs>
+  <g transform="matrix(0.0004,0,0,-0.0004,10.123456,20)">
+    <use xlink:href="#glyph0-1" x="1.23456" y="2"/>
+    <use xlink:href="#glyph1-1" x="3" y="4"/>
+  </g>
+</svg>
+"""
+
+
+class test_round(unittest.TestCase):
+
+    def test_round_numbers(self):
+        self.assertEqual(svgopt.round_numbers('M 1.23456 -0.0001 L 2e-1 3.10'),
+                         'M 1.235 0 L 0.2 3.1')
+        self.assertEqual(svgopt.round_numbers('1.23456', precision=1), '1.2')
+
+    def test_matrix(self):
+        self.assertEqual(
+            svgopt.round_transform('matrix(0.0004,0,0,0.0004,10,10)'),
+            'matrix(0.0004,0,0,0.0004,10,10)')
+        self.assertEqual(
+            svgopt.round_transform('matrix(1.234567 0 0 -1 10.12345 0.00001)'),
+            'matrix(1.235,0,0,-1,10.123,0)')
+
+    def test_significant_digits(self):
+        self.assertEqual(svgopt.round_transform('scale(0.000123456)'),
+                         'scale(0.000123)')
+        # Translations are coordinates
+        self.assertEqual(
+            svgopt.round_transform('translate(0.00001,3.33333) rotate(45.5)'),
+            'translate(0,3.333) rotate(45.5)')
+
+
+class test_optimize(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmpdir, 'fig.svg')
+        with open(self.src, 'w') as fh:
+            fh.write(SVG)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, root):
+        symbols = root.findall('.//{%s}symbol' % svgopt.SVG_NS)
+        self.assertEqual([symbol.get('id') for symbol in symbols],
+                         ['glyph0-1'])
+        self.assertEqual([use.get(svgopt.HREF)
+                          for use in root.iter('{%s}use' % svgopt.SVG_NS)],
+                         ['#glyph0-1', '#glyph0-1'])
+        group = root.find('{%s}g' % svgopt.SVG_NS)
+        self.assertEqual(group.get('transform'),
+                         'matrix(0.0004,0,0,-0.0004,10.123,20)')
+
+    def test_merged(self):
+        dst = os.path.join(self.tmpdir, 'fig.min.svg')
+        svgopt.optimize(self.src, dst)
+        self.check(ET.parse(dst).getroot())
+        self.assertLess(os.path.getsize(dst), os.path.getsize(self.src))
+
+    def test_compressed(self):
+        dst = os.path.join(self.tmpdir, 'fig.svgz')
+        svgopt.optimize(self.src, dst, compress=True)
+        with gzip.open(dst) as fh:
+            self.check(ET.parse(fh).getroot())
+
+
+if __name__ == '__main__':
+    unittest.main()
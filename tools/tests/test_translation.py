@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from libscifig.translation import read_po, translate
+
+PO = r'''# Translation of a figure
+msgid ""
+msgstr ""
+"Content-Type: text/plain; charset=UTF-8\n"
+
+#: fig.tikz:3
+msgid "Temperature $\\theta$"
+msgstr "Température $\\theta$"
+
+msgid "A \"quoted\" label"
+msgstr "Une étiquette \"citée\""
+
+msgid ""
+"A long "
+"label"
+msgstr ""
+"Une longue "
+"étiquette"
+
+msgid "Untranslated"
+msgstr ""
+
+#, fuzzy
+msgid "Fuzzy"
+msgstr "Approximatif"
+
+msgid "Tab\there"
+msgstr "Tabulation\tici"
+'''
+
+TEX = r'''\begin{tikzpicture}
+\draw (0,0) node[above] {Temperature $\theta$};
+\draw (1,0) node {A "quoted" label} -- (2,0);
+\node at (0,1) {A long label};
+\node at (0,2) {Untranslated};
+\node at (0,3) {Fuzzy};
+\node at (0,4) {Not in the catalog};
+\end{tikzpicture}
+'''
+
+
+class test_translation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.po = os.path.join(self.tmpdir, 'fig_fr.po')
+        with open(self.po, 'w', encoding='utf-8') as fh:
+            fh.write(PO)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_po(self):
+        catalog = read_po(self.po)
+        self.assertEqual(catalog, {
+            'Temperature $\\theta$': 'Température $\\theta$',
+            'A "quoted" label': 'Une étiquette "citée"',
+            'A long label': 'Une longue étiquette',
+            'Tab\there': 'Tabulation\tici',
+        })
+
+    def test_translate(self):
+        translated = translate(TEX, read_po(self.po))
+        self.assertEqual(translated, r'''\begin{tikzpicture}
+\draw (0,0) node[above] {Température $\theta$};
+\draw (1,0) node {Une étiquette "citée"} -- (2,0);
+\node at (0,1) {Une longue étiquette};
+\node at (0,2) {Untranslated};
+\node at (0,3) {Fuzzy};
+\node at (0,4) {Not in the catalog};
+\end{tikzpicture}
+''')
+
+    def test_empty_catalog(self):
+        self.assertEqual(translate(TEX, {}), TEX)
+
+
+if __name__ == '__main__':
+    unittest.main()
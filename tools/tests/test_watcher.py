@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from libscifig import watcher
+
+
+class _Stop(Exception):
+    """
+    Stop the watch loop.
+    """
+
+
+class test_watcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.paths = []
+        for name in ('a', 'b', 'c'):
+            self.paths.append(os.path.join(self.tmpdir, name))
+            self.touch(self.paths[-1], 1)
+        self.mtime = 1
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, path, mtime):
+        """
+        Write a file with a given modification time (s).
+        """
+        with open(path, 'w') as fh:
+            fh.write('x')
+        os.utime(path, ns=(mtime * 10**9, mtime * 10**9))
+
+    def edit(self, path):
+        self.mtime += 1
+        self.touch(path, self.mtime)
+
+    def test_snapshot(self):
+        missing = os.path.join(self.tmpdir, 'missing')
+        old = watcher.snapshot(self.paths + [missing])
+        self.assertIsNone(old[missing])
+        self.edit(self.paths[0])
+        os.remove(self.paths[1])
+        self.touch(missing, 1)
+        self.assertEqual(watcher.compare(old, watcher.snapshot(self.paths
+                                                               + [missing])),
+                         sorted([self.paths[0], self.paths[1], missing]))
+
+    def test_interval(self):
+        poller = watcher.PollingWatcher(lambda: self.paths, min_interval=1,
+                                        max_interval=4, cpu_share=1)
+        intervals = []
+        for step in range(4):
+            self.assertEqual(poller.poll(), [])
+            intervals.append(poller.interval)
+        self.assertEqual(intervals, [2, 4, 4, 4])
+        self.edit(self.paths[0])
+        self.assertEqual(poller.poll(), [self.paths[0]])
+        self.assertEqual(poller.interval, 1)
+
+    def test_cpu_share(self):
+        poller = watcher.PollingWatcher(lambda: self.paths, min_interval=1,
+                                        max_interval=4, cpu_share=1e-12)
+        # Polls using a CPU time
+        with mock.patch('libscifig.watcher.time.process_time',
+                        side_effect=[0, 1e-9]):
+            poller.poll()
+        self.assertGreater(poller.interval, 4)
+
+    def test_refresh_keeps_snapshot(self):
+        watched = self.paths[:2]
+        poller = watcher.PollingWatcher(lambda: watched)
+        # Changed while the previous batch was built
+        self.edit(self.paths[0])
+        watched = self.paths
+        poller.refresh()
+        self.assertEqual(poller.watched, self.paths)
+        self.assertEqual(poller.poll(), [self.paths[0]])
+
+    def test_batch(self):
+        poller = watcher.PollingWatcher(lambda: self.paths, min_interval=0,
+                                        max_interval=0)
+        # Files edited before each poll
+        edits = iter([[self.paths[0]], [self.paths[1]], [], [self.paths[2]],
+                      []])
+        batches = []
+
+        def sleep(interval):
+            try:
+                for path in next(edits):
+                    self.edit(path)
+            except StopIteration:
+                raise _Stop()
+
+        def callback(changed):
+            batches.append(changed)
+
+        with mock.patch('libscifig.watcher.time.sleep', sleep):
+            with self.assertRaises(_Stop):
+                poller.watch(callback)
+        self.assertEqual(batches, [self.paths[:2], self.paths[2:]])
+
+
+if __name__ == '__main__':
+    unittest.main()